@@ -6,7 +6,7 @@ import sys
 import time
 
 from channel import channel_factory
-from common import const
+from common import const, web_server
 from config import load_config
 from plugins import *
 import threading
@@ -18,6 +18,7 @@ def sigterm_handler_wrap(_signo):
     def func(_signo, _stack_frame):
         logger.info("signal {} received, exiting...".format(_signo))
         conf().save_user_datas()
+        web_server.stop_servers()
         if callable(old_handler):  #  check old_handler
             return old_handler(_signo, _stack_frame)
         sys.exit(0)
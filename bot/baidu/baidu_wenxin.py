@@ -1,6 +1,5 @@
 # encoding:utf-8
 
-import requests
 import json
 from common import const
 from bot.bot import Bot
@@ -8,6 +7,7 @@ from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common import http_client
 from config import conf
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
 
@@ -90,7 +90,7 @@ class BaiduWenxinBot(Bot):
                 'Content-Type': 'application/json'
             }
             payload = {'messages': session.messages, 'system': self.prompt} if self.prompt_enabled else {'messages': session.messages}
-            response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
+            response = http_client.request("POST", url, headers=headers, data=json.dumps(payload))
             response_text = json.loads(response.text)
             logger.info(f"[BAIDU] response text={response_text}")
             res_content = response_text["result"]
@@ -117,4 +117,4 @@ class BaiduWenxinBot(Bot):
         """
         url = "https://aip.baidubce.com/oauth/2.0/token"
         params = {"grant_type": "client_credentials", "client_id": BAIDU_API_KEY, "client_secret": BAIDU_SECRET_KEY}
-        return str(requests.post(url, params=params).json().get("access_token"))
+        return str(http_client.post(url, params=params).json().get("access_token"))
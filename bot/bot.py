@@ -5,6 +5,7 @@ Auto-replay chat robot abstract class
 
 from bridge.context import Context
 from bridge.reply import Reply
+from common.async_runtime import run_sync
 
 
 class Bot(object):
@@ -15,3 +16,11 @@ class Bot(object):
         :return: reply content
         """
         raise NotImplementedError
+
+    async def async_reply(self, query, context: Context = None) -> Reply:
+        """
+        bot auto-reply content in asyncio mode, falls back to reply() in a thread executor by default
+        :param req: received message
+        :return: reply content
+        """
+        return await run_sync(self.reply, query, context)
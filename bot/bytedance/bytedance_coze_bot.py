@@ -2,7 +2,6 @@
 import io
 import os
 from os.path import isfile
-import requests
 from urllib.parse import urlparse, unquote
 from bot.bot import Bot
 from bot.bytedance.coze_client import CozeClient
@@ -14,6 +13,7 @@ from config import conf
 from common import memory
 from common.utils import parse_markdown_text
 from common.tmp_dir import TmpDir
+from common import http_client
 from cozepy import MessageType,Message
 
 class ByteDanceCozeBot(Bot):
@@ -188,7 +188,7 @@ class ByteDanceCozeBot(Bot):
 
     def _download_image(self, url):
         try:
-            pic_res = requests.get(url, stream=True)
+            pic_res = http_client.get(url, stream=True)
             pic_res.raise_for_status()
             image_storage = io.BytesIO()
             size = 0
@@ -204,7 +204,7 @@ class ByteDanceCozeBot(Bot):
 
     def _download_file(self, url):
         try:
-            response = requests.get(url)
+            response = http_client.get(url)
             response.raise_for_status()
             parsed_url = urlparse(url)
             logger.debug(f"Downloading file from {url}")
@@ -212,7 +212,7 @@ class ByteDanceCozeBot(Bot):
             # 从路径中提取文件名
             file_name = url_path.split('/')[-1]
             logger.debug(f"Saving file as {file_name}")
-            file_path = os.path.join(TmpDir().path(), file_name)
+            file_path = TmpDir().file(file_name)
             with open(file_path, 'wb') as file:
                 file.write(response.content)
             return file_path
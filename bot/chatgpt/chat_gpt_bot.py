@@ -1,5 +1,6 @@
 # encoding:utf-8
 
+import asyncio
 import base64
 import time
 
@@ -12,11 +13,14 @@ from bot.chatgpt.chat_gpt_session import ChatGPTSession
 from bot.openai.open_ai_image import OpenAIImage
 from bot.openai.open_ai_vision import OpenAIVision
 from bot.session_manager import SessionManager
+from bot.stream_reply import is_stream_reply, iter_chunk_deltas, stream_completion
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.async_runtime import bind_openai_session, run_sync
 from common.log import logger
-from common.token_bucket import TokenBucket
+from common.token_bucket import get_token_bucket
 from common import memory, utils, const
+from common import http_client
 from config import conf, load_config
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
 
@@ -32,7 +36,7 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
         if proxy:
             openai.proxy = proxy
         if conf().get("rate_limit_chatgpt"):
-            self.tb4chatgpt = TokenBucket(conf().get("rate_limit_chatgpt", 20))
+            self.tb4chatgpt = get_token_bucket("chatgpt", conf().get("rate_limit_chatgpt", 20))
         conf_model = conf().get("model") or "gpt-3.5-turbo"
         self.sessions = SessionManager(ChatGPTSession, model=conf().get("model") or "gpt-3.5-turbo")
         # o1相关模型不支持system prompt，暂时用文心模型的session
@@ -57,53 +61,11 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
     def reply(self, query, context=None):
         # acquire reply content
         if context.type == ContextType.TEXT:
-            logger.info("[CHATGPT] query={}".format(query))
-
-            session_id = context["session_id"]
-            reply = None
-            clear_memory_commands = conf().get("clear_memory_commands", ["#清除记忆"])
-            if query in clear_memory_commands:
-                self.sessions.clear_session(session_id)
-                reply = Reply(ReplyType.INFO, "记忆已清除")
-            elif query == "#清除所有":
-                self.sessions.clear_all_session()
-                reply = Reply(ReplyType.INFO, "所有人记忆已清除")
-            elif query == "#更新配置":
-                load_config()
-                reply = Reply(ReplyType.INFO, "配置已更新")
+            reply, session, api_key, new_args = self._before_reply_text(query, context)
             if reply:
                 return reply
-            session = self.sessions.session_query(query, session_id)
-            logger.debug("[CHATGPT] session query={}".format(session.messages))
-
-            api_key = context.get("openai_api_key")
-            model = context.get("gpt_model")
-            new_args = None
-            if model:
-                new_args = self.args.copy()
-                new_args["model"] = model
-            # if context.get('stream'):
-            #     # reply in stream
-            #     return self.reply_text_stream(query, new_query, session_id)
-
-            reply_content = self.reply_text(session_id, session, api_key, args=new_args)
-            logger.debug(
-                "[CHATGPT] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
-                    session.messages,
-                    session_id,
-                    reply_content["content"],
-                    reply_content["completion_tokens"],
-                )
-            )
-            if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-            elif reply_content["completion_tokens"] > 0:
-                self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
-                reply = Reply(ReplyType.TEXT, reply_content["content"])
-            else:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-                logger.debug("[CHATGPT] reply {} used 0 tokens.".format(reply_content))
-            return reply
+            reply_content = self.reply_text(context["session_id"], session, api_key, args=new_args, context=context)
+            return self._after_reply_text(context["session_id"], session, reply_content)
 
         elif context.type == ContextType.IMAGE_CREATE:
             ok, retstring = self.create_img(query, 0, context=context)
@@ -117,12 +79,75 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
-    def reply_text(self, session_id: str, session: ChatGPTSession, api_key=None, args=None, retry_count=0) -> dict:
+    async def async_reply(self, query, context=None):
+        if context.type != ContextType.TEXT or is_stream_reply(context):
+            # 流式回复需要边接收边发送，仍在线程池中处理
+            return await super().async_reply(query, context)
+        reply, session, api_key, new_args = self._before_reply_text(query, context)
+        if reply:
+            return reply
+        reply_content = await self.async_reply_text(context["session_id"], session, api_key, args=new_args)
+        return self._after_reply_text(context["session_id"], session, reply_content)
+
+    def _before_reply_text(self, query, context):
+        """
+        处理管理命令并将query加入会话
+        :return: (命令的回复, session, api_key, 请求参数)，命令的回复不为空时直接返回给用户
+        """
+        logger.info("[CHATGPT] query={}".format(query))
+
+        session_id = context["session_id"]
+        reply = None
+        clear_memory_commands = conf().get("clear_memory_commands", ["#清除记忆"])
+        if query in clear_memory_commands:
+            self.sessions.clear_session(session_id)
+            reply = Reply(ReplyType.INFO, "记忆已清除")
+        elif query == "#清除所有":
+            self.sessions.clear_all_session()
+            reply = Reply(ReplyType.INFO, "所有人记忆已清除")
+        elif query == "#更新配置":
+            load_config()
+            reply = Reply(ReplyType.INFO, "配置已更新")
+        if reply:
+            return reply, None, None, None
+        session = self.sessions.session_query(query, session_id)
+        logger.debug("[CHATGPT] session query={}".format(session.messages))
+
+        api_key = context.get("openai_api_key")
+        model = context.get("gpt_model")
+        new_args = None
+        if model:
+            new_args = self.args.copy()
+            new_args["model"] = model
+        return None, session, api_key, new_args
+
+    def _after_reply_text(self, session_id, session, reply_content: dict) -> Reply:
+        logger.debug(
+            "[CHATGPT] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
+                session.messages,
+                session_id,
+                reply_content["content"],
+                reply_content["completion_tokens"],
+            )
+        )
+        if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+        elif reply_content["completion_tokens"] > 0:
+            self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
+            # 流式回复时前面的分段已经发送，只返回最后一段
+            reply = reply_content.get("final_reply") or Reply(ReplyType.TEXT, reply_content["content"])
+        else:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+            logger.debug("[CHATGPT] reply {} used 0 tokens.".format(reply_content))
+        return reply
+
+    def reply_text(self, session_id: str, session: ChatGPTSession, api_key=None, args=None, retry_count=0, context=None) -> dict:
         """
         call openai's ChatCompletion to get the answer
         :param session: a conversation session
         :param session_id: session id
         :param retry_count: retry count
+        :param context: 开启流式回复时用于边生成边发送
         :return: {}
         """
         try:
@@ -134,89 +159,122 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
             res = self.do_vision_completion_if_need(session_id, session.messages[-1]['content'])
             if res:
                 return res
+            if is_stream_reply(context):
+                response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, stream=True, **args)
+                return stream_completion(iter_chunk_deltas(response), context, tag="CHATGPT")
             response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, **args)
-            # logger.debug("[CHATGPT] response={}".format(response))
-            # logger.info("[ChatGPT] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            content = response.choices[0]["message"]["content"]
-            # fastgpt工具调用格式处理
-            if isinstance(content, list):
-                # {
-                #     "id": "",
-                #     "model": "",
-                #     "usage": {},
-                #     "choices": [
-                #         {
-                #             "message": {
-                #                 "role": "assistant",
-                #                 "content": [
-                #                     {
-                #                         "type": "tool",
-                #                         "tools": [
-                #                             {
-                #                                 "id": "xx",
-                #                                 "toolName": "HTTP请求",
-                #                                 "toolAvatar": "xx",
-                #                                 "functionName": "xx",
-                #                                 "params": "{\"key1\":\"xx\",\"key2\":\"xxx"}",
-                #                                 "response": "xxx"
-                #                             }
-                #                         ]
-                #                     },
-                #                     {
-                #                         "type": "text",
-                #                         "text": {
-                #                             "content": "xxx"
-                #                         }
-                #                     }
-                #                 ]
-                #             },
-                #             "finish_reason": "stop",
-                #             "index": 0
-                #         }
-                #     ]
-                # }
-                for item in content:
-                    if item["type"] == "text":
-                        content = item["text"]["content"]
-                        break
-            return {
-                "total_tokens": response["usage"]["total_tokens"],
-                "completion_tokens": response["usage"]["completion_tokens"],
-                "content": content,
-            }
+            return self._parse_completion(response)
         except Exception as e:
-            need_retry = retry_count < 2
-            result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-            if isinstance(e, openai.error.RateLimitError):
-                logger.warn("[CHATGPT] RateLimitError: {}".format(e))
-                result["content"] = "提问太快啦，请休息一下再问我吧"
-                if need_retry:
-                    time.sleep(20)
-            elif isinstance(e, openai.error.Timeout):
-                logger.warn("[CHATGPT] Timeout: {}".format(e))
-                result["content"] = "我没有收到你的消息"
-                if need_retry:
-                    time.sleep(5)
-            elif isinstance(e, openai.error.APIError):
-                logger.warn("[CHATGPT] Bad Gateway: {}".format(e))
-                result["content"] = "请再问我一次"
-                if need_retry:
-                    time.sleep(10)
-            elif isinstance(e, openai.error.APIConnectionError):
-                logger.warn("[CHATGPT] APIConnectionError: {}".format(e))
-                result["content"] = "我连接不到你的网络"
-                if need_retry:
-                    time.sleep(5)
-            else:
-                logger.exception("[CHATGPT] Exception: {}".format(e))
-                need_retry = False
-                self.sessions.clear_session(session.session_id)
+            result, retry_delay = self._handle_reply_text_error(e, session, retry_count)
+            if retry_delay is None:
+                return result
+            time.sleep(retry_delay)
+            logger.warn("[CHATGPT] 第{}次重试".format(retry_count + 1))
+            return self.reply_text(session_id, session, api_key, args, retry_count + 1, context)
 
-            if need_retry:
-                logger.warn("[CHATGPT] 第{}次重试".format(retry_count + 1))
-                return self.reply_text(session_id, session, api_key, args, retry_count + 1)
-            else:
+    async def async_reply_text(self, session_id: str, session: ChatGPTSession, api_key=None, args=None, retry_count=0) -> dict:
+        """
+        reply_text的异步版本，使用openai的acreate接口，等待回复时不占用线程
+        """
+        try:
+            if conf().get("rate_limit_chatgpt") and not await self.tb4chatgpt.acquire():
+                raise openai.error.RateLimitError("RateLimitError: rate limit exceeded")
+            if args is None:
+                args = self.args
+            if memory.USER_IMAGE_CACHE.get(session_id):
+                res = await run_sync(self.do_vision_completion_if_need, session_id, session.messages[-1]['content'])
+                if res:
+                    return res
+            bind_openai_session()
+            response = await openai.ChatCompletion.acreate(api_key=api_key, messages=session.messages, **args)
+            return self._parse_completion(response)
+        except Exception as e:
+            result, retry_delay = self._handle_reply_text_error(e, session, retry_count)
+            if retry_delay is None:
                 return result
+            await asyncio.sleep(retry_delay)
+            logger.warn("[CHATGPT] 第{}次重试".format(retry_count + 1))
+            return await self.async_reply_text(session_id, session, api_key, args, retry_count + 1)
+
+    def _parse_completion(self, response) -> dict:
+        # logger.debug("[CHATGPT] response={}".format(response))
+        # logger.info("[ChatGPT] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
+        content = response.choices[0]["message"]["content"]
+        # fastgpt工具调用格式处理
+        if isinstance(content, list):
+            # {
+            #     "id": "",
+            #     "model": "",
+            #     "usage": {},
+            #     "choices": [
+            #         {
+            #             "message": {
+            #                 "role": "assistant",
+            #                 "content": [
+            #                     {
+            #                         "type": "tool",
+            #                         "tools": [
+            #                             {
+            #                                 "id": "xx",
+            #                                 "toolName": "HTTP请求",
+            #                                 "toolAvatar": "xx",
+            #                                 "functionName": "xx",
+            #                                 "params": "{\"key1\":\"xx\",\"key2\":\"xxx"}",
+            #                                 "response": "xxx"
+            #                             }
+            #                         ]
+            #                     },
+            #                     {
+            #                         "type": "text",
+            #                         "text": {
+            #                             "content": "xxx"
+            #                         }
+            #                     }
+            #                 ]
+            #             },
+            #             "finish_reason": "stop",
+            #             "index": 0
+            #         }
+            #     ]
+            # }
+            for item in content:
+                if item["type"] == "text":
+                    content = item["text"]["content"]
+                    break
+        return {
+            "total_tokens": response["usage"]["total_tokens"],
+            "completion_tokens": response["usage"]["completion_tokens"],
+            "content": content,
+        }
+
+    def _handle_reply_text_error(self, e: Exception, session: ChatGPTSession, retry_count: int):
+        """
+        :return: (返回给用户的结果, 重试前的等待秒数)，不需要重试时等待秒数为None
+        """
+        need_retry = retry_count < 2
+        retry_delay = None
+        result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
+        if isinstance(e, openai.error.RateLimitError):
+            logger.warn("[CHATGPT] RateLimitError: {}".format(e))
+            result["content"] = "提问太快啦，请休息一下再问我吧"
+            retry_delay = 20
+        elif isinstance(e, openai.error.Timeout):
+            logger.warn("[CHATGPT] Timeout: {}".format(e))
+            result["content"] = "我没有收到你的消息"
+            retry_delay = 5
+        elif isinstance(e, openai.error.APIError):
+            logger.warn("[CHATGPT] Bad Gateway: {}".format(e))
+            result["content"] = "请再问我一次"
+            retry_delay = 10
+        elif isinstance(e, openai.error.APIConnectionError):
+            logger.warn("[CHATGPT] APIConnectionError: {}".format(e))
+            result["content"] = "我连接不到你的网络"
+            retry_delay = 5
+        else:
+            logger.exception("[CHATGPT] Exception: {}".format(e))
+            need_retry = False
+            self.sessions.clear_session(session.session_id)
+        return result, retry_delay if need_retry else None
 
 
 class AzureChatGPTBot(ChatGPTBot):
@@ -239,13 +297,13 @@ class AzureChatGPTBot(ChatGPTBot):
             headers = {"api-key": api_key, "Content-Type": "application/json"}
             try:
                 body = {"prompt": query, "size": conf().get("image_create_size", "256x256"),"n": 1}
-                submission = requests.post(url, headers=headers, json=body)
+                submission = http_client.post(url, headers=headers, json=body)
                 operation_location = submission.headers['operation-location']
                 status = ""
                 while (status != "succeeded"):
                     if retry_count > 3:
                         return False, "图片生成失败"
-                    response = requests.get(operation_location, headers=headers)
+                    response = http_client.get(operation_location, headers=headers)
                     status = response.json()['status']
                     retry_count += 1
                 image_url = response.json()['result']['data'][0]['url']
@@ -264,7 +322,7 @@ class AzureChatGPTBot(ChatGPTBot):
             headers = {"api-key": api_key, "Content-Type": "application/json"}
             try:
                 body = {"prompt": query, "size": conf().get("image_create_size", "1024x1024"), "quality": conf().get("dalle3_image_quality", "standard")}
-                response = requests.post(url, headers=headers, json=body)
+                response = http_client.post(url, headers=headers, json=body)
                 response.raise_for_status()  # 检查请求是否成功
                 data = response.json()
 
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from bot.session_manager import Session
 from common.log import logger
 from common import const
@@ -16,8 +18,27 @@ class ChatGPTSession(Session):
     def __init__(self, session_id, system_prompt=None, model="gpt-3.5-turbo"):
         super().__init__(session_id, system_prompt)
         self.model = model
+        # 每条消息的token数在加入会话时计算，与messages一一对应；为None表示需要重新计算（如计数出错）
+        self._token_counts = None
+        self._total_tokens = 0  # _token_counts之和，不含回复的引导token
         self.reset()
 
+    def reset(self):
+        super().reset()
+        self._recount()
+
+    def load_dict(self, data):
+        super().load_dict(data)
+        self._recount()
+
+    def add_query(self, query):
+        super().add_query(query)
+        self._count_last()
+
+    def add_reply(self, reply):
+        super().add_reply(reply)
+        self._count_last()
+
     def discard_exceeding(self, max_tokens, cur_tokens=None):
         precise = True
         try:
@@ -29,11 +50,11 @@ class ChatGPTSession(Session):
             logger.debug("Exception when counting tokens precisely for query: {}".format(e))
         while cur_tokens > max_tokens:
             if len(self.messages) > 2:
-                self.messages.pop(1)
+                self._pop_message(1)
             elif len(self.messages) == 2 and self.messages[1]["role"] == "assistant":
-                self.messages.pop(1)
+                tokens = self._pop_message(1)
                 if precise:
-                    cur_tokens = self.calc_tokens()
+                    cur_tokens -= tokens
                 else:
                     cur_tokens = cur_tokens - max_tokens
                 break
@@ -44,56 +65,115 @@ class ChatGPTSession(Session):
                 logger.debug("max_tokens={}, total_tokens={}, len(messages)={}".format(max_tokens, cur_tokens, len(self.messages)))
                 break
             if precise:
-                cur_tokens = self.calc_tokens()
+                cur_tokens = self._total_tokens + reply_priming_tokens(self.model)
             else:
                 cur_tokens = cur_tokens - max_tokens
         return cur_tokens
 
     def calc_tokens(self):
-        return num_tokens_from_messages(self.messages, self.model)
+        if self._token_counts is None or len(self._token_counts) != len(self.messages):
+            # 计数出错过，或messages被直接修改过
+            self._recount(strict=True)
+        return self._total_tokens + reply_priming_tokens(self.model)
+
+    def _recount(self, strict=False):
+        try:
+            self._token_counts = [num_tokens_from_message(message, self.model) for message in self.messages]
+            self._total_tokens = sum(self._token_counts)
+        except Exception as e:
+            self._token_counts = None
+            if strict:
+                raise
+            logger.debug("Exception when counting tokens for session: {}".format(e))
+
+    def _count_last(self):
+        if self._token_counts is None or len(self._token_counts) != len(self.messages) - 1:
+            self._token_counts = None  # 留到calc_tokens时重新计算
+            return
+        try:
+            tokens = num_tokens_from_message(self.messages[-1], self.model)
+        except Exception as e:
+            self._token_counts = None
+            logger.debug("Exception when counting tokens for message: {}".format(e))
+            return
+        self._token_counts.append(tokens)
+        self._total_tokens += tokens
+
+    def _pop_message(self, index):
+        """删除消息并从总数中减去它的token数，返回删除的token数（计数无效时为0）"""
+        self.messages.pop(index)
+        if self._token_counts is None or len(self._token_counts) != len(self.messages) + 1:
+            self._token_counts = None
+            return 0
+        tokens = self._token_counts.pop(index)
+        self._total_tokens -= tokens
+        return tokens
 
 
 # refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
 def num_tokens_from_messages(messages, model):
     """Returns the number of tokens used by a list of messages."""
-
-    if model in ["wenxin", "xunfei"] or model.startswith(const.GEMINI):
+    if _resolve_model(model) == "character":
         return num_tokens_by_character(messages)
+    return sum(num_tokens_from_message(message, model) for message in messages) + reply_priming_tokens(model)
 
-    import tiktoken
 
+def reply_priming_tokens(model):
+    if _resolve_model(model) == "character":
+        return 0
+    return 3  # every reply is primed with <|start|>assistant<|message|>
+
+
+def num_tokens_from_message(message, model):
+    """Returns the number of tokens used by a single message, excluding the reply priming tokens."""
+    model = _resolve_model(model)
+    if model == "character":
+        return len(message["content"])
+    encoding = _get_encoding(model)
+    if model == "gpt-3.5-turbo":
+        tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
+        tokens_per_name = -1  # if there's a name, the role is omitted
+    else:
+        tokens_per_message = 3
+        tokens_per_name = 1
+    num_tokens = tokens_per_message
+    for key, value in message.items():
+        num_tokens += len(encoding.encode(value))
+        if key == "name":
+            num_tokens += tokens_per_name
+    return num_tokens
+
+
+@lru_cache(maxsize=None)
+def _resolve_model(model):
+    """把模型名映射为计数方式：character（按字符计数）、gpt-3.5-turbo 或 gpt-4"""
+    if model in ["wenxin", "xunfei"] or model.startswith(const.GEMINI):
+        return "character"
     if model in ["gpt-3.5-turbo-0301", "gpt-35-turbo", "gpt-3.5-turbo-1106", "moonshot", const.LINKAI_35]:
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
+        return "gpt-3.5-turbo"
     elif model in ["gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0613", "gpt-3.5-turbo-0613",
                    "gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613", "gpt-35-turbo-16k", "gpt-4-turbo-preview",
                    "gpt-4-1106-preview", const.GPT4_TURBO_PREVIEW, const.GPT4_VISION_PREVIEW, const.GPT4_TURBO_01_25,
                    const.GPT_4o, const.GPT_4O_0806, const.GPT_4o_MINI, const.LINKAI_4o, const.LINKAI_4_TURBO]:
-        return num_tokens_from_messages(messages, model="gpt-4")
+        return "gpt-4"
     elif model.startswith("claude-3"):
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
+        return "gpt-3.5-turbo"
+    if model not in ["gpt-3.5-turbo", "gpt-4"]:
+        logger.debug(f"num_tokens_from_messages() is not implemented for model {model}. Returning num tokens assuming gpt-3.5-turbo.")
+        return "gpt-3.5-turbo"
+    return model
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model):
+    """tiktoken的编码对象创建开销较大，按模型缓存"""
+    import tiktoken
+
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
         logger.debug("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-    if model == "gpt-3.5-turbo":
-        tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
-        tokens_per_name = -1  # if there's a name, the role is omitted
-    elif model == "gpt-4":
-        tokens_per_message = 3
-        tokens_per_name = 1
-    else:
-        logger.debug(f"num_tokens_from_messages() is not implemented for model {model}. Returning num tokens assuming gpt-3.5-turbo.")
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
-    return num_tokens
+        return tiktoken.get_encoding("cl100k_base")
 
 
 def num_tokens_by_character(messages):
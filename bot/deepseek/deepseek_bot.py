@@ -1,13 +1,16 @@
 # encoding:utf-8
 
+import asyncio
 import time
 import openai
 
 from bot.bot import Bot
 from bot.deepseek.deepseek_session import DeepseekSession
 from bot.session_manager import SessionManager
+from bot.stream_reply import is_stream_reply, iter_chunk_deltas, stream_completion
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.async_runtime import bind_openai_session
 from common.log import logger
 from config import conf
 
@@ -43,64 +46,103 @@ class DeepseekBot(Bot):
         # 处理查询请求
         if context and context.type:
             if context.type == ContextType.TEXT:
-                logger.info("[DEEPSEEK] query={}".format(query))
-                session_id = context["session_id"]
-                reply = None
-                
-                if query == "#清除记忆":
-                    self.sessions.clear_session(session_id)
-                    reply = Reply(ReplyType.INFO, "记忆已清除")
+                reply, session = self._before_reply_text(query, context)
+                if reply:
                     return reply
-                    
-                session = self.sessions.session_query(query, session_id)
-                
-                reply_content = self.reply_text(session)
-                
-                if reply_content:
-                    # 将回复添加到会话中
-                    session.add_reply(reply_content)
-                    
-                    logger.info("[DEEPSEEK] new reply={}".format(reply_content))
-                    reply = Reply(ReplyType.TEXT, reply_content)
-                else:
-                    logger.error("[DEEPSEEK] reply content is empty")
-                    reply = Reply(ReplyType.ERROR, "对不起，我没有得到有效的回复。")
-                    
-                return reply
+                reply_content = self.reply_text(session, context=context)
+                return self._after_reply_text(session, reply_content)
             elif context.type == ContextType.IMAGE_CREATE:
                 # 不支持图像创建
                 reply = Reply(ReplyType.ERROR, "抱歉，Deepseek模型暂不支持图像创建。")
                 return reply
         return Reply(ReplyType.ERROR, "处理消息失败")
 
-    def reply_text(self, session: DeepseekSession, retry_count=0):
-        """使用Deepseek API生成回复"""
+    async def async_reply(self, query, context=None):
+        if not context or context.type != ContextType.TEXT or is_stream_reply(context):
+            # 流式回复需要边接收边发送，仍在线程池中处理
+            return await super().async_reply(query, context)
+        reply, session = self._before_reply_text(query, context)
+        if reply:
+            return reply
+        reply_content = await self.async_reply_text(session)
+        return self._after_reply_text(session, reply_content)
+
+    def _before_reply_text(self, query, context):
+        logger.info("[DEEPSEEK] query={}".format(query))
+        session_id = context["session_id"]
+
+        if query == "#清除记忆":
+            self.sessions.clear_session(session_id)
+            return Reply(ReplyType.INFO, "记忆已清除"), None
+
+        session = self.sessions.session_query(query, session_id)
+        return None, session
+
+    def _after_reply_text(self, session: DeepseekSession, reply_content):
+        final_reply = None
+        if isinstance(reply_content, dict):
+            # 流式回复时前面的分段已经发送，只返回最后一段
+            final_reply = reply_content["final_reply"]
+            reply_content = reply_content["content"]
+        if reply_content:
+            # 将回复添加到会话中
+            session.add_reply(reply_content)
+
+            logger.info("[DEEPSEEK] new reply={}".format(reply_content))
+            reply = final_reply or Reply(ReplyType.TEXT, reply_content)
+        else:
+            logger.error("[DEEPSEEK] reply content is empty")
+            reply = Reply(ReplyType.ERROR, "对不起，我没有得到有效的回复。")
+        return reply
+
+    def reply_text(self, session: DeepseekSession, retry_count=0, context=None):
+        """使用Deepseek API生成回复，开启流式回复时边生成边发送"""
         try:
-            messages = session.get_messages()
-            logger.debug("[DEEPSEEK] session messages={}".format(messages))
-            
+            if is_stream_reply(context):
+                response = openai.ChatCompletion.create(stream=True, **self._completion_args(session))
+                return stream_completion(iter_chunk_deltas(response), context, tag="DEEPSEEK")
             # 调用API获取回复 - 使用旧版本OpenAI API格式
-            response = openai.ChatCompletion.create(
-                model=self.args["model"],
-                messages=messages,
-                temperature=self.args["temperature"],
-                max_tokens=self.args["max_tokens"],
-                top_p=self.args["top_p"],
-                frequency_penalty=self.args["frequency_penalty"],
-                presence_penalty=self.args["presence_penalty"],
-                request_timeout=self.args["request_timeout"]
-            )
-            
+            response = openai.ChatCompletion.create(**self._completion_args(session))
+
             # 提取回复内容
             reply_content = response.choices[0].message.content
             return reply_content
-            
+
         except Exception as e:
             # 处理异常情况
             logger.error("[DEEPSEEK] Exception: {}".format(e))
             if retry_count < 2:
                 logger.warn("[DEEPSEEK] 第{}次重试".format(retry_count + 1))
                 time.sleep(3)
-                return self.reply_text(session, retry_count + 1)
+                return self.reply_text(session, retry_count + 1, context)
+            else:
+                return "抱歉，我遇到了问题，请稍后再试。"
+
+    async def async_reply_text(self, session: DeepseekSession, retry_count=0):
+        """reply_text的异步版本"""
+        try:
+            bind_openai_session()
+            response = await openai.ChatCompletion.acreate(**self._completion_args(session))
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.error("[DEEPSEEK] Exception: {}".format(e))
+            if retry_count < 2:
+                logger.warn("[DEEPSEEK] 第{}次重试".format(retry_count + 1))
+                await asyncio.sleep(3)
+                return await self.async_reply_text(session, retry_count + 1)
             else:
-                return "抱歉，我遇到了问题，请稍后再试。" 
\ No newline at end of file
+                return "抱歉，我遇到了问题，请稍后再试。"
+
+    def _completion_args(self, session: DeepseekSession) -> dict:
+        messages = session.get_messages()
+        logger.debug("[DEEPSEEK] session messages={}".format(messages))
+        return {
+            "model": self.args["model"],
+            "messages": messages,
+            "temperature": self.args["temperature"],
+            "max_tokens": self.args["max_tokens"],
+            "top_p": self.args["top_p"],
+            "frequency_penalty": self.args["frequency_penalty"],
+            "presence_penalty": self.args["presence_penalty"],
+            "request_timeout": self.args["request_timeout"],
+        }
@@ -12,12 +12,15 @@ from urllib.parse import urlparse, unquote
 from bot.bot import Bot
 from lib.dify.dify_client import DifyClient, ChatClient
 from bot.dify.dify_session import DifySession, DifySessionManager
+from bot.stream_reply import StreamReplySender, can_send_partial
 from bridge.context import ContextType, Context
 from bridge.reply import Reply, ReplyType
+from common.async_runtime import post_json, run_sync
 from common.log import logger
 from common import const, memory
 from common.utils import parse_markdown_text, print_red
 from common.tmp_dir import TmpDir
+from common import http_client
 from config import conf
 
 UNKNOWN_ERROR_MSG = "我暂时遇到了一些问题，请您稍后重试~"
@@ -30,51 +33,74 @@ class DifyBot(Bot):
     def reply(self, query, context: Context=None):
         # acquire reply content
         if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:
-            if context.type == ContextType.IMAGE_CREATE:
-                query = conf().get('image_create_prefix', ['画'])[0] + query
-            logger.info("[DIFY] query={}".format(query))
-            session_id = context["session_id"]
-            # TODO: 适配除微信以外的其他channel
-            channel_type = conf().get("channel_type", "wx")
-            user = None
-            if channel_type in ["wx", "wework", "gewechat"]:
-                user = context["msg"].other_user_nickname if context.get("msg") else "default"
-            elif channel_type in ["wechatcom_app", "wechatmp", "wechatmp_service", "wechatcom_service", "web"]:
-                user = context["msg"].other_user_id if context.get("msg") else "default"
-            else:
-                return Reply(ReplyType.ERROR, f"unsupported channel type: {channel_type}, now dify only support wx, wechatcom_app, wechatmp, wechatmp_service channel")
-            logger.debug(f"[DIFY] dify_user={user}")
-            user = user if user else "default" # 防止用户名为None，当被邀请进的群未设置群名称时用户名为None
-            session = self.sessions.get_session(session_id, user)
-            if context.get("isgroup", False):
-                # 群聊：根据是否是共享会话群来决定是否设置用户信息
-                if not context.get("is_shared_session_group", False):
-                    # 非共享会话群：设置发送者信息
-                    session.set_user_info(context["msg"].actual_user_id, context["msg"].actual_user_nickname)
-                else:
-                    # 共享会话群：不设置用户信息
-                    session.set_user_info('', '')
-                # 设置群聊信息
-                session.set_room_info(context["msg"].other_user_id, context["msg"].other_user_nickname)
-            else:
-                # 私聊：使用发送者信息作为用户信息，房间信息留空
-                session.set_user_info(context["msg"].other_user_id, context["msg"].other_user_nickname)
-                session.set_room_info('', '')
-
-            # 打印设置的session信息
-            logger.debug(f"[DIFY] Session user and room info - user_id: {session.get_user_id()}, user_name: {session.get_user_name()}, room_id: {session.get_room_id()}, room_name: {session.get_room_name()}")
-            logger.debug(f"[DIFY] session={session} query={query}")
-
+            query, session, reply = self._prepare_session(query, context)
+            if reply:
+                return reply
             reply, err = self._reply(query, session, context)
-            if err != None:
-                dify_error_reply = conf().get("dify_error_reply", None)
-                error_msg = dify_error_reply if dify_error_reply else err
-                reply = Reply(ReplyType.TEXT, error_msg)
-            return reply
+            self.sessions.save_session(session)
+            return self._wrap_error_reply(reply, err)
         else:
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
+    async def async_reply(self, query, context: Context=None):
+        if context.type != ContextType.TEXT and context.type != ContextType.IMAGE_CREATE:
+            return await super().async_reply(query, context)
+        query, session, reply = self._prepare_session(query, context)
+        if reply:
+            return reply
+        reply, err = await self._async_reply(query, session, context)
+        self.sessions.save_session(session)
+        return self._wrap_error_reply(reply, err)
+
+    def _prepare_session(self, query, context: Context):
+        """
+        准备dify会话
+        :return: (query, session, reply)，reply不为None时直接返回该回复
+        """
+        if context.type == ContextType.IMAGE_CREATE:
+            query = conf().get('image_create_prefix', ['画'])[0] + query
+        logger.info("[DIFY] query={}".format(query))
+        session_id = context["session_id"]
+        # TODO: 适配除微信以外的其他channel
+        channel_type = conf().get("channel_type", "wx")
+        user = None
+        if channel_type in ["wx", "wework", "gewechat"]:
+            user = context["msg"].other_user_nickname if context.get("msg") else "default"
+        elif channel_type in ["wechatcom_app", "wechatmp", "wechatmp_service", "wechatcom_service", "web"]:
+            user = context["msg"].other_user_id if context.get("msg") else "default"
+        else:
+            return query, None, Reply(ReplyType.ERROR, f"unsupported channel type: {channel_type}, now dify only support wx, wechatcom_app, wechatmp, wechatmp_service channel")
+        logger.debug(f"[DIFY] dify_user={user}")
+        user = user if user else "default" # 防止用户名为None，当被邀请进的群未设置群名称时用户名为None
+        session = self.sessions.get_session(session_id, user)
+        if context.get("isgroup", False):
+            # 群聊：根据是否是共享会话群来决定是否设置用户信息
+            if not context.get("is_shared_session_group", False):
+                # 非共享会话群：设置发送者信息
+                session.set_user_info(context["msg"].actual_user_id, context["msg"].actual_user_nickname)
+            else:
+                # 共享会话群：不设置用户信息
+                session.set_user_info('', '')
+            # 设置群聊信息
+            session.set_room_info(context["msg"].other_user_id, context["msg"].other_user_nickname)
+        else:
+            # 私聊：使用发送者信息作为用户信息，房间信息留空
+            session.set_user_info(context["msg"].other_user_id, context["msg"].other_user_nickname)
+            session.set_room_info('', '')
+
+        # 打印设置的session信息
+        logger.debug(f"[DIFY] Session user and room info - user_id: {session.get_user_id()}, user_name: {session.get_user_name()}, room_id: {session.get_room_id()}, room_name: {session.get_room_name()}")
+        logger.debug(f"[DIFY] session={session} query={query}")
+        return query, session, None
+
+    def _wrap_error_reply(self, reply, err):
+        if err != None:
+            dify_error_reply = conf().get("dify_error_reply", None)
+            error_msg = dify_error_reply if dify_error_reply else err
+            reply = Reply(ReplyType.TEXT, error_msg)
+        return reply
+
     # TODO: delete this function
     def _get_payload(self, query, session: DifySession, response_mode):
         # 输入的变量参考 wechat-assistant-pro：https://github.com/leochen-g/wechat-assistant-pro/issues/76
@@ -113,11 +139,75 @@ class DifyBot(Bot):
             logger.exception(error_info)
             return None, UNKNOWN_ERROR_MSG
 
+    async def _async_reply(self, query: str, session: DifySession, context: Context):
+        """_reply的异步版本，chatbot和workflow直接使用aiohttp请求，agent的流式响应仍在线程池中处理"""
+        try:
+            session.count_user_message()
+            dify_app_type = self._get_dify_conf(context, "dify_app_type", 'chatbot')
+            if dify_app_type == 'chatbot' or dify_app_type == 'chatflow':
+                return await self._async_handle_chatbot(query, session, context)
+            elif dify_app_type == 'agent':
+                return await run_sync(self._handle_agent, query, session, context)
+            elif dify_app_type == 'workflow':
+                return await self._async_handle_workflow(query, session, context)
+            else:
+                friendly_error_msg = "[DIFY] 请检查 config.json 中的 dify_app_type 设置，目前仅支持 agent, chatbot, chatflow, workflow"
+                return None, friendly_error_msg
+
+        except Exception as e:
+            error_info = f"[DIFY] Exception: {e}"
+            logger.exception(error_info)
+            return None, UNKNOWN_ERROR_MSG
+
+    async def _async_handle_chatbot(self, query: str, session: DifySession, context: Context):
+        if self._is_stream_reply(context):
+            # 流式回复需要边接收边发送，仍在线程池中处理
+            return await run_sync(self._handle_chatbot, query, session, context)
+        payload = self._get_payload(query, session, 'blocking')
+        files = await run_sync(self._get_upload_files, session, context)
+        data = {
+            "inputs": payload['inputs'],
+            "query": payload['query'],
+            "user": payload['user'],
+            "response_mode": payload['response_mode'],
+            "files": files
+        }
+        if payload['conversation_id']:
+            data["conversation_id"] = payload['conversation_id']
+        status_code, rsp_data = await self._async_post(context, "/chat-messages", data)
+        if status_code != 200:
+            return None, self._handle_async_error_response(payload, rsp_data, status_code)
+        # 下载图片、文件和发送中间消息都是阻塞操作，放到线程池中执行
+        return await run_sync(self._handle_chatbot_response, rsp_data, session, context)
+
+    async def _async_handle_workflow(self, query: str, session: DifySession, context: Context):
+        payload = self._get_workflow_payload(query, session)
+        status_code, rsp_data = await self._async_post(context, "/workflows/run", payload)
+        if status_code != 200:
+            return None, self._handle_async_error_response(payload, rsp_data, status_code)
+        return self._handle_workflow_response(rsp_data)
+
+    async def _async_post(self, context: Context, endpoint, data):
+        api_key = self._get_dify_conf(context, "dify_api_key", '')
+        api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        return await post_json(f"{api_base}{endpoint}", data, headers=headers)
+
+    def _handle_async_error_response(self, payload, rsp_data, status_code):
+        response_text = rsp_data if isinstance(rsp_data, str) else json.dumps(rsp_data, ensure_ascii=False)
+        error_info = f"[DIFY] payload={payload} response text={response_text} status_code={status_code}"
+        logger.warning(error_info)
+        return self._handle_error_response(response_text, status_code)
+
     def _handle_chatbot(self, query: str, session: DifySession, context: Context):
         api_key = self._get_dify_conf(context, "dify_api_key", '')
         api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
         chat_client = ChatClient(api_key, api_base)
-        response_mode = 'blocking'
+        stream = self._is_stream_reply(context)
+        response_mode = 'streaming' if stream else 'blocking'
         payload = self._get_payload(query, session, response_mode)
         files = self._get_upload_files(session, context)
         response = chat_client.create_chat_message(
@@ -149,7 +239,11 @@ class DifyBot(Bot):
         #     },
         #     "created_at": 1705407629
         # }
-        rsp_data = response.json()
+        if stream:
+            return self._handle_stream_response(response, session, context)
+        return self._handle_chatbot_response(response.json(), session, context)
+
+    def _handle_chatbot_response(self, rsp_data: dict, session: DifySession, context: Context):
         logger.debug("[DIFY] usage {}".format(rsp_data.get('metadata', {}).get('usage', 0)))
 
         answer = rsp_data['answer']
@@ -162,52 +256,14 @@ class DifyBot(Bot):
         if is_group:
             at_prefix = "@" + context["msg"].actual_user_nickname + "\n"
         for item in parsed_content[:-1]:
-            reply = None
-            if item['type'] == 'text':
-                content = at_prefix + item['content']
-                reply = Reply(ReplyType.TEXT, content)
-            elif item['type'] == 'image':
-                image_url = self._fill_file_base_url(item['content'])
-                image = self._download_image(image_url)
-                if image:
-                    reply = Reply(ReplyType.IMAGE, image)
-                else:
-                    reply = Reply(ReplyType.TEXT, f"图片链接：{image_url}")
-            elif item['type'] == 'file':
-                file_url = self._fill_file_base_url(item['content'])
-                file_path = self._download_file(file_url)
-                if file_path:
-                    reply = Reply(ReplyType.FILE, file_path)
-                else:
-                    reply = Reply(ReplyType.TEXT, f"文件链接：{file_url}")
+            reply = self._parsed_item_to_reply(item, at_prefix)
             logger.debug(f"[DIFY] reply={reply}")
             if reply and channel:
                 channel.send(reply, context)
         # parsed_content 没有数据时，直接不回复
         if not parsed_content:
             return None, None
-        final_item = parsed_content[-1]
-        final_reply = None
-        if final_item['type'] == 'text':
-            content = final_item['content']
-            if is_group:
-                at_prefix = "@" + context["msg"].actual_user_nickname + "\n"
-                content = at_prefix + content
-            final_reply = Reply(ReplyType.TEXT, final_item['content'])
-        elif final_item['type'] == 'image':
-            image_url = self._fill_file_base_url(final_item['content'])
-            image = self._download_image(image_url)
-            if image:
-                final_reply = Reply(ReplyType.IMAGE, image)
-            else:
-                final_reply = Reply(ReplyType.TEXT, f"图片链接：{image_url}")
-        elif final_item['type'] == 'file':
-            file_url = self._fill_file_base_url(final_item['content'])
-            file_path = self._download_file(file_url)
-            if file_path:
-                final_reply = Reply(ReplyType.FILE, file_path)
-            else:
-                final_reply = Reply(ReplyType.TEXT, f"文件链接：{file_url}")
+        final_reply = self._parsed_item_to_reply(parsed_content[-1])
 
         # 设置dify conversation_id, 依靠dify管理上下文
         if session.get_conversation_id() == '':
@@ -215,9 +271,30 @@ class DifyBot(Bot):
 
         return final_reply, None
 
+    def _parsed_item_to_reply(self, item: dict, at_prefix=""):
+        """把parse_markdown_text解析出的文本、图片、文件转换为Reply，图片和文件会先下载"""
+        reply = None
+        if item['type'] == 'text':
+            reply = Reply(ReplyType.TEXT, at_prefix + item['content'])
+        elif item['type'] == 'image':
+            image_url = self._fill_file_base_url(item['content'])
+            image = self._download_image(image_url)
+            if image:
+                reply = Reply(ReplyType.IMAGE, image)
+            else:
+                reply = Reply(ReplyType.TEXT, f"图片链接：{image_url}")
+        elif item['type'] == 'file':
+            file_url = self._fill_file_base_url(item['content'])
+            file_path = self._download_file(file_url)
+            if file_path:
+                reply = Reply(ReplyType.FILE, file_path)
+            else:
+                reply = Reply(ReplyType.TEXT, f"文件链接：{file_url}")
+        return reply
+
     def _download_file(self, url):
         try:
-            response = requests.get(url)
+            response = http_client.get(url)
             response.raise_for_status()
             parsed_url = urlparse(url)
             logger.debug(f"Downloading file from {url}")
@@ -225,7 +302,7 @@ class DifyBot(Bot):
             # 从路径中提取文件名
             file_name = url_path.split('/')[-1]
             logger.debug(f"Saving file as {file_name}")
-            file_path = os.path.join(TmpDir().path(), file_name)
+            file_path = TmpDir().file(file_name)
             with open(file_path, 'wb') as file:
                 file.write(response.content)
             return file_path
@@ -235,7 +312,7 @@ class DifyBot(Bot):
 
     def _download_image(self, url):
         try:
-            pic_res = requests.get(url, stream=True)
+            pic_res = http_client.get(url, stream=True)
             pic_res.raise_for_status()
             image_storage = io.BytesIO()
             size = 0
@@ -275,6 +352,8 @@ class DifyBot(Bot):
         # data: {"event": "agent_thought", "id": "8dcf3648-fbad-407a-85dd-73a6f43aeb9f", "task_id": "9cf1ddd7-f94b-459b-b942-b77b26c59e9b", "message_id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "position": 1, "thought": "", "observation": "", "tool": "dalle3", "tool_input": "{\"dalle3\": {\"prompt\": \"cute Japanese anime girl with white hair, blue eyes, bunny girl suit\"}}", "created_at": 1705639511, "message_files": [], "conversation_id": "c216c595-2d89-438c-b33c-aae5ddddd142"}
         # data: {"event": "agent_message", "id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "task_id": "9cf1ddd7-f94b-459b-b942-b77b26c59e9b", "message_id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "answer": "I have created an image of a cute Japanese", "created_at": 1705639511, "conversation_id": "c216c595-2d89-438c-b33c-aae5ddddd142"}
         # data: {"event": "message_end", "task_id": "9cf1ddd7-f94b-459b-b942-b77b26c59e9b", "id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "message_id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "conversation_id": "c216c595-2d89-438c-b33c-aae5ddddd142", "metadata": {"usage": {"prompt_tokens": 305, "prompt_unit_price": "0.001", "prompt_price_unit": "0.001", "prompt_price": "0.0003050", "completion_tokens": 97, "completion_unit_price": "0.002", "completion_price_unit": "0.001", "completion_price": "0.0001940", "total_tokens": 184, "total_price": "0.0002290", "currency": "USD", "latency": 1.771092874929309}}}
+        if self._is_stream_reply(context):
+            return self._handle_stream_response(response, session, context)
         msgs, conversation_id = self._handle_sse_response(response)
         channel = context.get("channel")
         # TODO: 适配除微信以外的其他channel
@@ -337,7 +416,9 @@ class DifyBot(Bot):
         #      }
         #  }
 
-        rsp_data = response.json()
+        return self._handle_workflow_response(response.json())
+
+    def _handle_workflow_response(self, rsp_data: dict):
         if 'data' not in rsp_data or 'outputs' not in rsp_data['data'] or 'text' not in rsp_data['data']['outputs']:
             error_info = f"[DIFY] Unexpected response format: {rsp_data}"
             logger.warning(error_info)
@@ -429,20 +510,64 @@ class DifyBot(Bot):
             logger.warning("Received an empty SSE event.")
             return None
 
-    # TODO: 异步返回events
-    def _handle_sse_response(self, response: requests.Response):
-        events = []
+    def _iter_sse_events(self, response: requests.Response):
+        """逐个返回已到达的SSE事件"""
         for line in response.iter_lines():
             if line:
                 decoded_line = line.decode('utf-8')
                 event = self._parse_sse_event(decoded_line)
                 if event:
-                    events.append(event)
+                    yield event
+
+    def _handle_stream_response(self, response: requests.Response, session: DifySession, context: Context):
+        """
+        边接收边发送：完整的句子、图片、文件一旦生成就通过channel发送，最后一段作为最终回复返回
+        """
+        sender = StreamReplySender(context, self._parsed_item_to_reply, tag="DIFY")
+        conversation_id = None
+        try:
+            for event in self._iter_sse_events(response):
+                event_name = event['event']
+                if event_name == 'agent_message' or event_name == 'message':
+                    if not conversation_id:
+                        conversation_id = event['conversation_id']
+                    sender.feed(event['answer'])
+                elif event_name == 'agent_thought':
+                    # 工具调用前后的文本各自成段
+                    sender.flush()
+                    logger.debug("[DIFY] agent_thought: {}".format(event))
+                elif event_name == 'message_file':
+                    if event.get('type') != 'image':
+                        logger.warning("[DIFY] unsupported message file type: {}".format(event))
+                    sender.add({'type': 'image', 'content': event['url']})
+                elif event_name == 'error':
+                    logger.error("[DIFY] error: {}".format(event))
+                    raise Exception(event)
+                elif event_name == 'message_end':
+                    logger.debug("[DIFY] message_end usage: {}".format(event.get('metadata', {}).get('usage')))
+                    break
+                elif event_name in ['message_replace', 'ping', 'workflow_started', 'node_started', 'node_finished', 'workflow_finished', 'tts_message', 'tts_message_end']:
+                    pass
+                else:
+                    logger.warning("[DIFY] unknown event: {}".format(event))
+        except Exception as e:
+            # 已经发送过分段时不再抛出，避免用户在部分回复之后又收到错误提示，用已收到的内容结束
+            if not sender.sent:
+                raise
+            logger.warning("[DIFY] stream interrupted after {} segments: {}".format(sender.sent, e))
 
+        if conversation_id and session.get_conversation_id() == '':
+            session.set_conversation_id(conversation_id)
+        return sender.finish(), None
+
+    def _is_stream_reply(self, context: Context):
+        return self._get_dify_conf(context, "stream_reply", False) and can_send_partial(context)
+
+    def _handle_sse_response(self, response: requests.Response):
         merged_message = []
         accumulated_agent_message = ''
         conversation_id = None
-        for event in events:
+        for event in self._iter_sse_events(response):
             event_name = event['event']
             if event_name == 'agent_message' or event_name == 'message':
                 accumulated_agent_message += event['answer']
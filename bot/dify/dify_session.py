@@ -1,4 +1,8 @@
+import time
+
 from common.expired_dict import ExpiredDict
+from common.log import logger
+from common.session_store import get_session_store
 from config import conf
 
 
@@ -58,15 +62,40 @@ class DifySession(object):
         
         self._user_message_counter += 1
 
+    def to_dict(self):
+        """持久化的会话数据"""
+        return {
+            "user": self._user,
+            "conversation_id": self._conversation_id,
+            "user_message_counter": self._user_message_counter,
+            "user_id": self._user_id,
+            "user_name": self._user_name,
+            "room_id": self._room_id,
+            "room_name": self._room_name,
+        }
+
+    def load_dict(self, data):
+        self._conversation_id = data.get("conversation_id", "")
+        self._user_message_counter = data.get("user_message_counter", 0)
+        self._user_id = data.get("user_id", "")
+        self._user_name = data.get("user_name", "")
+        self._room_id = data.get("room_id", "")
+        self._room_name = data.get("room_name", "")
+
 class DifySessionManager(object):
     def __init__(self, sessioncls, **session_kwargs):
-        if conf().get("expires_in_seconds"):
+        self.store = get_session_store()
+        if self.store:
+            # 启用持久化时内存中只保留最近活跃的会话，淘汰的会话首次访问时从存储中加载
+            sessions = ExpiredDict(conf().get("expires_in_seconds") or 3600, max_size=conf().get("session_cache_size", 10000))
+        elif conf().get("expires_in_seconds"):
             sessions = ExpiredDict(conf().get("expires_in_seconds"))
         else:
             sessions = dict()
         self.sessions = sessions
         self.sessioncls = sessioncls
         self.session_kwargs = session_kwargs
+        self.namespace = sessioncls.__name__
 
     def _build_session(self, session_id: str, user: str):
         """
@@ -76,10 +105,36 @@ class DifySessionManager(object):
             return self.sessioncls(session_id, user)
 
         if session_id not in self.sessions:
-            self.sessions[session_id] = self.sessioncls(session_id, user)
+            session = self._load_session(session_id, user)
+            if session is None:
+                session = self.sessioncls(session_id, user)
+            self.sessions[session_id] = session
         session = self.sessions[session_id]
         return session
 
+    def _load_session(self, session_id, user):
+        if not self.store:
+            return None
+        try:
+            item = self.store.load(self.namespace, session_id)
+        except Exception as e:
+            logger.warning("[DIFY] load session {} error: {}".format(session_id, e))
+            return None
+        if item is None:
+            return None
+        data, updated_at = item
+        expires_in_seconds = conf().get("expires_in_seconds")
+        if expires_in_seconds and time.time() - updated_at > expires_in_seconds:
+            return None
+        session = self.sessioncls(session_id, data.get("user") or user)
+        session.load_dict(data)
+        return session
+
+    def save_session(self, session):
+        """会话修改后调用，写入持久化存储（异步批量写入）"""
+        if self.store and session.get_session_id() is not None:
+            self.store.save(self.namespace, session.get_session_id(), session.to_dict())
+
     def get_session(self, session_id, user):
         session = self._build_session(session_id, user)
         return session
@@ -87,6 +142,10 @@ class DifySessionManager(object):
     def clear_session(self, session_id):
         if session_id in self.sessions:
             del self.sessions[session_id]
+        if self.store:
+            self.store.delete(self.namespace, session_id)
 
     def clear_all_session(self):
         self.sessions.clear()
+        if self.store:
+            self.store.clear(self.namespace)
@@ -12,8 +12,8 @@ from bridge.reply import Reply, ReplyType
 from common.log import logger
 from config import conf, load_config
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
-import requests
 from common import const
+from common import http_client
 
 
 # ZhipuAI对话模型API
@@ -107,7 +107,7 @@ class MinimaxBot(Bot):
             self.request_body["messages"].extend(session.messages)
             logger.info("[Minimax_AI] request_body={}".format(self.request_body))
             # logger.info("[Minimax_AI] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            res = requests.post(self.base_url, headers=headers, json=self.request_body)
+            res = http_client.post(self.base_url, headers=headers, json=self.request_body)
 
             # self.request_body["messages"].extend(response.json()["choices"][0]["messages"])
             if res.status_code == 200:
@@ -6,12 +6,13 @@ import openai
 import openai.error
 from bot.bot import Bot
 from bot.session_manager import SessionManager
+from bot.stream_reply import is_stream_reply, iter_sse_deltas, stream_completion
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common import http_client
 from config import conf, load_config
 from .modelscope_session import ModelScopeSession
-import requests
 
 
 # ModelScope对话模型API
@@ -61,8 +62,8 @@ class ModelScopeBot(Bot):
             if model:
                 new_args["model"] = model
 
-            if new_args["model"] == "Qwen/QwQ-32B":
-                reply_content = self.reply_text_stream(session, args=new_args)
+            if new_args["model"] == "Qwen/QwQ-32B" or is_stream_reply(context):
+                reply_content = self.reply_text_stream(session, args=new_args, context=context)
             else:
                 reply_content = self.reply_text(session, args=new_args)
 
@@ -82,7 +83,8 @@ class ModelScopeBot(Bot):
                     reply = Reply(ReplyType.TEXT, reply_content["content"])
             elif reply_content["completion_tokens"] > 0:
                 self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
-                reply = Reply(ReplyType.TEXT, reply_content["content"])
+                # 流式回复时前面的分段已经发送，只返回最后一段
+                reply = reply_content.get("final_reply") or Reply(ReplyType.TEXT, reply_content["content"])
             else:
                 reply = Reply(ReplyType.ERROR, reply_content["content"])
                 logger.debug("[MODELSCOPE_AI] reply {} used 0 tokens.".format(reply_content))
@@ -115,7 +117,7 @@ class ModelScopeBot(Bot):
             
             body = args
             body["messages"] = session.messages
-            res = requests.post(
+            res = http_client.post(
                 self.base_url,
                 headers=headers,
                 data=json.dumps(body)
@@ -167,12 +169,13 @@ class ModelScopeBot(Bot):
             else:
                 return result
 
-    def reply_text_stream(self, session: ModelScopeSession, args=None, retry_count=0) -> dict:
+    def reply_text_stream(self, session: ModelScopeSession, args=None, retry_count=0, context=None) -> dict:
         """
         call ModelScope's ChatCompletion to get the answer with stream response
         :param session: a conversation session
         :param session_id: session id
         :param retry_count: retry count
+        :param context: 开启流式回复时用于边生成边发送
         :return: {}
         """
         try:
@@ -185,25 +188,18 @@ class ModelScopeBot(Bot):
             body["messages"] = session.messages
             body["stream"] = True  # 启用流式响应
 
-            res = requests.post(
+            res = http_client.post(
                 self.base_url,
                 headers=headers,
                 data=json.dumps(body),
                 stream=True
             )
             if res.status_code == 200:
-                content = ""
-                for line in res.iter_lines():
-                    if line:
-                        decoded_line = line.decode('utf-8')
-                        if decoded_line.startswith("data: "):
-                            try:
-                                json_data = json.loads(decoded_line[6:])
-                                delta_content = json_data.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                                if delta_content:
-                                    content += delta_content
-                            except json.JSONDecodeError as e:
-                                pass
+                deltas = iter_sse_deltas(res)
+                if is_stream_reply(context):
+                    return stream_completion(deltas, context, tag="MODELSCOPE_AI")
+                # 模型只支持流式接口时，等待完整回复
+                content = "".join(deltas)
                 return {
                     "total_tokens": 1,  # 流式响应通常不返回token使用情况
                     "completion_tokens": 1,
@@ -236,7 +232,7 @@ class ModelScopeBot(Bot):
 
                 if need_retry:
                     time.sleep(3)
-                    return self.reply_text_stream(session, args, retry_count + 1)
+                    return self.reply_text_stream(session, args, retry_count + 1, context)
                 else:
                     return result
         except Exception as e:
@@ -244,7 +240,7 @@ class ModelScopeBot(Bot):
             need_retry = retry_count < 2
             result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
             if need_retry:
-                return self.reply_text_stream(session, args, retry_count + 1)
+                return self.reply_text_stream(session, args, retry_count + 1, context)
             else:
                 return result
     def create_img(self, query, retry_count=0):
@@ -265,7 +261,7 @@ class ModelScopeBot(Bot):
             json_payload = json.dumps(payload, ensure_ascii=False).encode('utf-8')
             
             # 使用 data 参数发送原始字符串（requests 会自动处理编码）
-            res = requests.post(url, headers=headers, data=json_payload)
+            res = http_client.post(url, headers=headers, data=json_payload)
             
             response_data = res.json()
             image_url = response_data['images'][0]['url']
@@ -1,17 +1,20 @@
 # encoding:utf-8
 
+import asyncio
 import time
 
 import openai
 import openai.error
 from bot.bot import Bot
 from bot.session_manager import SessionManager
+from bot.stream_reply import is_stream_reply, iter_sse_deltas, stream_completion
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.async_runtime import post_json
 from common.log import logger
+from common import http_client
 from config import conf, load_config
 from .moonshot_session import MoonshotSession
-import requests
 
 
 # ZhipuAI对话模型API
@@ -33,114 +36,168 @@ class MoonshotBot(Bot):
     def reply(self, query, context=None):
         # acquire reply content
         if context.type == ContextType.TEXT:
-            logger.info("[MOONSHOT_AI] query={}".format(query))
-
-            session_id = context["session_id"]
-            reply = None
-            clear_memory_commands = conf().get("clear_memory_commands", ["#清除记忆"])
-            if query in clear_memory_commands:
-                self.sessions.clear_session(session_id)
-                reply = Reply(ReplyType.INFO, "记忆已清除")
-            elif query == "#清除所有":
-                self.sessions.clear_all_session()
-                reply = Reply(ReplyType.INFO, "所有人记忆已清除")
-            elif query == "#更新配置":
-                load_config()
-                reply = Reply(ReplyType.INFO, "配置已更新")
+            reply, session, new_args = self._before_reply_text(query, context)
             if reply:
                 return reply
-            session = self.sessions.session_query(query, session_id)
-            logger.debug("[MOONSHOT_AI] session query={}".format(session.messages))
+            reply_content = self.reply_text(session, args=new_args, context=context)
+            return self._after_reply_text(session, context["session_id"], reply_content)
+        else:
+            reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
+            return reply
+
+    async def async_reply(self, query, context=None):
+        if context.type != ContextType.TEXT or is_stream_reply(context):
+            # 流式回复需要边接收边发送，仍在线程池中处理
+            return await super().async_reply(query, context)
+        reply, session, new_args = self._before_reply_text(query, context)
+        if reply:
+            return reply
+        reply_content = await self.async_reply_text(session, args=new_args)
+        return self._after_reply_text(session, context["session_id"], reply_content)
+
+    def _before_reply_text(self, query, context):
+        """
+        处理清除记忆等指令，并生成本次请求的session和参数
+        :return: (reply, session, args)，reply不为None时直接返回该回复
+        """
+        logger.info("[MOONSHOT_AI] query={}".format(query))
+
+        session_id = context["session_id"]
+        reply = None
+        clear_memory_commands = conf().get("clear_memory_commands", ["#清除记忆"])
+        if query in clear_memory_commands:
+            self.sessions.clear_session(session_id)
+            reply = Reply(ReplyType.INFO, "记忆已清除")
+        elif query == "#清除所有":
+            self.sessions.clear_all_session()
+            reply = Reply(ReplyType.INFO, "所有人记忆已清除")
+        elif query == "#更新配置":
+            load_config()
+            reply = Reply(ReplyType.INFO, "配置已更新")
+        if reply:
+            return reply, None, None
+        session = self.sessions.session_query(query, session_id)
+        logger.debug("[MOONSHOT_AI] session query={}".format(session.messages))
 
-            model = context.get("moonshot_model")
-            new_args = self.args.copy()
-            if model:
-                new_args["model"] = model
-            # if context.get('stream'):
-            #     # reply in stream
-            #     return self.reply_text_stream(query, new_query, session_id)
+        model = context.get("moonshot_model")
+        new_args = self.args.copy()
+        if model:
+            new_args["model"] = model
+        return None, session, new_args
 
-            reply_content = self.reply_text(session, args=new_args)
-            logger.debug(
-                "[MOONSHOT_AI] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
-                    session.messages,
-                    session_id,
-                    reply_content["content"],
-                    reply_content["completion_tokens"],
-                )
+    def _after_reply_text(self, session: MoonshotSession, session_id, reply_content: dict):
+        logger.debug(
+            "[MOONSHOT_AI] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
+                session.messages,
+                session_id,
+                reply_content["content"],
+                reply_content["completion_tokens"],
             )
-            if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-            elif reply_content["completion_tokens"] > 0:
-                self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
-                reply = Reply(ReplyType.TEXT, reply_content["content"])
-            else:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-                logger.debug("[MOONSHOT_AI] reply {} used 0 tokens.".format(reply_content))
-            return reply
+        )
+        if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+        elif reply_content["completion_tokens"] > 0:
+            self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
+            # 流式回复时前面的分段已经发送，只返回最后一段
+            reply = reply_content.get("final_reply") or Reply(ReplyType.TEXT, reply_content["content"])
         else:
-            reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
-            return reply
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+            logger.debug("[MOONSHOT_AI] reply {} used 0 tokens.".format(reply_content))
+        return reply
 
-    def reply_text(self, session: MoonshotSession, args=None, retry_count=0) -> dict:
+    def reply_text(self, session: MoonshotSession, args=None, retry_count=0, context=None) -> dict:
         """
         call openai's ChatCompletion to get the answer
         :param session: a conversation session
         :param session_id: session id
         :param retry_count: retry count
+        :param context: 开启流式回复时用于边生成边发送
         :return: {}
         """
         try:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": "Bearer " + self.api_key
-            }
             body = args
             body["messages"] = session.messages
+            stream = is_stream_reply(context)
+            if stream:
+                body["stream"] = True
             # logger.debug("[MOONSHOT_AI] response={}".format(response))
             # logger.info("[MOONSHOT_AI] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            res = requests.post(
+            res = http_client.post(
                 self.base_url,
-                headers=headers,
-                json=body
+                headers=self._get_headers(),
+                json=body,
+                stream=stream
             )
-            if res.status_code == 200:
-                response = res.json()
-                return {
-                    "total_tokens": response["usage"]["total_tokens"],
-                    "completion_tokens": response["usage"]["completion_tokens"],
-                    "content": response["choices"][0]["message"]["content"]
-                }
+            if stream and res.status_code == 200:
+                return stream_completion(iter_sse_deltas(res), context, tag="MOONSHOT_AI")
+            result, need_retry = self._parse_response(res.status_code, res.json(), retry_count)
+            if need_retry:
+                time.sleep(3)
+                return self.reply_text(session, args, retry_count + 1, context)
             else:
-                response = res.json()
-                error = response.get("error")
-                logger.error(f"[MOONSHOT_AI] chat failed, status_code={res.status_code}, "
-                             f"msg={error.get('message')}, type={error.get('type')}")
-
-                result = {"completion_tokens": 0, "content": "提问太快啦，请休息一下再问我吧"}
-                need_retry = False
-                if res.status_code >= 500:
-                    # server error, need retry
-                    logger.warn(f"[MOONSHOT_AI] do retry, times={retry_count}")
-                    need_retry = retry_count < 2
-                elif res.status_code == 401:
-                    result["content"] = "授权失败，请检查API Key是否正确"
-                elif res.status_code == 429:
-                    result["content"] = "请求过于频繁，请稍后再试"
-                    need_retry = retry_count < 2
-                else:
-                    need_retry = False
+                return result
+        except Exception as e:
+            logger.exception(e)
+            need_retry = retry_count < 2
+            result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
+            if need_retry:
+                return self.reply_text(session, args, retry_count + 1, context)
+            else:
+                return result
 
-                if need_retry:
-                    time.sleep(3)
-                    return self.reply_text(session, args, retry_count + 1)
-                else:
-                    return result
+    async def async_reply_text(self, session: MoonshotSession, args=None, retry_count=0) -> dict:
+        """reply_text的异步版本"""
+        try:
+            body = args
+            body["messages"] = session.messages
+            status_code, response = await post_json(self.base_url, body, headers=self._get_headers())
+            result, need_retry = self._parse_response(status_code, response, retry_count)
+            if need_retry:
+                await asyncio.sleep(3)
+                return await self.async_reply_text(session, args, retry_count + 1)
+            else:
+                return result
         except Exception as e:
             logger.exception(e)
             need_retry = retry_count < 2
             result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
             if need_retry:
-                return self.reply_text(session, args, retry_count + 1)
+                return await self.async_reply_text(session, args, retry_count + 1)
             else:
                 return result
+
+    def _get_headers(self):
+        return {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + self.api_key
+        }
+
+    def _parse_response(self, status_code, response: dict, retry_count):
+        """
+        解析接口响应
+        :return: (result, need_retry)
+        """
+        if status_code == 200:
+            return {
+                "total_tokens": response["usage"]["total_tokens"],
+                "completion_tokens": response["usage"]["completion_tokens"],
+                "content": response["choices"][0]["message"]["content"]
+            }, False
+        error = response.get("error")
+        logger.error(f"[MOONSHOT_AI] chat failed, status_code={status_code}, "
+                     f"msg={error.get('message')}, type={error.get('type')}")
+
+        result = {"completion_tokens": 0, "content": "提问太快啦，请休息一下再问我吧"}
+        need_retry = False
+        if status_code >= 500:
+            # server error, need retry
+            logger.warn(f"[MOONSHOT_AI] do retry, times={retry_count}")
+            need_retry = retry_count < 2
+        elif status_code == 401:
+            result["content"] = "授权失败，请检查API Key是否正确"
+        elif status_code == 429:
+            result["content"] = "请求过于频繁，请稍后再试"
+            need_retry = retry_count < 2
+        else:
+            need_retry = False
+        return result, need_retry
@@ -1,5 +1,8 @@
+import time
+
 from common.expired_dict import ExpiredDict
 from common.log import logger
+from common.session_store import get_session_store
 from config import conf
 
 
@@ -32,19 +35,32 @@ class Session(object):
     def discard_exceeding(self, max_tokens=None, cur_tokens=None):
         raise NotImplementedError
 
+    def to_dict(self):
+        """持久化的会话数据"""
+        return {"system_prompt": self.system_prompt, "messages": self.messages}
+
+    def load_dict(self, data):
+        self.system_prompt = data.get("system_prompt", self.system_prompt)
+        self.messages = data.get("messages", [])
+
     def calc_tokens(self):
         raise NotImplementedError
 
 
 class SessionManager(object):
     def __init__(self, sessioncls, **session_args):
-        if conf().get("expires_in_seconds"):
+        self.store = get_session_store()
+        if self.store:
+            # 启用持久化时内存中只保留最近活跃的会话，淘汰的会话首次访问时从存储中加载
+            sessions = ExpiredDict(conf().get("expires_in_seconds") or 3600, max_size=conf().get("session_cache_size", 10000))
+        elif conf().get("expires_in_seconds"):
             sessions = ExpiredDict(conf().get("expires_in_seconds"))
         else:
             sessions = dict()
         self.sessions = sessions
         self.sessioncls = sessioncls
         self.session_args = session_args
+        self.namespace = sessioncls.__name__
 
     def build_session(self, session_id, system_prompt=None):
         """
@@ -55,12 +71,43 @@ class SessionManager(object):
             return self.sessioncls(session_id, system_prompt, **self.session_args)
 
         if session_id not in self.sessions:
-            self.sessions[session_id] = self.sessioncls(session_id, system_prompt, **self.session_args)
+            session = self._load_session(session_id)
+            if session is None:
+                session = self.sessioncls(session_id, system_prompt, **self.session_args)
+                self.save_session(session)
+            elif system_prompt is not None:
+                session.set_system_prompt(system_prompt)
+                self.save_session(session)
+            self.sessions[session_id] = session
         elif system_prompt is not None:  # 如果有新的system_prompt，更新并重置session
             self.sessions[session_id].set_system_prompt(system_prompt)
+            self.save_session(self.sessions[session_id])
         session = self.sessions[session_id]
         return session
 
+    def save_session(self, session):
+        """会话修改后调用，写入持久化存储（异步批量写入）"""
+        if self.store and session.session_id is not None:
+            self.store.save(self.namespace, session.session_id, session.to_dict())
+
+    def _load_session(self, session_id):
+        if not self.store:
+            return None
+        try:
+            item = self.store.load(self.namespace, session_id)
+        except Exception as e:
+            logger.warning("[SessionManager] load session {} error: {}".format(session_id, e))
+            return None
+        if item is None:
+            return None
+        data, updated_at = item
+        expires_in_seconds = conf().get("expires_in_seconds")
+        if expires_in_seconds and time.time() - updated_at > expires_in_seconds:
+            return None
+        session = self.sessioncls(session_id, data.get("system_prompt"), **self.session_args)
+        session.load_dict(data)
+        return session
+
     def session_query(self, query, session_id):
         session = self.build_session(session_id)
         session.add_query(query)
@@ -70,6 +117,7 @@ class SessionManager(object):
             logger.debug("prompt tokens used={}".format(total_tokens))
         except Exception as e:
             logger.warning("Exception when counting tokens precisely for prompt: {}".format(str(e)))
+        self.save_session(session)
         return session
 
     def session_reply(self, reply, session_id, total_tokens=None):
@@ -81,11 +129,16 @@ class SessionManager(object):
             logger.debug("raw total_tokens={}, savesession tokens={}".format(total_tokens, tokens_cnt))
         except Exception as e:
             logger.warning("Exception when counting tokens precisely for session: {}".format(str(e)))
+        self.save_session(session)
         return session
 
     def clear_session(self, session_id):
         if session_id in self.sessions:
             del self.sessions[session_id]
+        if self.store:
+            self.store.delete(self.namespace, session_id)
 
     def clear_all_session(self):
         self.sessions.clear()
+        if self.store:
+            self.store.clear(self.namespace)
@@ -0,0 +1,163 @@
+"""
+流式回复：边接收模型返回的文本边切分为句子、图片和文件，完整的分段立即通过channel发送，最后一段作为最终回复返回
+- 开启stream_reply且channel支持发送多条消息时使用，否则仍等待完整回复（如公众号被动回复只能回复一次）
+- 提供OpenAI兼容接口的流式响应解析，供ChatGPT、DeepSeek、Moonshot、ModelScope、智谱等bot共用
+"""
+
+import json
+
+from bridge.context import Context
+from bridge.reply import Reply, ReplyType
+from common.log import logger
+from common.stream_segmenter import StreamSegmenter
+from config import conf
+
+
+def can_send_partial(context: Context) -> bool:
+    """channel能否在最终回复之前发送多条消息"""
+    channel = context.get("channel") if context else None
+    return channel is not None and getattr(channel, "SUPPORT_STREAM_REPLY", False)
+
+
+def is_stream_reply(context: Context) -> bool:
+    return bool(conf().get("stream_reply", False)) and can_send_partial(context)
+
+
+def iter_sse_deltas(response):
+    """
+    解析OpenAI兼容接口的SSE流式响应（requests的stream=True响应），逐个返回新增的文本
+    """
+    for line in response.iter_lines():
+        if not line:
+            continue
+        line = line.decode("utf-8") if isinstance(line, bytes) else line
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        try:
+            chunk = json.loads(data)
+        except json.JSONDecodeError:
+            logger.debug("[StreamReply] invalid sse data: {}".format(data))
+            continue
+        if chunk.get("error"):
+            raise Exception(chunk["error"])
+        choices = chunk.get("choices") or [{}]
+        content = (choices[0].get("delta") or {}).get("content")
+        if content:
+            yield content
+
+
+def iter_chunk_deltas(chunks):
+    """
+    解析SDK返回的流式分块（openai的ChatCompletion.create(stream=True)、zhipuai等），逐个返回新增的文本
+    """
+    for chunk in chunks:
+        choices = chunk["choices"] if isinstance(chunk, dict) else chunk.choices
+        if not choices:
+            continue
+        delta = choices[0]["delta"] if isinstance(choices[0], dict) else choices[0].delta
+        content = delta.get("content") if isinstance(delta, dict) else getattr(delta, "content", None)
+        if content:
+            yield content
+
+
+def default_item_to_reply(item: dict):
+    if item["type"] == "text":
+        return Reply(ReplyType.TEXT, item["content"])
+    if item["type"] == "image":
+        return Reply(ReplyType.IMAGE_URL, item["content"])
+    return Reply(ReplyType.TEXT, "文件链接：{}".format(item["content"]))
+
+
+class StreamReplySender(object):
+    """
+    用法：
+        sender = StreamReplySender(context)
+        for delta in deltas:
+            sender.feed(delta)
+        final_reply = sender.finish()
+    已完成的分段中始终保留最后一段，作为最终回复交给channel按正常流程装饰和发送
+    中间的分段同样经过channel的装饰和插件处理（前后缀、群聊@、敏感词、语音回复等）后发送
+    """
+
+    def __init__(self, context: Context, item_to_reply=None, tag="StreamReply"):
+        """
+        :param item_to_reply: 把分段转换为Reply的函数 item_to_reply(item)，默认图片按链接发送
+        """
+        self.context = context
+        self.channel = context.get("channel")
+        self.item_to_reply = item_to_reply or default_item_to_reply
+        self.tag = tag
+        self.segmenter = StreamSegmenter(min_length=conf().get("stream_min_segment_length", 20))
+        self.pending = []  # 已完成但尚未发送的分段
+        self.parts = []  # 收到的全部文本，用于写入会话
+        self.sent = 0  # 已发送的分段数
+
+    @property
+    def content(self) -> str:
+        return "".join(self.parts)
+
+    def feed(self, text: str):
+        if not text:
+            return
+        self.parts.append(text)
+        self.pending.extend(self.segmenter.feed(text))
+        self._send_pending()
+
+    def add(self, item: dict):
+        """在当前位置插入一个分段（如接口单独返回的图片），之前的文本先结束为一段"""
+        self.pending.extend(self.segmenter.flush())
+        self.pending.append(item)
+        self._send_pending()
+
+    def flush(self):
+        """强制在当前位置分段，如工具调用前后的文本"""
+        self.pending.extend(self.segmenter.flush())
+        self._send_pending()
+
+    def consume(self, deltas):
+        """
+        读取全部流式文本。已经发送过分段后出错时不再抛出，避免重试导致重复发送，用已收到的内容结束
+        """
+        try:
+            for delta in deltas:
+                self.feed(delta)
+        except Exception as e:
+            if not self.sent:
+                raise
+            logger.warning("[{}] stream interrupted after {} segments: {}".format(self.tag, self.sent, e))
+
+    def finish(self):
+        """发送剩余的中间分段，返回最后一段对应的Reply，没有任何内容时返回None"""
+        self.pending.extend(self.segmenter.flush())
+        self._send_pending()
+        if not self.pending:
+            return None
+        return self.item_to_reply(self.pending.pop())
+
+    def _send_pending(self):
+        while len(self.pending) > 1:
+            reply = self.item_to_reply(self.pending.pop(0))
+            logger.debug("[{}] stream reply={}".format(self.tag, reply))
+            if reply:
+                self.channel._send_reply(self.context, self.channel._decorate_reply(self.context, reply))
+                self.sent += 1
+
+
+def stream_completion(deltas, context: Context, tag="StreamReply") -> dict:
+    """
+    读取OpenAI兼容接口的流式文本并分段发送
+    :return: 与bot的reply_text结果格式相同，content为完整文本，final_reply为最终回复的分段
+    """
+    sender = StreamReplySender(context, tag=tag)
+    sender.consume(deltas)
+    final_reply = sender.finish()
+    content = sender.content
+    return {
+        "total_tokens": None,  # 流式响应没有用量统计，写入会话时重新计算
+        "completion_tokens": len(sender.parts),  # 每个分块约一个token
+        "content": content,
+        "final_reply": final_reply,
+    }
@@ -8,6 +8,7 @@ from bot.bot import Bot
 from bot.zhipuai.zhipu_ai_session import ZhipuAISession
 from bot.zhipuai.zhipu_ai_image import ZhipuAIImage
 from bot.session_manager import SessionManager
+from bot.stream_reply import is_stream_reply, iter_chunk_deltas, stream_completion
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
@@ -55,11 +56,7 @@ class ZHIPUAIBot(Bot, ZhipuAIImage):
             if model:
                 new_args = self.args.copy()
                 new_args["model"] = model
-            # if context.get('stream'):
-            #     # reply in stream
-            #     return self.reply_text_stream(query, new_query, session_id)
-
-            reply_content = self.reply_text(session, api_key, args=new_args)
+            reply_content = self.reply_text(session, api_key, args=new_args, context=context)
             logger.debug(
                 "[ZHIPU_AI] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
                     session.messages,
@@ -72,7 +69,8 @@ class ZHIPUAIBot(Bot, ZhipuAIImage):
                 reply = Reply(ReplyType.ERROR, reply_content["content"])
             elif reply_content["completion_tokens"] > 0:
                 self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
-                reply = Reply(ReplyType.TEXT, reply_content["content"])
+                # 流式回复时前面的分段已经发送，只返回最后一段
+                reply = reply_content.get("final_reply") or Reply(ReplyType.TEXT, reply_content["content"])
             else:
                 reply = Reply(ReplyType.ERROR, reply_content["content"])
                 logger.debug("[ZHIPU_AI] reply {} used 0 tokens.".format(reply_content))
@@ -90,12 +88,13 @@ class ZHIPUAIBot(Bot, ZhipuAIImage):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
-    def reply_text(self, session: ZhipuAISession, api_key=None, args=None, retry_count=0) -> dict:
+    def reply_text(self, session: ZhipuAISession, api_key=None, args=None, retry_count=0, context=None) -> dict:
         """
         call openai's ChatCompletion to get the answer
         :param session: a conversation session
         :param session_id: session id
         :param retry_count: retry count
+        :param context: 开启流式回复时用于边生成边发送
         :return: {}
         """
         try:
@@ -105,6 +104,9 @@ class ZHIPUAIBot(Bot, ZhipuAIImage):
             if args is None:
                 args = self.args
             # response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, **args)
+            if is_stream_reply(context):
+                response = self.client.chat.completions.create(messages=session.messages, stream=True, **args)
+                return stream_completion(iter_chunk_deltas(response), context, tag="ZHIPU_AI")
             response = self.client.chat.completions.create(messages=session.messages, **args)
             # logger.debug("[ZHIPU_AI] response={}".format(response))
             # logger.info("[ZHIPU_AI] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
@@ -144,6 +146,6 @@ class ZHIPUAIBot(Bot, ZhipuAIImage):
 
             if need_retry:
                 logger.warn("[ZHIPU_AI] 第{}次重试".format(retry_count + 1))
-                return self.reply_text(session, api_key, args, retry_count + 1)
+                return self.reply_text(session, api_key, args, retry_count + 1, context)
             else:
                 return result
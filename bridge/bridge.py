@@ -1,8 +1,10 @@
 from bot.bot_factory import create_bot
 from bridge.context import Context
-from bridge.reply import Reply
-from common import const
+from bridge.reply import Reply, ReplyType
+from bridge.reply_cache import lookup_reply, store_reply
+from common import const, metrics
 from common.log import logger
+from common.singleflight import get_group
 from common.singleton import singleton
 from config import conf
 from translate.factory import create_translator
@@ -90,7 +92,61 @@ class Bridge(object):
         return self.btype[typename]
 
     def fetch_reply_content(self, query, context: Context) -> Reply:
-        return self.get_bot("chat").reply(query, context)
+        with self._span(context):
+            return self._fetch_reply_content(query, context)
+
+    async def async_fetch_reply_content(self, query, context: Context) -> Reply:
+        with self._span(context):
+            return await self._async_fetch_reply_content(query, context)
+
+    def _span(self, context: Context):
+        channel = context.get("channel") if context else None
+        return metrics.span("bot_reply", channel=getattr(channel, "channel_type", ""), bot=self.btype["chat"], context_type=metrics.context_type_name(context))
+
+    def _fetch_reply_content(self, query, context: Context) -> Reply:
+        key, reply = lookup_reply(self.btype["chat"], query, context)
+        if reply is not None:
+            return reply
+        if key is None or not conf().get("singleflight", True):
+            reply = self.get_bot("chat").reply(query, context)
+            store_reply(key, reply)
+            return reply
+        reply, shared = get_group("bridge").do(key, self.get_bot("chat").reply, query, context)
+        if not shared:
+            store_reply(key, reply)
+            return reply
+        reply = self._shared_reply(key, reply)
+        if reply is None:
+            reply = self.get_bot("chat").reply(query, context)
+        return reply
+
+    async def _async_fetch_reply_content(self, query, context: Context) -> Reply:
+        key, reply = lookup_reply(self.btype["chat"], query, context)
+        if reply is not None:
+            return reply
+        if key is None or not conf().get("singleflight", True):
+            reply = await self.get_bot("chat").async_reply(query, context)
+            store_reply(key, reply)
+            return reply
+        reply, shared = await get_group("bridge").do_async(key, self.get_bot("chat").async_reply, query, context)
+        if not shared:
+            store_reply(key, reply)
+            return reply
+        reply = self._shared_reply(key, reply)
+        if reply is None:
+            reply = await self.get_bot("chat").async_reply(query, context)
+        return reply
+
+    def _shared_reply(self, key, reply: Reply):
+        """
+        复制其他请求得到的回复，只共享文本回复，其他回复返回None，由调用方自己请求bot
+        语音、图片等回复的临时文件由发起请求的channel发送后删除，不能共享
+        """
+        if reply is None or reply.type != ReplyType.TEXT:
+            return None
+        logger.info("[Bridge] share in-flight reply, query={}".format(key[3]))
+        # 每个等待者使用新的Reply，channel装饰回复时会修改content
+        return Reply(reply.type, reply.content)
 
     def fetch_voice_to_text(self, voiceFile) -> Reply:
         return self.get_bot("voice_to_text").voiceToText(voiceFile)
@@ -0,0 +1,150 @@
+"""
+无状态回复缓存：相同的问题在有效期内直接返回缓存的回复，不再请求bot
+缓存的回复不考虑会话上下文，只应对不依赖历史消息的应用开启，如dify的workflow应用
+开启semantic_cache时，未精确命中的问题再通过语义缓存匹配相似的问法
+开启singleflight时，这些应用中同时进行的相同问题只请求一次bot
+"""
+
+import hashlib
+import re
+import threading
+
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from bridge.semantic_cache import get_semantic_cache
+from common import const
+from common.expired_dict import ExpiredDict
+from common.log import logger
+from config import conf
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s。．.？?！!～~，,、]+$")
+
+
+def normalize_query(query: str) -> str:
+    """统一空白、大小写和句末标点，如 "怎么用？" 与 "怎么用" 视为同一个问题"""
+    query = _SPACES.sub(" ", query.strip()).lower()
+    return _TRAILING_PUNCTUATION.sub("", query)
+
+
+def _hash(text) -> str:
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+
+def app_ids(bot_type, context: Context):
+    """
+    应用标识，reply_cache_apps中包含其中任意一个时开启缓存，第一个用于缓存key
+    dify: dify:<api_key>、dify:<app_type>
+    其他bot: <bot_type>:<model>、<bot_type>
+    """
+    if bot_type == const.DIFY:
+        api_key = context.get("dify_api_key", conf().get("dify_api_key", ""))
+        app_type = context.get("dify_app_type", conf().get("dify_app_type", "chatbot"))
+        return ["dify:" + api_key, "dify:" + app_type]
+    model = context.get("gpt_model") or conf().get("model", "")
+    return ["{}:{}".format(bot_type, model), bot_type]
+
+
+def is_single_reply(bot_type, context: Context) -> bool:
+    """
+    bot是否只通过返回值回复：dify的chatbot、chatflow、agent应用会把图片、文件等分段直接发送，只返回最后一段，
+    开启stream_reply时其他bot也会直接发送中间的分段，这些情况下返回的回复不完整，不能缓存或共享
+    """
+    if bot_type == const.DIFY:
+        return context.get("dify_app_type", conf().get("dify_app_type", "chatbot")) == "workflow"
+    return not conf().get("stream_reply", False)
+
+
+def make_cache_key(bot_type, query, context: Context):
+    """返回缓存key: (bot类型, 应用标识hash, 人设hash, 归一化的问题)，不可缓存时返回None"""
+    if context is None or context.type != ContextType.TEXT or not isinstance(query, str):
+        return None
+    apps = conf().get("reply_cache_apps", [])
+    ids = app_ids(bot_type, context)
+    if not any(app_id in apps for app_id in ids):
+        return None
+    if not is_single_reply(bot_type, context):
+        return None
+    system_prompt = "" if bot_type == const.DIFY else conf().get("character_desc", "")
+    return (bot_type, _hash(ids[0]), _hash(system_prompt), normalize_query(query))
+
+
+class ReplyCache(object):
+    def __init__(self, ttl, max_size):
+        self.cache = ExpiredDict(ttl, max_size=max_size)
+        self.stats = {"hits": 0, "misses": 0, "stores": 0}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        content = self.cache.get(key)
+        with self.lock:
+            self.stats["hits" if content is not None else "misses"] += 1
+        # 每次返回新的Reply，channel装饰回复时会修改content
+        return Reply(ReplyType.TEXT, content) if content is not None else None
+
+    def put(self, key, reply: Reply):
+        if reply is None or reply.type != ReplyType.TEXT or not reply.content:
+            return
+        self.cache[key] = reply.content
+        with self.lock:
+            self.stats["stores"] += 1
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0
+        stats["size"] = len(self.cache)
+        stats["evicted"] = self.cache.get_stats()["evicted"]
+        return stats
+
+
+_reply_cache = None
+
+
+def get_reply_cache():
+    """未开启reply_cache时返回None"""
+    global _reply_cache
+    if not conf().get("reply_cache", False):
+        return None
+    if _reply_cache is None:
+        _reply_cache = ReplyCache(conf().get("reply_cache_ttl", 600), conf().get("reply_cache_max_size", 1000))
+        logger.info("[ReplyCache] reply cache enabled, apps={}".format(conf().get("reply_cache_apps", [])))
+    return _reply_cache
+
+
+def lookup_reply(bot_type, query, context: Context):
+    """
+    依次查询回复缓存和语义缓存
+    :return: (缓存key, 缓存的回复)，不可缓存时key为None，key同时用于合并相同的请求
+    """
+    cache = get_reply_cache()
+    semantic_cache = get_semantic_cache()
+    if cache is None and semantic_cache is None and not conf().get("singleflight", True):
+        return None, None
+    key = make_cache_key(bot_type, query, context)
+    if key is None:
+        return None, None
+    if cache is not None:
+        reply = cache.get(key)
+        if reply is not None:
+            logger.info("[ReplyCache] hit, query={}".format(query))
+            return key, reply
+    if semantic_cache is not None:
+        result = semantic_cache.lookup("/".join(key[:3]), key[3])
+        if result is not None:
+            logger.info("[SemanticCache] hit, query={}, score={:.3f}".format(query, result[1]))
+            return key, Reply(ReplyType.TEXT, result[0])
+    return key, None
+
+
+def store_reply(key, reply: Reply):
+    """把bot的回复写入开启的缓存，key为lookup_reply返回的缓存key"""
+    if key is None or reply is None or reply.type != ReplyType.TEXT or not reply.content:
+        return
+    cache = get_reply_cache()
+    if cache is not None:
+        cache.put(key, reply)
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is not None:
+        semantic_cache.add("/".join(key[:3]), key[3], reply.content)
@@ -0,0 +1,202 @@
+"""
+语义缓存：用字符n-gram哈希向量表示问题，余弦相似度超过阈值时返回缓存的回复，用于匹配同一问题的不同问法
+- 向量计算和检索依赖numpy，未安装时不开启；numpy在开启语义缓存时才导入，不影响启动速度
+- 超出容量时覆盖最早写入的条目，过期的条目不会被命中
+- 字符n-gram对只差一个数字或字母的问题相似度很高（如"套餐a的价格"和"套餐b的价格"），所以还要求问题中的数字和英文单词完全相同
+- 索引定期保存到appdata_dir/semantic_cache.npz，重启后加载
+"""
+
+import atexit
+import json
+import os
+import re
+import threading
+import time
+import zlib
+
+from common.log import logger
+from config import conf, get_appdata_dir
+
+np = None  # numpy模块，由load_numpy()导入
+
+NGRAM_SIZES = (1, 2, 3)
+_EXACT_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def load_numpy():
+    """导入numpy，未安装时返回None"""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+
+def embed(text: str, dim: int):
+    """字符1~3-gram的哈希向量（带符号的feature hashing），已做L2归一化"""
+    vector = np.zeros(dim, dtype=np.float32)
+    for n in NGRAM_SIZES:
+        for i in range(len(text) - n + 1):
+            h = zlib.crc32(text[i : i + n].encode("utf-8"))  # 不能用hash()，每个进程的结果不同
+            vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+def exact_tokens(text: str) -> list:
+    """问题中必须完全匹配的部分：数字和英文单词，如订单号、选项字母、型号"""
+    return sorted(set(_EXACT_TOKEN.findall(text.lower())))
+
+
+class SemanticCache(object):
+    def __init__(self, path=None, dim=512, threshold=0.8, max_size=5000, ttl=86400, save_every=20):
+        self.path = path
+        self.dim = dim
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.save_every = save_every  # 每写入多少条保存一次索引
+        if load_numpy() is None:
+            raise ImportError("numpy is not installed")
+        self.vectors = np.zeros((max_size, dim), dtype=np.float32)
+        self.namespaces = [None] * max_size  # 每条的应用标识，只在同一应用内匹配
+        self.namespace_ids = np.full(max_size, -1, dtype=np.int32)  # 应用标识的编号，用于在计算相似度后直接屏蔽其他应用的条目
+        self.namespace_index = {}  # 应用标识 -> 编号
+        self.tokens = [None] * max_size  # 每条问题的exact_tokens
+        self.contents = [None] * max_size
+        self.created = np.zeros(max_size, dtype=np.float64)  # 写入时间，time.time()
+        self.count = 0  # 已写入的总条数，count % max_size为下一个写入位置
+        self.unsaved = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0}
+        if path:
+            self.load()
+
+    def lookup(self, namespace, query):
+        """返回(回复内容, 相似度)，未命中返回None"""
+        vector = embed(query, self.dim)
+        tokens = exact_tokens(query)
+        with self.lock:
+            size = min(self.count, self.max_size)
+            namespace_id = self.namespace_index.get(namespace)
+            if size == 0 or namespace_id is None:
+                self.stats["misses"] += 1
+                return None
+            scores = self.vectors[:size] @ vector
+            scores[self.namespace_ids[:size] != namespace_id] = -1
+            scores[self.created[:size] < time.time() - self.ttl] = -1
+            # 取相似度最高的几条，从高到低检查，直到找到数字和英文单词相同的条目
+            top = min(8, size)
+            candidates = np.argpartition(-scores, top - 1)[:top]
+            for index in candidates[np.argsort(-scores[candidates])]:
+                score = float(scores[index])
+                if score < self.threshold:
+                    break
+                if self.tokens[index] == tokens:
+                    self.stats["hits"] += 1
+                    return self.contents[index], score
+            self.stats["misses"] += 1
+            return None
+
+    def add(self, namespace, query, content):
+        vector = embed(query, self.dim)
+        with self.lock:
+            index = self.count % self.max_size
+            self.vectors[index] = vector
+            self._set_namespace(index, namespace)
+            self.tokens[index] = exact_tokens(query)
+            self.contents[index] = content
+            self.created[index] = time.time()
+            self.count += 1
+            self.unsaved += 1
+            self.stats["stores"] += 1
+            need_save = self.path and self.unsaved >= self.save_every
+        if need_save:
+            self.save()
+
+    def _set_namespace(self, index, namespace):
+        # 需持有锁或在初始化时调用
+        self.namespaces[index] = namespace
+        self.namespace_ids[index] = self.namespace_index.setdefault(namespace, len(self.namespace_index))
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            if not self.unsaved:
+                return
+            size = min(self.count, self.max_size)
+            meta = {"dim": self.dim, "count": self.count, "namespaces": self.namespaces[:size], "tokens": self.tokens[:size], "contents": self.contents[:size]}
+            vectors = self.vectors[:size].copy()
+            created = self.created[:size].copy()
+            self.unsaved = 0
+        tmp_path = self.path + ".tmp.npz"
+        try:
+            np.savez(tmp_path, vectors=vectors, created=created, meta=np.array(json.dumps(meta, ensure_ascii=False)))
+            os.replace(tmp_path, self.path)  # 先写临时文件再替换，避免写到一半时崩溃损坏索引
+        except Exception as e:
+            logger.warning("[SemanticCache] save index failed: {}".format(e))
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                meta = json.loads(str(data["meta"]))
+                vectors, created = data["vectors"], data["created"]
+        except Exception as e:
+            logger.warning("[SemanticCache] load index failed: {}".format(e))
+            return
+        if meta["dim"] != self.dim or "tokens" not in meta:
+            logger.info("[SemanticCache] index format changed, ignore saved index")
+            return
+        # 保存时的容量可能与当前不同，只保留最新的max_size条
+        size = len(meta["contents"])
+        order = [(meta["count"] - size + i) % size for i in range(size)] if meta["count"] > size else list(range(size))
+        order = order[-self.max_size :]
+        for i, index in enumerate(order):
+            self.vectors[i] = vectors[index]
+            self.created[i] = created[index]
+            self._set_namespace(i, meta["namespaces"][index])
+            self.tokens[i] = meta["tokens"][index]
+            self.contents[i] = meta["contents"][index]
+        self.count = len(order)
+        logger.info("[SemanticCache] loaded {} entries from {}".format(self.count, self.path))
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats, size=min(self.count, self.max_size), max_size=self.max_size)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0
+        return stats
+
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """未开启semantic_cache或未安装numpy时返回None"""
+    global _semantic_cache
+    if not conf().get("semantic_cache", False):
+        return None
+    if _semantic_cache is None:
+        with _semantic_cache_lock:
+            if _semantic_cache is None:
+                if load_numpy() is None:
+                    logger.warning("[SemanticCache] numpy is not installed, semantic cache is disabled. Try: pip install numpy")
+                    _semantic_cache = False
+                else:
+                    _semantic_cache = SemanticCache(
+                        os.path.join(get_appdata_dir(), "semantic_cache.npz"),
+                        threshold=conf().get("semantic_cache_threshold", 0.8),
+                        max_size=conf().get("semantic_cache_max_size", 5000),
+                        ttl=conf().get("semantic_cache_ttl", 86400),
+                    )
+                    atexit.register(_semantic_cache.save)
+    return _semantic_cache or None
@@ -10,6 +10,7 @@ from bridge.reply import *
 class Channel(object):
     channel_type = ""
     NOT_SUPPORT_REPLYTYPE = [ReplyType.VOICE, ReplyType.IMAGE]
+    SUPPORT_STREAM_REPLY = True  # 能否在最终回复前发送多条消息，不支持时流式回复退化为等待完整回复
 
     def startup(self):
         """
@@ -37,6 +38,9 @@ class Channel(object):
     def build_reply_content(self, query, context: Context = None) -> Reply:
         return Bridge().fetch_reply_content(query, context)
 
+    async def async_build_reply_content(self, query, context: Context = None) -> Reply:
+        return await Bridge().async_fetch_reply_content(query, context)
+
     def build_voice_to_text(self, voice_file) -> Reply:
         return Bridge().fetch_voice_to_text(voice_file)
 
@@ -1,15 +1,23 @@
+import asyncio
 import os
 import re
 import threading
 import time
 from asyncio import CancelledError
-from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import Future
 
 from bridge.context import *
 from bridge.reply import *
 from channel.channel import Channel
+from channel.trigger_index import get_trigger_index, mention_pattern
 from common.dequeue import Dequeue
-from common import memory
+from common import memory, metrics
+from config import config_snapshot
+from common.async_runtime import run_coroutine, run_sync
+from common.shared_state import get_shared_state
+from common.tmp_dir import TmpDir
+from common.worker_pool import PRIORITY_ADMIN, PRIORITY_NORMAL, PRIORITY_PLUGIN, PoolBusyError, get_handler_pool, call_later, run_in_cpu_pool
 from plugins import *
 
 try:
@@ -17,7 +25,7 @@ try:
 except Exception as e:
     pass
 
-handler_pool = ThreadPoolExecutor(max_workers=8)  # 处理消息的线程池
+handler_pool = get_handler_pool()  # 处理消息的线程池，大小和积压上限见handler_pool_size、handler_pool_max_backlog
 
 
 # 抽象类, 它包含了与消息通道无关的通用处理逻辑
@@ -27,14 +35,28 @@ class ChatChannel(Channel):
     futures = {}  # 记录每个session_id提交到线程池的future对象, 用于重置会话时把没执行的future取消掉，正在执行的不会被取消
     sessions = {}  # 用于控制并发，每个session_id同时只能有一个context在处理
     lock = threading.Lock()  # 用于控制对sessions的访问
+    ready_cond = threading.Condition(lock)  # 有session可调度时通知消费线程
+    ready_sessions = deque()  # 待调度的session_id队列，由produce和任务完成回调写入
+    ready_set = set()  # ready_sessions中的session_id，避免重复入队
+    dispatch_stats = {"dispatched": 0, "latency_total": 0.0, "latency_max": 0.0}  # 消息从入队到提交线程池的耗时统计
 
     def __init__(self):
         _thread = threading.Thread(target=self.consume)
         _thread.setDaemon(True)
         _thread.start()
+        metrics.register_collector(self._collect_metrics)
 
-    # 根据消息构造context，消息内容相关的触发项写在这里
+    def _span(self, stage, context: Context, **labels):
+        """记录处理阶段的耗时，按channel和消息类型分组"""
+        return metrics.span(stage, channel=self.channel_type, context_type=metrics.context_type_name(context), **labels)
+
+    # 根据消息构造context
     def _compose_context(self, ctype: ContextType, content, **kwargs):
+        with metrics.span("compose_context", channel=self.channel_type, context_type=ctype.name):
+            return self._build_context(ctype, content, **kwargs)
+
+    # 消息内容相关的触发项写在这里，channel需要自定义context时重写该方法
+    def _build_context(self, ctype: ContextType, content, **kwargs):
         context = Context(ctype, content)
         context.kwargs = kwargs
         if ctype == ContextType.ACCEPT_FRIEND:
@@ -46,9 +68,10 @@ class ChatChannel(Channel):
             context["origin_ctype"] = ctype
         # context首次传入时，receiver是None，根据类型设置receiver
         first_in = "receiver" not in context
+        config = config_snapshot()
+        trigger_index = get_trigger_index(config)
         # 群名匹配过程，设置session_id和receiver
         if first_in:  # context首次传入时，receiver是None，根据类型设置receiver
-            config = conf()
             cmsg = context["msg"]
             user_data = conf().get_user_data(cmsg.from_user_id)
             context["openai_api_key"] = user_data.get("openai_api_key")
@@ -58,24 +81,10 @@ class ChatChannel(Channel):
                 group_id = cmsg.other_user_id
                 context["group_name"] = group_name
 
-                group_name_white_list = config.get("group_name_white_list", [])
-                group_name_keyword_white_list = config.get("group_name_keyword_white_list", [])
-                if any(
-                        [
-                            group_name in group_name_white_list,
-                            "ALL_GROUP" in group_name_white_list,
-                            check_contain(group_name, group_name_keyword_white_list),
-                        ]
-                ):
-                    group_chat_in_one_session = conf().get("group_chat_in_one_session", [])
+                if trigger_index.is_group_allowed(group_name):
                     session_id = f"{cmsg.actual_user_id}@@{group_id}" # 当群聊未共享session时，session_id为user_id与group_id的组合，用于区分不同群聊以及单聊
                     context["is_shared_session_group"] = False  # 默认为非共享会话群
-                    if any(
-                            [
-                                group_name in group_chat_in_one_session,
-                                "ALL_GROUP" in group_chat_in_one_session,
-                            ]
-                    ):
+                    if group_name in trigger_index.group_chat_in_one_session:
                         session_id = group_id
                         context["is_shared_session_group"] = True  # 如果是共享会话群，设置为True
                 else:
@@ -96,11 +105,11 @@ class ChatChannel(Channel):
 
         # 消息内容匹配过程，并处理content
         if ctype == ContextType.TEXT:
-            nick_name_black_list = conf().get("nick_name_black_list", [])
+            nick_name_black_list = trigger_index.nick_name_black_list
             if context.get("isgroup", False):  # 群聊
                 # 校验关键字
-                match_prefix = check_prefix(content, conf().get("group_chat_prefix"))
-                match_contain = check_contain(content, conf().get("group_chat_keyword"))
+                match_prefix = trigger_index.group_chat_prefix.match(content)
+                match_contain = trigger_index.group_chat_keyword.contains(content)
                 flag = False
                 if context["msg"].to_user_id != context["msg"].actual_user_id:
                     if match_prefix is not None or match_contain is not None:
@@ -115,19 +124,16 @@ class ChatChannel(Channel):
                             return None
 
                         logger.info("[chat_channel]receive group at")
-                        if not conf().get("group_at_off", False):
+                        if not config.get("group_at_off", False):
                             flag = True
                         self.name = self.name if self.name is not None else ""  # 部分渠道self.name可能没有赋值
-                        pattern = f"@{re.escape(self.name)}(\u2005|\u0020)"
-                        subtract_res = re.sub(pattern, r"", content)
+                        subtract_res = mention_pattern(self.name).sub(r"", content)
                         if isinstance(context["msg"].at_list, list):
                             for at in context["msg"].at_list:
-                                pattern = f"@{re.escape(at)}(\u2005|\u0020)"
-                                subtract_res = re.sub(pattern, r"", subtract_res)
+                                subtract_res = mention_pattern(at).sub(r"", subtract_res)
                         if subtract_res == content and context["msg"].self_display_name:
                             # 前缀移除后没有变化，使用群昵称再次移除
-                            pattern = f"@{re.escape(context['msg'].self_display_name)}(\u2005|\u0020)"
-                            subtract_res = re.sub(pattern, r"", content)
+                            subtract_res = mention_pattern(context["msg"].self_display_name).sub(r"", content)
                         content = subtract_res
                 if not flag:
                     if context["origin_ctype"] == ContextType.VOICE:
@@ -140,7 +146,7 @@ class ChatChannel(Channel):
                     logger.warning(f"[chat_channel] Nickname '{nick_name}' in In BlackList, ignore")
                     return None
 
-                match_prefix = check_prefix(content, conf().get("single_chat_prefix", [""]))
+                match_prefix = trigger_index.single_chat_prefix.match(content)
                 if match_prefix is not None:  # 判断如果匹配到自定义前缀，则返回过滤掉前缀+空格后的内容
                     content = content.replace(match_prefix, "", 1).strip()
                 elif self.channel_type == 'wechatcom_app':
@@ -151,18 +157,18 @@ class ChatChannel(Channel):
                 else:
                     return None
             content = content.strip()
-            img_match_prefix = check_prefix(content, conf().get("image_create_prefix",[""]))
+            img_match_prefix = trigger_index.image_create_prefix.match(content)
             if img_match_prefix:
                 content = content.replace(img_match_prefix, "", 1)
                 context.type = ContextType.IMAGE_CREATE
             else:
                 context.type = ContextType.TEXT
             context.content = content.strip()
-            if "desire_rtype" not in context and conf().get(
+            if "desire_rtype" not in context and config.get(
                     "always_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         elif context.type == ContextType.VOICE:
-            if "desire_rtype" not in context and conf().get(
+            if "desire_rtype" not in context and config.get(
                     "voice_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         return context
@@ -178,11 +184,43 @@ class ChatChannel(Channel):
 
         # reply的包装步骤
         if reply and reply.content:
-            reply = self._decorate_reply(context, reply)
+            with self._span("decorate_reply", context):
+                reply = self._decorate_reply(context, reply)
 
             # reply的发送步骤
             self._send_reply(context, reply)
 
+    # 异步模式下的处理流程，等待bot回复时不占用线程，插件、装饰和发送等同步步骤在线程池中执行
+    async def _handle_async(self, context: Context):
+        if context is None or not context.content:
+            return
+        logger.debug("[chat_channel] ready to handle context async: {}".format(context))
+        reply = await self._generate_reply_async(context)
+
+        logger.debug("[chat_channel] ready to decorate reply: {}".format(reply))
+
+        if reply and reply.content:
+            with self._span("decorate_reply", context):
+                reply = await run_sync(self._decorate_reply, context, reply)
+            await run_sync(self._send_reply, context, reply)
+
+    async def _generate_reply_async(self, context: Context, reply: Reply = Reply()) -> Reply:
+        if context.type not in [ContextType.TEXT, ContextType.IMAGE_CREATE]:
+            return await run_sync(self._generate_reply, context, reply)
+        e_context = await run_sync(
+            PluginManager().emit_event,
+            EventContext(
+                Event.ON_HANDLE_CONTEXT,
+                {"channel": self, "context": context, "reply": reply},
+            ),
+        )
+        reply = e_context["reply"]
+        if not e_context.is_pass():
+            logger.debug("[chat_channel] ready to handle context async: type={}, content={}".format(context.type, context.content))
+            context["channel"] = e_context["channel"]
+            reply = await super().async_build_reply_content(context.content, context)
+        return reply
+
     def _generate_reply(self, context: Context, reply: Reply = Reply()) -> Reply:
         e_context = PluginManager().emit_event(
             EventContext(
@@ -202,12 +240,14 @@ class ChatChannel(Channel):
                 file_path = context.content
                 wav_path = os.path.splitext(file_path)[0] + ".wav"
                 try:
-                    any_to_wav(file_path, wav_path)
+                    with self._span("voice_convert", context):
+                        run_in_cpu_pool(any_to_wav, file_path, wav_path)
                 except Exception as e:  # 转换失败，直接使用mp3，对于某些api，mp3也可以识别
                     logger.warning("[chat_channel]any to wav error, use raw path. " + str(e))
                     wav_path = file_path
                 # 语音识别
-                reply = super().build_voice_to_text(wav_path)
+                with self._span("voice_to_text", context):
+                    reply = super().build_voice_to_text(wav_path)
                 # 删除临时文件
                 try:
                     os.remove(file_path)
@@ -258,7 +298,8 @@ class ChatChannel(Channel):
                 if reply.type == ReplyType.TEXT:
                     reply_text = reply.content
                     if desire_rtype == ReplyType.VOICE and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
-                        reply = super().build_text_to_voice(reply.content)
+                        with self._span("text_to_voice", context):
+                            reply = super().build_text_to_voice(reply.content)
                         return self._decorate_reply(context, reply)
                     if context.get("isgroup", False):
                         if not conf().get("no_need_at", False):
@@ -296,16 +337,28 @@ class ChatChannel(Channel):
                 self._send(reply, context)
 
     def _send(self, reply: Reply, context: Context, retry_cnt=0):
+        if retry_cnt == 0:
+            TmpDir().hold_reply(reply)  # 发送完成（包括重试）后释放，没有其他引用时删除回复的临时文件
         try:
-            self.send(reply, context)
+            with self._span("send", context):
+                self.send(reply, context)
         except Exception as e:
             logger.error("[chat_channel] sendMsg error: {}".format(str(e)))
-            if isinstance(e, NotImplementedError):
-                return
-            logger.exception(e)
-            if retry_cnt < 2:
-                time.sleep(3 + 3 * retry_cnt)
-                self._send(reply, context, retry_cnt + 1)
+            if not isinstance(e, NotImplementedError):
+                logger.exception(e)
+                if retry_cnt < 2:
+                    # 延后重试，等待期间不占用处理线程
+                    call_later(3 + 3 * retry_cnt, self._submit_retry, reply, context, retry_cnt + 1)
+                    return
+        TmpDir().release_reply(reply)
+
+    def _submit_retry(self, reply: Reply, context: Context, retry_cnt):
+        # 在定时线程中执行，回复已经生成，按管理命令优先级提交，不受积压上限限制
+        try:
+            handler_pool.submit_with_priority(PRIORITY_ADMIN, self._send, reply, context, retry_cnt)
+        except Exception as e:
+            logger.error("[chat_channel] submit send retry failed, drop reply: {}".format(e))
+            TmpDir().release_reply(reply)
 
     # 处理好友申请
     def _build_friend_request_reply(self, context):
@@ -338,7 +391,17 @@ class ChatChannel(Channel):
             except Exception as e:
                 logger.exception("Worker raise exception: {}".format(e))
             with self.lock:
-                self.sessions[session_id][1].release()
+                if session_id not in self.sessions:
+                    return
+                context_queue, semaphore = self.sessions[session_id]
+                semaphore.release()
+                if session_id in self.futures and worker in self.futures[session_id]:
+                    self.futures[session_id].remove(worker)
+                if not context_queue.empty():
+                    self._mark_ready(session_id)
+                elif semaphore._initial_value == semaphore._value:  # 没有排队和处理中的消息，清理session
+                    del self.sessions[session_id]
+                    self.futures.pop(session_id, None)
 
         return func
 
@@ -351,57 +414,176 @@ class ChatChannel(Channel):
                     threading.BoundedSemaphore(conf().get("concurrency_in_session", 4)),
                 ]
             if context.type == ContextType.TEXT and context.content.startswith("#"):
-                self.sessions[session_id][0].putleft(context)  # 优先处理管理命令
+                self.sessions[session_id][0].putleft((time.monotonic(), context))  # 优先处理管理命令
             else:
-                self.sessions[session_id][0].put(context)
+                self.sessions[session_id][0].put((time.monotonic(), context))
+            self._mark_ready(session_id)
+
+    # 将session加入待调度队列并唤醒消费线程，调用时需持有self.lock
+    def _mark_ready(self, session_id):
+        if session_id not in self.ready_set:
+            self.ready_set.add(session_id)
+            self.ready_sessions.append(session_id)
+            self.ready_cond.notify()
 
-    # 消费者函数，单独线程，用于从消息队列中取出消息并处理
+    # 消费者函数，单独线程，等待produce或任务完成的通知，再从对应session的队列中取出消息并处理
     def consume(self):
         while True:
             with self.lock:
-                session_ids = list(self.sessions.keys())
-            for session_id in session_ids:
-                with self.lock:
-                    context_queue, semaphore = self.sessions[session_id]
-                if semaphore.acquire(blocking=False):  # 等线程处理完毕才能删除
-                    if not context_queue.empty():
-                        context = context_queue.get()
-                        logger.debug("[chat_channel] consume context: {}".format(context))
-                        future: Future = handler_pool.submit(self._handle, context)
-                        future.add_done_callback(self._thread_pool_callback(session_id, context=context))
-                        with self.lock:
-                            if session_id not in self.futures:
-                                self.futures[session_id] = []
-                            self.futures[session_id].append(future)
-                    elif semaphore._initial_value == semaphore._value + 1:  # 除了当前，没有任务再申请到信号量，说明所有任务都处理完毕
-                        with self.lock:
-                            self.futures[session_id] = [t for t in self.futures[session_id] if not t.done()]
-                            assert len(self.futures[session_id]) == 0, "thread pool error"
-                            del self.sessions[session_id]
+                while not self.ready_sessions:
+                    self.ready_cond.wait()
+                session_id = self.ready_sessions.popleft()
+                self.ready_set.discard(session_id)
+                if session_id not in self.sessions:
+                    continue
+                context_queue, semaphore = self.sessions[session_id]
+                tasks = []
+                while not context_queue.empty() and semaphore.acquire(blocking=False):
+                    tasks.append(context_queue.get())
+            # 提交线程池时不持有锁，避免done_callback同步执行时死锁
+            for enqueue_time, context in tasks:
+                logger.debug("[chat_channel] consume context: {}".format(context))
+                self._record_dispatch(time.monotonic() - enqueue_time)
+                try:
+                    if conf().get("channel_async_mode", False):
+                        future: Future = run_coroutine(self._handle_in_session_async(context))
                     else:
-                        semaphore.release()
-            time.sleep(0.2)
+                        future: Future = handler_pool.submit_with_priority(self._get_priority(context), self._handle_in_session, context)
+                except PoolBusyError as e:
+                    logger.warning("[chat_channel] handler pool is busy, shed context: {}".format(context))
+                    # 管理命令优先级不受积压上限限制，繁忙提示排在积压任务之前发送，不额外创建线程
+                    handler_pool.submit_with_priority(PRIORITY_ADMIN, self._send_busy_reply, context)
+                    future = Future()
+                    future.set_result(None)  # 通过回调释放信号量
+                with self.lock:
+                    if session_id not in self.futures:
+                        self.futures[session_id] = []
+                    self.futures[session_id].append(future)
+                future.add_done_callback(self._thread_pool_callback(session_id, context=context))
+
+    # 多进程共用共享状态时，同一会话的消息在所有进程间也要串行处理，进程内由sessions中的信号量保证
+    def _session_lock_key(self, context: Context):
+        if get_shared_state().distributed and conf().get("concurrency_in_session", 1) == 1:
+            return "session:{}:{}".format(self.channel_type, context.get("session_id"))
+        return None
+
+    def _handle_in_session(self, context: Context):
+        key = self._session_lock_key(context)
+        if key is None:
+            return self._handle(context)
+        with get_shared_state().lock(key, ttl=conf().get("shared_state_lock_ttl", 600), timeout=conf().get("shared_state_lock_wait", 5)) as acquired:
+            if not acquired:
+                return self._requeue(context)
+            return self._handle(context)
+
+    async def _handle_in_session_async(self, context: Context):
+        key = self._session_lock_key(context)
+        if key is None:
+            return await self._handle_async(context)
+        state = get_shared_state()
+        ttl = conf().get("shared_state_lock_ttl", 600)
+        # 每次只尝试一次，等待期间不占用线程，避免其他进程持有会话锁时占满run_sync的线程池
+        deadline = time.monotonic() + conf().get("shared_state_lock_wait", 5)
+        delay = 0.01
+        token = await run_sync(state.acquire_lock, key, ttl, 0)
+        while token is None:
+            if time.monotonic() >= deadline:
+                return self._requeue(context)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.2)
+            token = await run_sync(state.acquire_lock, key, ttl, 0)
+        try:
+            return await self._handle_async(context)
+        finally:
+            await run_sync(state.release_lock, key, token)
+
+    # 会话锁被其他进程持有时，把消息放回会话队列的头部，当前任务结束后重新调度，不阻塞处理线程
+    def _requeue(self, context: Context):
+        session_id = context.get("session_id", 0)
+        logger.debug("[chat_channel] session {} is locked by another process, requeue context".format(session_id))
+        with self.lock:
+            if session_id in self.sessions:
+                self.sessions[session_id][0].putleft((time.monotonic(), context))
+                return
+        self.produce(context)
+
+    # 消息在线程池中的优先级，管理命令最先处理，插件指令其次
+    def _get_priority(self, context: Context):
+        if context.type == ContextType.TEXT and isinstance(context.content, str):
+            if context.content.startswith("#"):
+                return PRIORITY_ADMIN
+            plugin_trigger_prefix = conf().get("plugin_trigger_prefix", "$")
+            if plugin_trigger_prefix and context.content.startswith(plugin_trigger_prefix):
+                return PRIORITY_PLUGIN
+        return PRIORITY_NORMAL
+
+    # 线程池积压过多时直接回复繁忙提示
+    def _send_busy_reply(self, context: Context):
+        if context.type not in [ContextType.TEXT, ContextType.VOICE, ContextType.IMAGE_CREATE]:
+            return
+        busy_reply = conf().get("busy_reply", "")
+        if busy_reply:
+            self._send(Reply(ReplyType.TEXT, busy_reply), context)
+
+    def _record_dispatch(self, latency):
+        with self.lock:
+            stats = self.dispatch_stats
+            stats["dispatched"] += 1
+            stats["latency_total"] += latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+
+    def get_scheduler_stats(self) -> dict:
+        """
+        获取消息调度状态
+        :return: 排队消息数、待调度session数、活跃session数、已调度消息数及调度延迟(ms)
+        """
+        with self.lock:
+            stats = self.dispatch_stats
+            dispatched = stats["dispatched"]
+            return {
+                "queue_depth": sum(queue.qsize() for queue, _ in self.sessions.values()),
+                "ready_sessions": len(self.ready_sessions),
+                "active_sessions": len(self.sessions),
+                "dispatched": dispatched,
+                "dispatch_latency_avg_ms": stats["latency_total"] / dispatched * 1000 if dispatched else 0.0,
+                "dispatch_latency_max_ms": stats["latency_max"] * 1000,
+            }
+
+    def _collect_metrics(self):
+        stats = self.get_scheduler_stats()
+        labels = {"channel": self.channel_type}
+        return [
+            ("channel_queue_depth", "gauge", "Messages waiting in session queues", [(labels, stats["queue_depth"])]),
+            ("channel_ready_sessions", "gauge", "Sessions waiting to be dispatched", [(labels, stats["ready_sessions"])]),
+            ("channel_active_sessions", "gauge", "Sessions with queued or running messages", [(labels, stats["active_sessions"])]),
+            ("channel_dispatched_total", "counter", "Messages dispatched to the handler pool", [(labels, stats["dispatched"])]),
+        ]
 
     # 取消session_id对应的所有任务，只能取消排队的消息和已提交线程池但未执行的任务
     def cancel_session(self, session_id):
         with self.lock:
-            if session_id in self.sessions:
-                for future in self.futures[session_id]:
-                    future.cancel()
-                cnt = self.sessions[session_id][0].qsize()
-                if cnt > 0:
-                    logger.info("Cancel {} messages in session {}".format(cnt, session_id))
-                self.sessions[session_id][0] = Dequeue()
+            futures = self._clear_session_queue(session_id)
+        # future.cancel()会同步触发done_callback，需在锁外执行
+        for future in futures:
+            future.cancel()
 
     def cancel_all_session(self):
+        futures = []
         with self.lock:
             for session_id in self.sessions:
-                for future in self.futures[session_id]:
-                    future.cancel()
-                cnt = self.sessions[session_id][0].qsize()
-                if cnt > 0:
-                    logger.info("Cancel {} messages in session {}".format(cnt, session_id))
-                self.sessions[session_id][0] = Dequeue()
+                futures.extend(self._clear_session_queue(session_id))
+        for future in futures:
+            future.cancel()
+
+    # 清空session中排队的消息，返回待取消的future列表，调用时需持有self.lock
+    def _clear_session_queue(self, session_id):
+        if session_id not in self.sessions:
+            return []
+        cnt = self.sessions[session_id][0].qsize()
+        if cnt > 0:
+            logger.info("Cancel {} messages in session {}".format(cnt, session_id))
+        self.sessions[session_id][0] = Dequeue()
+        return list(self.futures.get(session_id, []))
 
 
 def check_prefix(content, prefix_list):
@@ -1,10 +1,10 @@
 from bridge.context import ContextType
 from channel.chat_message import ChatMessage
 import json
-import requests
 from common.log import logger
 from common.tmp_dir import TmpDir
 from common import utils
+from common import http_client
 
 
 class FeishuMessage(ChatMessage):
@@ -28,7 +28,7 @@ class FeishuMessage(ChatMessage):
             file_key = content.get("file_key")
             file_name = content.get("file_name")
 
-            self.content = TmpDir().path() + file_key + "." + utils.get_path_suffix(file_name)
+            self.content = TmpDir().file(file_key + "." + utils.get_path_suffix(file_name))
 
             def _download_file():
                 # 如果响应状态码是200，则将响应内容写入本地文件
@@ -39,7 +39,7 @@ class FeishuMessage(ChatMessage):
                 params = {
                     "type": "file"
                 }
-                response = requests.get(url=url, headers=headers, params=params)
+                response = http_client.get(url=url, headers=headers, params=params)
                 if response.status_code == 200:
                     with open(self.content, "wb") as f:
                         f.write(response.content)
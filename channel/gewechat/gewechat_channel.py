@@ -1,4 +1,6 @@
 import os
+import queue
+import threading
 import time
 import json
 import web
@@ -8,10 +10,16 @@ import re
 from bridge.context import Context, ContextType
 from bridge.reply import Reply, ReplyType
 from channel.chat_channel import ChatChannel
+from channel.outbound_dispatcher import OutboundDispatcher
+from channel.gewechat.gewechat_contact_cache import get_contact_cache
 from channel.gewechat.gewechat_message import GeWeChatMessage
+from common.shared_state import get_shared_state
 from common.log import logger
 from common.singleton import singleton
 from common.tmp_dir import TmpDir
+from common.worker_pool import run_in_cpu_pool
+from common import http_client
+from common.web_server import run_web_app
 from config import conf, save_config
 from lib.gewechat import GewechatClient
 from voice.audio_convert import mp3_to_silk
@@ -26,6 +34,21 @@ class GeWeChatChannel(ChatChannel):
     def __init__(self):
         super().__init__()
 
+        # 回调消息先入队再由ingress线程处理
+        self.ingress_queue = queue.Queue(maxsize=conf().get("gewechat_ingress_queue_size", 1000))
+        self.shared_state = get_shared_state()  # 消息去重，多进程部署时共享
+        self.ingress_stats = {"received": 0, "duplicated": 0, "dropped": 0, "processed": 0, "errors": 0}
+        self.ingress_workers = []
+        self.ingress_lock = threading.Lock()
+        self.outbound = OutboundDispatcher(
+            "gewechat",
+            self._deliver,
+            split=self._split_reply,
+            qps=conf().get("gewechat_send_qps", 5),
+            max_retries=conf().get("outbound_max_retries", 2),
+            coalesce_text=conf().get("outbound_coalesce_text", True),
+        )
+
         self.base_url = conf().get("gewechat_base_url")
         if not self.base_url:
             logger.error("[gewechat] base_url is not set")
@@ -77,8 +100,9 @@ class GeWeChatChannel(ChatChannel):
             logger.error("[gewechat] callback_url is not set, unable to start callback server")
             return
 
+        self._start_ingress_workers()
+
         # 创建新线程设置回调地址
-        import threading
         def set_callback():
             # 等待服务器启动（给予适当的启动时间）
             import time
@@ -103,7 +127,101 @@ class GeWeChatChannel(ChatChannel):
         logger.info(f"[gewechat] start callback server: {callback_url}, using port {port}")
         urls = (path, "channel.gewechat.gewechat_channel.Query")
         app = web.application(urls, globals(), autoreload=False)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        run_web_app(app, port, name="gewechat")
+
+    def enqueue_callback(self, data) -> bool:
+        """
+        回调消息入队，按NewMsgId去重
+        :return: 队列满丢弃时返回False，此时不保留去重记录，gewechat重发的回调可以重新入队
+        """
+        msg_data = {}
+        if isinstance(data, dict):
+            msg_data = data.get('Data') or data.get('data') or {}
+        msg_id = msg_data.get('NewMsgId') if isinstance(msg_data, dict) else None
+        dedup_key = f"gewechat:msg:{msg_id}" if msg_id else None
+        with self.ingress_lock:
+            self.ingress_stats["received"] += 1
+        # 去重可能需要访问Redis，不在ingress_lock内进行
+        if dedup_key and not self.shared_state.add_if_absent(dedup_key, ttl=60 * 10):
+            with self.ingress_lock:
+                self.ingress_stats["duplicated"] += 1
+            logger.debug(f"[gewechat] ignore duplicated callback, NewMsgId={msg_id}")
+            return True
+        try:
+            self.ingress_queue.put_nowait(data)
+        except queue.Full:
+            if dedup_key:
+                self.shared_state.delete(dedup_key)
+            with self.ingress_lock:
+                self.ingress_stats["dropped"] += 1
+            logger.warning(f"[gewechat] ingress queue is full, drop callback NewMsgId={msg_id}")
+            return False
+        return True
+
+    def get_ingress_stats(self) -> dict:
+        with self.ingress_lock:
+            stats = dict(self.ingress_stats)
+        return dict(
+            stats,
+            queue_size=self.ingress_queue.qsize(),
+            queue_maxsize=self.ingress_queue.maxsize,
+            workers=len(self.ingress_workers),
+        )
+
+    def _start_ingress_workers(self):
+        for i in range(max(1, conf().get("gewechat_ingress_workers", 2))):
+            t = threading.Thread(target=self._ingress_worker, name=f"gewechat_ingress_{i}", daemon=True)
+            t.start()
+            self.ingress_workers.append(t)
+
+    def _ingress_worker(self):
+        while True:
+            data = self.ingress_queue.get()
+            result = "processed"
+            try:
+                self._handle_callback(data)
+            except Exception as e:
+                result = "errors"
+                logger.exception(f"[gewechat] handle callback error: {e}")
+            with self.ingress_lock:
+                self.ingress_stats[result] += 1
+
+    def _handle_callback(self, data):
+        gewechat_msg = GeWeChatMessage(data, self.client)
+        
+        # 微信客户端的状态同步消息
+        if gewechat_msg.ctype == ContextType.STATUS_SYNC:
+            logger.debug(f"[gewechat] ignore status sync message: {gewechat_msg.content}")
+            return
+
+        # 忽略非用户消息（如公众号、系统通知等）
+        if gewechat_msg.ctype == ContextType.NON_USER_MSG:
+            logger.debug(f"[gewechat] ignore non-user message from {gewechat_msg.from_user_id}: {gewechat_msg.content}")
+            return
+
+        # 判断是否需要忽略语音消息
+        if gewechat_msg.ctype == ContextType.VOICE:
+            if conf().get("speech_recognition") != True:
+                return
+
+        # 忽略来自自己的消息
+        if gewechat_msg.my_msg:
+            logger.debug(f"[gewechat] ignore message from myself: {gewechat_msg.actual_user_id}: {gewechat_msg.content}")
+            return
+
+        # 忽略过期的消息
+        if int(gewechat_msg.create_time) < int(time.time()) - 60 * 5: # 跳过5分钟前的历史消息
+            logger.debug(f"[gewechat] ignore expired message from {gewechat_msg.actual_user_id}: {gewechat_msg.content}")
+            return
+
+        context = self._compose_context(
+            gewechat_msg.ctype,
+            gewechat_msg.content,
+            isgroup=gewechat_msg.is_group,
+            msg=gewechat_msg,
+        )
+        if context:
+            self.produce(context)
 
     def split_sentence(self, sentence, n = 4):
         # Using regex to split by period, question mark, or exclamation mark, keeping the delimiter
@@ -132,17 +250,23 @@ class GeWeChatChannel(ChatChannel):
         return result
 
     def send(self, reply: Reply, context: Context):
+        # 提交到出站队列后立即返回，由出站线程池按接收者顺序发送
+        self.outbound.submit(reply, context)
+
+    def _split_reply(self, reply: Reply):
+        if reply.type in [ReplyType.TEXT, ReplyType.ERROR, ReplyType.INFO]:
+            return [Reply(reply.type, rep) for rep in self.split_sentence(reply.content, n=4)]
+        return [reply]
+
+    def _deliver(self, reply: Reply, context: Context):
         receiver = context["receiver"]
         gewechat_message = context.get("msg")
         if reply.type in [ReplyType.TEXT, ReplyType.ERROR, ReplyType.INFO]:
             reply_text = reply.content
-            reply_list = self.split_sentence(reply_text, n=4)
             ats = ""
             if gewechat_message and gewechat_message.is_group:
                 ats = gewechat_message.actual_user_id
-            # self.client.post_text(self.app_id, receiver, reply_text, ats)
-            for rep in reply_list:
-                self.client.post_text(self.app_id, receiver, rep, ats)
+            self.client.post_text(self.app_id, receiver, reply_text, ats)
             logger.info("[gewechat] Do send text to {}: {}".format(receiver, reply_text))
         elif reply.type == ReplyType.VOICE:
             try:
@@ -150,7 +274,7 @@ class GeWeChatChannel(ChatChannel):
                 if content.endswith('.mp3'):
                     # 如果是mp3文件，转换为silk格式
                     silk_path = content + '.silk'
-                    duration = mp3_to_silk(content, silk_path)
+                    duration = run_in_cpu_pool(mp3_to_silk, content, silk_path)
                     callback_url = conf().get("gewechat_callback_url")
                     silk_url = callback_url + "?file=" + silk_path
                     self.client.post_voice(self.app_id, receiver, silk_url, duration)
@@ -163,11 +287,10 @@ class GeWeChatChannel(ChatChannel):
         elif reply.type == ReplyType.IMAGE_URL or reply.type == ReplyType.IMAGE:
             image_storage = reply.content
             if reply.type == ReplyType.IMAGE_URL:
-                import requests
                 import io
                 img_url = reply.content
                 logger.debug(f"[gewechat]sendImage, download image start, img_url={img_url}")
-                pic_res = requests.get(img_url, stream=True)
+                pic_res = http_client.get(img_url, stream=True)
                 image_storage = io.BytesIO()
                 size = 0
                 for block in pic_res.iter_content(1024):
@@ -190,7 +313,7 @@ class GeWeChatChannel(ChatChannel):
             image_storage.seek(0)
             extension = ".gif" if header.startswith((b'GIF87a', b'GIF89a')) else ".png"
             img_file_name = f"img_{str(uuid.uuid4())}{extension}"
-            img_file_path = TmpDir().path() + img_file_name
+            img_file_path = TmpDir().file(img_file_name)
             with open(img_file_path, "wb") as f:
                 f.write(img_data)
             # Construct callback URL
@@ -205,7 +328,7 @@ class GeWeChatChannel(ChatChannel):
                 logger.info("[gewechat] sendImage, receiver={}, url={}, result={}".format(receiver, img_url, result))
             if result.get('ret') == 200:
                 newMsgId = result['data'].get('newMsgId')
-                new_img_file_path = TmpDir().path() + str(newMsgId) + extension
+                new_img_file_path = TmpDir().file(str(newMsgId) + extension)
                 os.rename(img_file_path, new_img_file_path)
                 logger.info("[gewechat] sendImage rename to {}".format(new_img_file_path))
 
@@ -236,46 +359,29 @@ class Query:
         channel = GeWeChatChannel()
         web_data = web.data()
         logger.debug("[gewechat] receive data: {}".format(web_data))
-        data = json.loads(web_data)
+        try:
+            data = json.loads(web_data)
+        except ValueError:
+            logger.warning(f"[gewechat] invalid callback data: {web_data}")
+            return "success"
         
         # gewechat服务发送的回调测试消息
         if isinstance(data, dict) and 'testMsg' in data and 'token' in data:
             logger.debug(f"[gewechat] 收到gewechat服务发送的回调测试消息")
             return "success"
 
-        gewechat_msg = GeWeChatMessage(data, channel.client)
-        
-        # 微信客户端的状态同步消息
-        if gewechat_msg.ctype == ContextType.STATUS_SYNC:
-            logger.debug(f"[gewechat] ignore status sync message: {gewechat_msg.content}")
-            return "success"
-
-        # 忽略非用户消息（如公众号、系统通知等）
-        if gewechat_msg.ctype == ContextType.NON_USER_MSG:
-            logger.debug(f"[gewechat] ignore non-user message from {gewechat_msg.from_user_id}: {gewechat_msg.content}")
-            return "success"
-
-        # 判断是否需要忽略语音消息
-        if gewechat_msg.ctype == ContextType.VOICE:
-            if conf().get("speech_recognition") != True:
-                return "success"
-
-        # 忽略来自自己的消息
-        if gewechat_msg.my_msg:
-            logger.debug(f"[gewechat] ignore message from myself: {gewechat_msg.actual_user_id}: {gewechat_msg.content}")
+        # 联系人或群信息变更，使缓存的昵称和群成员失效
+        if isinstance(data, dict) and data.get('TypeName') in ['ModContacts', 'DelContacts']:
+            # 回调内容不完整（如Data为null）时直接忽略，避免返回500导致gewechat反复重发
+            contact = data.get('Data') or {}
+            user_name = contact.get('UserName') if isinstance(contact, dict) else None
+            wxid = user_name.get('string') if isinstance(user_name, dict) else None
+            if wxid:
+                get_contact_cache().invalidate(wxid)
             return "success"
 
-        # 忽略过期的消息
-        if int(gewechat_msg.create_time) < int(time.time()) - 60 * 5: # 跳过5分钟前的历史消息
-            logger.debug(f"[gewechat] ignore expired message from {gewechat_msg.actual_user_id}: {gewechat_msg.content}")
-            return "success"
-
-        context = channel._compose_context(
-            gewechat_msg.ctype,
-            gewechat_msg.content,
-            isgroup=gewechat_msg.is_group,
-            msg=gewechat_msg,
-        )
-        if context:
-            channel.produce(context)
+        # 只做校验、去重和入队，消息解析、查询联系人等耗时操作由ingress线程处理，尽快响应gewechat
+        if not channel.enqueue_callback(data):
+            # 返回非200状态，让gewechat稍后重发
+            raise web.HTTPError("503 Service Unavailable", {"Content-Type": "text/plain"}, "busy")
         return "success"
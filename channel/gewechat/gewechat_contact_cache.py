@@ -0,0 +1,69 @@
+import threading
+import time
+
+from common.expired_dict import ExpiredDict
+from common.log import logger
+from config import conf
+
+
+class GeWeChatContactCache(object):
+    """
+    缓存好友/群的昵称和群成员列表，避免每条群消息都请求gewechat接口
+    收到ModContacts/DelContacts或进群、退群消息时调用invalidate使缓存失效
+    """
+
+    def __init__(self, ttl):
+        self.nicknames = ExpiredDict(ttl)  # wxid/chatroom_id -> nickname
+        self.members = ExpiredDict(ttl)  # chatroom_id -> {wxid: 群昵称或昵称}
+        self.member_refresh_time = {}  # chatroom_id -> 上次拉取群成员的时间
+        self.refresh_interval = 60  # 成员不在缓存中时最多每60秒重新拉取一次，防止非群成员消息反复触发请求
+        self.lock = threading.Lock()
+
+    def get_nickname(self, client, app_id, wxid):
+        nickname = self.nicknames.get(wxid)
+        if nickname is not None:
+            return nickname
+        response = client.get_brief_info(app_id, [wxid])
+        if response.get('ret') == 200 and response.get('data'):
+            nickname = response['data'][0].get('nickName') or wxid
+            self.nicknames[wxid] = nickname
+        return nickname
+
+    def get_member_nickname(self, client, app_id, chatroom_id, wxid):
+        members = self.members.get(chatroom_id)
+        if members is None or (wxid not in members and self._can_refresh(chatroom_id)):
+            members = self._load_members(client, app_id, chatroom_id)
+        return members.get(wxid) if members else None
+
+    def invalidate(self, wxid):
+        """联系人或群信息变更"""
+        self.nicknames.pop(wxid, None)
+        self.members.pop(wxid, None)
+        with self.lock:
+            self.member_refresh_time.pop(wxid, None)
+        logger.debug("[gewechat] contact cache invalidated: {}".format(wxid))
+
+    def _can_refresh(self, chatroom_id):
+        with self.lock:
+            return time.monotonic() - self.member_refresh_time.get(chatroom_id, 0) > self.refresh_interval
+
+    def _load_members(self, client, app_id, chatroom_id):
+        with self.lock:
+            self.member_refresh_time[chatroom_id] = time.monotonic()
+        response = client.get_chatroom_member_list(app_id, chatroom_id)
+        if response.get('ret') != 200 or not response.get('data', {}).get('memberList'):
+            return None
+        # 先取displayName，如果displayName为空，再取nickName
+        members = {member['wxid']: member.get('displayName') or member.get('nickName') for member in response['data']['memberList']}
+        self.members[chatroom_id] = members
+        return members
+
+
+_contact_cache = None
+
+
+def get_contact_cache() -> GeWeChatContactCache:
+    global _contact_cache
+    if _contact_cache is None:
+        _contact_cache = GeWeChatContactCache(conf().get("gewechat_contact_cache_ttl", 3600))
+    return _contact_cache
@@ -3,11 +3,12 @@ import uuid
 import re
 from bridge.context import ContextType
 from channel.chat_message import ChatMessage
+from channel.gewechat.gewechat_contact_cache import get_contact_cache
 from common.log import logger
 from common.tmp_dir import TmpDir
+from common import http_client
 from config import conf
 from lib.gewechat import GewechatClient
-import requests
 import xml.etree.ElementTree as ET
 
 # 私聊信息示例
@@ -350,13 +351,13 @@ class GeWeChatMessage(ChatMessage):
             if 'ImgBuf' in self.msg_data and 'buffer' in self.msg_data['ImgBuf'] and self.msg_data['ImgBuf']['buffer']:
                 silk_data = base64.b64decode(self.msg_data['ImgBuf']['buffer'])
                 silk_file_name = f"voice_{uuid.uuid4()}.silk"
-                silk_file_path = TmpDir().path() + silk_file_name
+                silk_file_path = TmpDir().file(silk_file_name)
                 with open(silk_file_path, "wb") as f:
                     f.write(silk_data)
                 self.content = silk_file_path
         elif msg_type == 3:  # Image message
             self.ctype = ContextType.IMAGE
-            self.content = TmpDir().path() + str(self.msg_id) + ".png"
+            self.content = TmpDir().file(str(self.msg_id) + ".png")
             self._prepare_fn = self.download_image
         elif msg_type == 49:  # 引用消息，小程序，公众号等
             # After getting content_xml
@@ -487,10 +488,13 @@ class GeWeChatMessage(ChatMessage):
             raise NotImplementedError(f"Unsupported message type: Type:{msg_type}")
 
         # 获取群聊或好友的名称
-        brief_info_response = self.client.get_brief_info(self.app_id, [self.other_user_id])
-        if brief_info_response.get('ret') == 200 and brief_info_response.get('data'):
-            brief_info = brief_info_response['data'][0]
-            self.other_user_nickname = brief_info.get('nickName', self.other_user_id)
+        contact_cache = get_contact_cache()
+        if self.ctype in [ContextType.JOIN_GROUP, ContextType.EXIT_GROUP]:
+            # 群成员变化，重新拉取群成员列表
+            contact_cache.invalidate(self.from_user_id)
+        nickname = contact_cache.get_nickname(self.client, self.app_id, self.other_user_id)
+        if nickname:
+            self.other_user_nickname = nickname
 
         if self.is_group:
             # 如果是群聊消息，获取实际发送者信息
@@ -528,14 +532,9 @@ class GeWeChatMessage(ChatMessage):
                 }
             }
             """
-            chatroom_member_list_response = self.client.get_chatroom_member_list(self.app_id, self.from_user_id)
-            if chatroom_member_list_response.get('ret') == 200 and chatroom_member_list_response.get('data', {}).get('memberList'):
-                # 从群成员列表中匹配acual_user_id
-                for member_info in chatroom_member_list_response['data']['memberList']:
-                    if member_info['wxid'] == self.actual_user_id:
-                         # 先获取displayName，如果displayName为空，再获取nickName
-                        self.actual_user_nickname = member_info.get('displayName') or member_info.get('nickName', self.actual_user_id)
-                        break
+            member_nickname = contact_cache.get_member_nickname(self.client, self.app_id, self.from_user_id, self.actual_user_id)
+            if member_nickname:
+                self.actual_user_nickname = member_nickname
             self.actual_user_nickname = self.actual_user_nickname or self.actual_user_id
 
                         # 检查是否被at
@@ -603,7 +602,7 @@ class GeWeChatMessage(ChatMessage):
                 download_url = conf().get("gewechat_download_url").rstrip('/')
                 full_url = download_url + '/' + file_url
                 try:
-                    file_data = requests.get(full_url).content
+                    file_data = http_client.get(full_url).content
                 except Exception as e:
                     logger.error(f"[gewechat] Failed to download image file: {e}")
                     return
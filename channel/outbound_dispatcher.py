@@ -0,0 +1,167 @@
+"""
+channel出站消息队列：
+- 同一接收者的消息按提交顺序逐条发送，上一条发送完成后才发送下一条
+- 按平台限制整体发送速率，超出时延后调度，不占用线程等待
+- 发送失败时延后重试，重试期间同一接收者的后续消息继续排队，保证顺序
+- 接收者有积压时，可以把相邻的文本消息合并为一条发送
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+
+from bridge.context import Context
+from bridge.reply import Reply, ReplyType
+from common import metrics
+from common.log import logger
+from common.tmp_dir import TmpDir
+from common.token_bucket import get_token_bucket
+from common.worker_pool import call_later, get_outbound_pool
+
+
+class _OutboundItem(object):
+    __slots__ = ("reply", "context", "group", "retries", "submit_time")
+
+    def __init__(self, reply, context, group):
+        self.reply = reply
+        self.context = context
+        self.group = group  # 同一次提交拆分出的消息属于同一组，不会再被合并
+        self.retries = 0
+        self.submit_time = time.monotonic()
+
+
+class OutboundDispatcher(object):
+    def __init__(self, name, deliver, split=None, qps=0, receiver_interval=0, max_retries=2, retry_delay=3, coalesce_text=False, max_text_length=0):
+        """
+        :param deliver: 实际发送单条消息的函数 deliver(reply, context)，失败时抛出异常
+        :param split: 拆分回复的函数 split(reply) -> [reply]，如长文本按平台长度限制拆分
+        :param qps: 整个channel每秒最多发送的消息数，0表示不限制
+        :param receiver_interval: 同一接收者两条消息之间的最小间隔，单位秒
+        :param max_text_length: 合并文本的最大长度，0表示不限制
+        """
+        self.name = name
+        self.deliver = deliver
+        self.split = split
+        self.limiter = get_token_bucket("outbound_" + name, qps * 60, capacity=max(1, int(qps))) if qps else None
+        self.receiver_interval = receiver_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.coalesce_text = coalesce_text
+        self.max_text_length = max_text_length
+        self.queues = {}  # receiver -> deque[_OutboundItem]
+        self.active = set()  # 正在发送或等待调度的接收者，每个接收者同时只有一条消息在发送
+        self.lock = threading.Lock()
+        self.groups = itertools.count()
+        self.stats = {"submitted": 0, "sent": 0, "retried": 0, "failed": 0, "coalesced": 0, "latency_total": 0.0, "latency_max": 0.0}
+        metrics.register_collector(self._collect_metrics)
+
+    def submit(self, reply: Reply, context: Context):
+        """提交回复并立即返回，消息由出站线程池发送"""
+        receiver = context["receiver"]
+        replies = self.split(reply) if self.split else [reply]
+        group = next(self.groups)
+        with self.lock:
+            queue = self.queues.setdefault(receiver, deque())
+            for item in replies:
+                TmpDir().hold_reply(item)  # 排队期间不清理回复的临时文件，发送完成或放弃后释放
+                queue.append(_OutboundItem(item, context, group))
+            self.stats["submitted"] += len(replies)
+            if receiver in self.active:
+                return
+            self.active.add(receiver)
+        self._dispatch(receiver)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["pending"] = sum(len(queue) for queue in self.queues.values())
+            stats["receivers"] = len(self.queues)
+        latency_total = stats.pop("latency_total")
+        stats["latency_avg_ms"] = round(latency_total * 1000 / stats["sent"], 2) if stats["sent"] else 0
+        stats["latency_max_ms"] = round(stats.pop("latency_max") * 1000, 2)
+        stats["name"] = self.name
+        return stats
+
+    def _collect_metrics(self):
+        stats = self.get_stats()
+        labels = {"channel": self.name}
+        return [
+            ("outbound_pending", "gauge", "Replies waiting in outbound queues", [(labels, stats["pending"])]),
+            ("outbound_receivers", "gauge", "Receivers with queued replies", [(labels, stats["receivers"])]),
+            ("outbound_sent_total", "counter", "Replies sent by outbound queues", [(labels, stats["sent"])]),
+            ("outbound_failed_total", "counter", "Replies dropped after retries", [(labels, stats["failed"])]),
+        ]
+
+    def _dispatch(self, receiver):
+        # 先预订令牌，需要等待时到时间再发送，不占用线程
+        wait = self.limiter.reserve() if self.limiter else 0
+        if wait > 0:
+            call_later(wait, self._submit, receiver)
+        else:
+            self._submit(receiver)
+
+    def _submit(self, receiver):
+        with self.lock:
+            item = self._take(receiver)
+        get_outbound_pool().submit(self._send, receiver, item)
+
+    def _take(self, receiver):
+        """取出队首消息，开启合并时把后续可合并的文本并入，需持有锁"""
+        queue = self.queues[receiver]
+        item = queue.popleft()
+        if not self.coalesce_text or item.retries or item.reply.type != ReplyType.TEXT:
+            return item
+        content = item.reply.content
+        while queue:
+            next_item = queue[0]
+            if next_item.reply.type != ReplyType.TEXT or next_item.context is not item.context or next_item.group == item.group:
+                break
+            merged = content + "\n" + next_item.reply.content
+            if self.max_text_length and len(merged.encode("utf-8")) > self.max_text_length:
+                break
+            queue.popleft()
+            content = merged
+            item.group = next_item.group
+            self.stats["coalesced"] += 1
+        if content is not item.reply.content:
+            item.reply = Reply(ReplyType.TEXT, content)
+        return item
+
+    def _send(self, receiver, item):
+        try:
+            with metrics.span("deliver", channel=self.name, context_type=metrics.context_type_name(item.context)):
+                self.deliver(item.reply, item.context)
+        except Exception as e:
+            if not isinstance(e, NotImplementedError) and item.retries < self.max_retries:
+                item.retries += 1
+                logger.warning("[{}] send to {} failed, retry {} later: {}".format(self.name, receiver, item.retries, e))
+                with self.lock:
+                    self.queues[receiver].appendleft(item)
+                    self.stats["retried"] += 1
+                call_later(self.retry_delay * item.retries, self._dispatch, receiver)
+                return
+            logger.exception("[{}] send to {} failed: {}".format(self.name, receiver, e))
+            TmpDir().release_reply(item.reply)
+            with self.lock:
+                self.stats["failed"] += 1
+        else:
+            TmpDir().release_reply(item.reply)
+            latency = time.monotonic() - item.submit_time
+            metrics.observe("outbound_latency", latency, channel=self.name, context_type=metrics.context_type_name(item.context))
+            with self.lock:
+                self.stats["sent"] += 1
+                self.stats["latency_total"] += latency
+                self.stats["latency_max"] = max(self.stats["latency_max"], latency)
+        self._next(receiver)
+
+    def _next(self, receiver):
+        with self.lock:
+            if not self.queues[receiver]:
+                del self.queues[receiver]
+                self.active.discard(receiver)
+                return
+        if self.receiver_interval:
+            call_later(self.receiver_interval, self._dispatch, receiver)
+        else:
+            self._dispatch(receiver)
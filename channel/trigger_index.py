@@ -0,0 +1,142 @@
+"""
+预编译的消息触发规则：群名白名单、昵称黑名单、前缀、关键词等
+配置修改或重新加载后自动重建，避免每条消息都遍历配置列表
+"""
+
+import re
+import threading
+from functools import lru_cache
+
+from config import ConfigSnapshot, config_snapshot
+
+
+class PrefixMatcher(object):
+    """前缀字典树，返回列表中最靠前的匹配前缀，与check_prefix的结果一致"""
+
+    def __init__(self, prefix_list):
+        self.root = {}
+        self.empty_index = None  # 空字符串前缀匹配所有内容
+        for index, prefix in enumerate(prefix_list or []):
+            if prefix == "":
+                if self.empty_index is None:
+                    self.empty_index = index
+                continue
+            node = self.root
+            for ch in prefix:
+                node = node.setdefault(ch, {})
+            node.setdefault("", (index, prefix))  # 重复的前缀保留第一个
+
+    def match(self, content):
+        best = None
+        if self.empty_index is not None:
+            best = (self.empty_index, "")
+        node = self.root
+        for ch in content:
+            node = node.get(ch)
+            if node is None:
+                break
+            end = node.get("")
+            if end and (best is None or end[0] < best[0]):
+                best = end
+        return best[1] if best else None
+
+
+class KeywordMatcher(object):
+    """Aho-Corasick多模式匹配，一次扫描判断内容是否包含任一关键词"""
+
+    def __init__(self, keyword_list):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [False]
+        self.match_all = False
+        for keyword in keyword_list or []:
+            if keyword == "":
+                self.match_all = True
+                continue
+            state = 0
+            for ch in keyword:
+                next_state = self.goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(False)
+                    self.goto[state][ch] = next_state
+                state = next_state
+            self.output[state] = True
+        self._build_fail()
+
+    def _build_fail(self):
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and ch not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(ch, 0)
+                self.output[next_state] = self.output[next_state] or self.output[self.fail[next_state]]
+
+    def contains(self, content):
+        if self.match_all:
+            return True
+        if len(self.goto) == 1 or not content:
+            return None
+        state = 0
+        for ch in content:
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            if self.output[state]:
+                return True
+        return None
+
+
+class NameMatcher(object):
+    """名单匹配，支持ALL_GROUP表示全部"""
+
+    def __init__(self, name_list):
+        self.names = set(name_list or [])
+        self.match_all = "ALL_GROUP" in self.names
+
+    def __contains__(self, name):
+        return self.match_all or name in self.names
+
+
+class TriggerIndex(object):
+    def __init__(self, config):
+        self.group_name_white_list = NameMatcher(config.get("group_name_white_list", []))
+        self.group_name_keyword_white_list = KeywordMatcher(config.get("group_name_keyword_white_list", []))
+        self.group_chat_in_one_session = NameMatcher(config.get("group_chat_in_one_session", []))
+        self.nick_name_black_list = set(config.get("nick_name_black_list", []) or [])
+        self.group_chat_prefix = PrefixMatcher(config.get("group_chat_prefix"))
+        self.group_chat_keyword = KeywordMatcher(config.get("group_chat_keyword"))
+        self.single_chat_prefix = PrefixMatcher(config.get("single_chat_prefix", [""]))
+        self.image_create_prefix = PrefixMatcher(config.get("image_create_prefix", [""]))
+
+    def is_group_allowed(self, group_name):
+        return group_name in self.group_name_white_list or self.group_name_keyword_white_list.contains(group_name) is not None
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_trigger_index(snapshot: ConfigSnapshot = None) -> TriggerIndex:
+    """返回配置快照对应的触发规则，每个配置版本只构建一次"""
+    global _index, _index_version
+    if snapshot is None:
+        snapshot = config_snapshot()
+    if _index is None or _index_version != snapshot.version:
+        with _index_lock:
+            if _index is None or _index_version != snapshot.version:
+                _index = TriggerIndex(snapshot)
+                _index_version = snapshot.version
+    return _index
+
+
+@lru_cache(maxsize=1024)
+def mention_pattern(name):
+    """@某人 的正则，编译结果按名字缓存"""
+    return re.compile(f"@{re.escape(name)}(\u2005|\u0020)")
@@ -9,6 +9,8 @@ from channel.chat_channel import ChatChannel, check_prefix
 from channel.chat_message import ChatMessage
 from common.log import logger
 from common.singleton import singleton
+from common import http_client
+from common.web_server import run_web_app
 from config import conf
 import os
 
@@ -64,11 +66,10 @@ class WebChannel(ChatChannel):
             elif reply.type == ReplyType.IMAGE_URL:
                 import io
 
-                import requests
                 from PIL import Image
 
                 img_url = reply.content
-                pic_res = requests.get(img_url, stream=True)
+                pic_res = http_client.get(img_url, stream=True)
                 image_storage = io.BytesIO()
                 for block in pic_res.iter_content(1024):
                     image_storage.write(block)
@@ -186,7 +187,7 @@ class WebChannel(ChatChannel):
         )
         port = conf().get("web_port", 9899)
         app = web.application(urls, globals(), autoreload=False)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        run_web_app(app, port, name="web")
 
 
 class SSEHandler:
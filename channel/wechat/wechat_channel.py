@@ -9,7 +9,6 @@ import json
 import os
 import threading
 import time
-import requests
 
 from bridge.context import *
 from bridge.reply import *
@@ -21,6 +20,7 @@ from common.log import logger
 from common.singleton import singleton
 from common.time_check import time_checker
 from common.utils import convert_webp_to_png, remove_markdown_symbol
+from common import http_client
 from config import conf, get_appdata_dir
 from lib import itchat
 from lib.itchat.content import *
@@ -119,7 +119,7 @@ def qrCallback(uuid, status, qrcode):
         qrcodes = [qr_api2, qr_api1, qr_api3, qr_api4]
         for item in qrcodes:
             try:
-                response = requests.get(item)
+                response = http_client.get(item)
                 response.raise_for_status()
                 with open("tmp/login.png", "wb") as f:
                     f.write(response.content)
@@ -276,7 +276,7 @@ class WechatChannel(ChatChannel):
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             img_url = reply.content
             logger.debug(f"[WX] start download image, img_url={img_url}")
-            pic_res = requests.get(img_url, stream=True)
+            pic_res = http_client.get(img_url, stream=True)
             image_storage = io.BytesIO()
             size = 0
             for block in pic_res.iter_content(1024):
@@ -308,7 +308,7 @@ class WechatChannel(ChatChannel):
         elif reply.type == ReplyType.VIDEO_URL:  # 新增视频URL回复类型
             video_url = reply.content
             logger.debug(f"[WX] start download video, video_url={video_url}")
-            video_res = requests.get(video_url, stream=True)
+            video_res = http_client.get(video_url, stream=True)
             video_storage = io.BytesIO()
             size = 0
             for block in video_res.iter_content(1024):
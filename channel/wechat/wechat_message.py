@@ -24,11 +24,11 @@ class WechatMessage(ChatMessage):
             self.content = itchat_msg["Text"]
         elif itchat_msg["Type"] == VOICE:
             self.ctype = ContextType.VOICE
-            self.content = TmpDir().path() + itchat_msg["FileName"]  # content直接存临时目录路径
+            self.content = TmpDir().file(itchat_msg["FileName"])  # content直接存临时目录路径
             self._prepare_fn = lambda: itchat_msg.download(self.content)
         elif itchat_msg["Type"] == PICTURE and itchat_msg["MsgType"] == 3:
             self.ctype = ContextType.IMAGE
-            self.content = TmpDir().path() + itchat_msg["FileName"]  # content直接存临时目录路径
+            self.content = TmpDir().file(itchat_msg["FileName"])  # content直接存临时目录路径
             self._prepare_fn = lambda: itchat_msg.download(self.content)
         elif itchat_msg["Type"] == NOTE and itchat_msg["MsgType"] == 10000:
             if is_group:
@@ -76,7 +76,7 @@ class WechatMessage(ChatMessage):
                 raise NotImplementedError("Unsupported note message: " + itchat_msg["Content"])
         elif itchat_msg["Type"] == ATTACHMENT:
             self.ctype = ContextType.FILE
-            self.content = TmpDir().path() + itchat_msg["FileName"]  # content直接存临时目录路径
+            self.content = TmpDir().file(itchat_msg["FileName"])  # content直接存临时目录路径
             self._prepare_fn = lambda: itchat_msg.download(self.content)
         elif itchat_msg["Type"] == SHARING:
             self.ctype = ContextType.SHARING
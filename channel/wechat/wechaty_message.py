@@ -41,7 +41,7 @@ class WechatyMessage(ChatMessage, aobject):
         elif wechaty_msg.type() == MessageType.MESSAGE_TYPE_AUDIO:
             self.ctype = ContextType.VOICE
             voice_file = await wechaty_msg.to_file_box()
-            self.content = TmpDir().path() + voice_file.name  # content直接存临时目录路径
+            self.content = TmpDir().file(voice_file.name)  # content直接存临时目录路径
 
             def func():
                 loop = asyncio.get_event_loop()
@@ -1,9 +1,7 @@
 # -*- coding=utf-8 -*-
 import io
 import os
-import time
 
-import requests
 import web
 from wechatpy.enterprise import create_reply, parse_message
 from wechatpy.enterprise.crypto import WeChatCrypto
@@ -13,11 +11,16 @@ from wechatpy.exceptions import InvalidSignatureException, WeChatClientException
 from bridge.context import Context
 from bridge.reply import Reply, ReplyType
 from channel.chat_channel import ChatChannel
+from channel.outbound_dispatcher import OutboundDispatcher
 from channel.wechatcom.wechatcomapp_client import WechatComAppClient
 from channel.wechatcom.wechatcomapp_message import WechatComAppMessage
 from common.log import logger
+from common.shared_state import get_shared_state
 from common.singleton import singleton
 from common.utils import compress_imgfile, fsize, split_string_by_utf8_length, convert_webp_to_png, remove_markdown_symbol
+from common.worker_pool import run_in_cpu_pool
+from common import http_client
+from common.web_server import run_web_app
 from config import conf, subscribe_msg
 from voice.audio_convert import any_to_amr, split_audio
 
@@ -41,62 +44,80 @@ class WechatComAppChannel(ChatChannel):
         )
         self.crypto = WeChatCrypto(self.token, self.aes_key, self.corp_id)
         self.client = WechatComAppClient(self.corp_id, self.secret)
+        self.outbound = OutboundDispatcher(
+            "wechatcom",
+            self._deliver,
+            split=self._split_reply,
+            qps=conf().get("wechatcomapp_send_qps", 10),
+            receiver_interval=0.5,  # 同一用户的消息间隔0.5秒，防止发送过快乱序
+            max_retries=conf().get("outbound_max_retries", 2),
+            coalesce_text=conf().get("outbound_coalesce_text", True),
+            max_text_length=MAX_UTF8_LEN,
+        )
 
     def startup(self):
         # start message listener
         urls = ("/wxcomapp/?", "channel.wechatcom.wechatcomapp_channel.Query")
         app = web.application(urls, globals(), autoreload=False)
         port = conf().get("wechatcomapp_port", 9898)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        run_web_app(app, port, name="wechatcom_app")
 
     def send(self, reply: Reply, context: Context):
-        receiver = context["receiver"]
+        # 提交到出站队列后立即返回，由出站线程池按接收者顺序发送
+        self.outbound.submit(reply, context)
+
+    def _split_reply(self, reply: Reply):
+        """长文本按长度拆分，长语音转换为amr后按60秒拆分"""
         if reply.type in [ReplyType.TEXT, ReplyType.ERROR, ReplyType.INFO]:
-            reply_text = remove_markdown_symbol(reply.content)
-            texts = split_string_by_utf8_length(reply_text, MAX_UTF8_LEN)
+            texts = split_string_by_utf8_length(remove_markdown_symbol(reply.content), MAX_UTF8_LEN)
             if len(texts) > 1:
                 logger.info("[wechatcom] text too long, split into {} parts".format(len(texts)))
-            for i, text in enumerate(texts):
-                self.client.message.send_text(self.agent_id, receiver, text)
-                if i != len(texts) - 1:
-                    time.sleep(0.5)  # 休眠0.5秒，防止发送过快乱序
-            logger.info("[wechatcom] Do send text to {}: {}".format(receiver, reply_text))
-        elif reply.type == ReplyType.VOICE:
+            return [Reply(reply.type, text) for text in texts]
+        if reply.type == ReplyType.VOICE:
+            file_path = reply.content
+            amr_file = os.path.splitext(file_path)[0] + ".amr"
             try:
-                media_ids = []
-                file_path = reply.content
-                amr_file = os.path.splitext(file_path)[0] + ".amr"
-                any_to_amr(file_path, amr_file)
+                run_in_cpu_pool(any_to_amr, file_path, amr_file)
                 duration, files = split_audio(amr_file, 60 * 1000)
-                if len(files) > 1:
-                    logger.info("[wechatcom] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
-                for path in files:
-                    response = self.client.media.upload("voice", open(path, "rb"))
-                    logger.debug("[wechatcom] upload voice response: {}".format(response))
-                    media_ids.append(response["media_id"])
-            except WeChatClientException as e:
-                logger.error("[wechatcom] upload voice failed: {}".format(e))
-                return
+            except Exception as e:
+                logger.error("[wechatcom] convert voice failed: {}".format(e))
+                return []
+            if len(files) > 1:
+                logger.info("[wechatcom] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
+            for path in {file_path, amr_file} - set(files):
+                try:
+                    os.remove(path)
+                except Exception:
+                    pass
+            return [Reply(ReplyType.VOICE, path) for path in files]
+        return [reply]
+
+    def _deliver(self, reply: Reply, context: Context):
+        receiver = context["receiver"]
+        if reply.type in [ReplyType.TEXT, ReplyType.ERROR, ReplyType.INFO]:
+            self.client.message.send_text(self.agent_id, receiver, reply.content)
+            logger.info("[wechatcom] Do send text to {}: {}".format(receiver, reply.content))
+        elif reply.type == ReplyType.VOICE:
+            path = reply.content
+            with open(path, "rb") as f:
+                response = self.client.media.upload("voice", f)
+            logger.debug("[wechatcom] upload voice response: {}".format(response))
+            self.client.message.send_voice(self.agent_id, receiver, response["media_id"])
             try:
-                os.remove(file_path)
-                if amr_file != file_path:
-                    os.remove(amr_file)
+                os.remove(path)
             except Exception:
                 pass
-            for media_id in media_ids:
-                self.client.message.send_voice(self.agent_id, receiver, media_id)
-                time.sleep(1)
-            logger.info("[wechatcom] sendVoice={}, receiver={}".format(reply.content, receiver))
+            logger.info("[wechatcom] sendVoice={}, receiver={}".format(path, receiver))
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             img_url = reply.content
-            pic_res = requests.get(img_url, stream=True)
+            pic_res = http_client.get(img_url, stream=True)
             image_storage = io.BytesIO()
             for block in pic_res.iter_content(1024):
                 image_storage.write(block)
             sz = fsize(image_storage)
             if sz >= 10 * 1024 * 1024:
                 logger.info("[wechatcom] image too large, ready to compress, sz={}".format(sz))
-                image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
+                image_storage = run_in_cpu_pool(compress_imgfile, image_storage, 10 * 1024 * 1024 - 1)
                 logger.info("[wechatcom] image compressed, sz={}".format(fsize(image_storage)))
             image_storage.seek(0)
             if ".webp" in img_url:
@@ -119,7 +140,7 @@ class WechatComAppChannel(ChatChannel):
             sz = fsize(image_storage)
             if sz >= 10 * 1024 * 1024:
                 logger.info("[wechatcom] image too large, ready to compress, sz={}".format(sz))
-                image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
+                image_storage = run_in_cpu_pool(compress_imgfile, image_storage, 10 * 1024 * 1024 - 1)
                 logger.info("[wechatcom] image compressed, sz={}".format(fsize(image_storage)))
             image_storage.seek(0)
             try:
@@ -174,6 +195,10 @@ class Query:
             except NotImplementedError as e:
                 logger.debug("[wechatcom] " + str(e))
                 return "success"
+            # 企业微信未及时收到响应会重试，多进程部署时重试可能落到其他进程
+            if not get_shared_state().add_if_absent("wechatcom:msg:{}".format(wechatcom_msg.msg_id), ttl=60 * 10):
+                logger.debug("[wechatcom] ignore duplicated message, msg_id={}".format(wechatcom_msg.msg_id))
+                return "success"
             context = channel._compose_context(
                 wechatcom_msg.ctype,
                 wechatcom_msg.content,
@@ -4,7 +4,6 @@ import json
 import os
 import time
 
-import requests
 import web
 from wechatpy.enterprise import create_reply, parse_message
 from wechatpy.enterprise.crypto import WeChatCrypto
@@ -19,12 +18,14 @@ from channel.wechatcs.wechatcomservice_message import WechatComServiceMessage
 from common.log import logger
 from common.singleton import singleton
 from common.utils import compress_imgfile, fsize, split_string_by_utf8_length
+from common.worker_pool import run_in_cpu_pool
+from common import http_client
+from common.web_server import run_web_app
 from config import conf, subscribe_msg
 from voice.audio_convert import any_to_amr, split_audio
 
 import web
 import json
-import requests
 import xml.etree.ElementTree as ET
 from wechatpy.enterprise.crypto import WeChatCrypto
 from wechatpy.exceptions import InvalidSignatureException
@@ -61,7 +62,7 @@ class WechatComServiceChannel(ChatChannel):
         urls = ("/wxcomapp", "channel.wechatcs.wechatcomservice_channel.Query")
         app = web.application(urls, globals(), autoreload=False)
         port = conf().get("wechatcomapp_port", 9898)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        run_web_app(app, port, name="wechatcom_service")
 
     def send(self, reply: Reply, context: Context):
         receiver = context["receiver"]
@@ -83,7 +84,7 @@ class WechatComServiceChannel(ChatChannel):
                 media_ids = []
                 file_path = reply.content
                 amr_file = os.path.splitext(file_path)[0] + ".amr"
-                any_to_amr(file_path, amr_file)
+                run_in_cpu_pool(any_to_amr, file_path, amr_file)
                 duration, files = split_audio(amr_file, 60 * 1000)
                 if len(files) > 1:
                     logger.info(
@@ -110,14 +111,14 @@ class WechatComServiceChannel(ChatChannel):
             logger.info("[wechatcs] sendVoice={}, receiver={}".format(reply.content, receiver))
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             img_url = reply.content
-            pic_res = requests.get(img_url, stream=True)
+            pic_res = http_client.get(img_url, stream=True)
             image_storage = io.BytesIO()
             for block in pic_res.iter_content(1024):
                 image_storage.write(block)
             sz = fsize(image_storage)
             if sz >= 10 * 1024 * 1024:
                 logger.info("[wechatcs] image too large, ready to compress, sz={}".format(sz))
-                image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
+                image_storage = run_in_cpu_pool(compress_imgfile, image_storage, 10 * 1024 * 1024 - 1)
                 logger.info("[wechatcs] image compressed, sz={}".format(fsize(image_storage)))
             image_storage.seek(0)
             try:
@@ -136,7 +137,7 @@ class WechatComServiceChannel(ChatChannel):
 
             if sz >= 10 * 1024 * 1024:
                 logger.info("[wechatcs] image too large, ready to compress, sz={}".format(sz))
-                image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
+                image_storage = run_in_cpu_pool(compress_imgfile, image_storage, 10 * 1024 * 1024 - 1)
                 logger.info("[wechatcs] image compressed, sz={}".format(fsize(image_storage)))
             image_storage.seek(0)
             try:
@@ -158,7 +159,7 @@ class WechatComServiceChannel(ChatChannel):
 
                 if sz >= 10 * 1024 * 1024:
                     logger.info("[wechatcs] image too large, ready to compress, sz={}".format(sz))
-                    image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
+                    image_storage = run_in_cpu_pool(compress_imgfile, image_storage, 10 * 1024 * 1024 - 1)
                     logger.info("[wechatcs] image compressed, sz={}".format(fsize(image_storage)))
                 image_storage.seek(0)
                 try:
@@ -188,7 +189,7 @@ class WechatComServiceChannel(ChatChannel):
         if msgid:
             data["msgid"] = msgid
 
-        response = requests.post(url, json=data)
+        response = http_client.post(url, json=data)
         return response.json()
 
     def send_image_message(self, external_userid, open_kfid, msgid=None, media_id=None):
@@ -202,7 +203,7 @@ class WechatComServiceChannel(ChatChannel):
         if msgid:
             data["msgid"] = msgid
 
-        response = requests.post(url, json=data).json()
+        response = http_client.post(url, json=data).json()
         if response['errmsg'] == 'ok':
             print(f"Send IMAGE Message Success")
         else:
@@ -220,7 +221,7 @@ class WechatComServiceChannel(ChatChannel):
         if msgid:
             data["msgid"] = msgid
 
-        response = requests.post(url, json=data).json()
+        response = http_client.post(url, json=data).json()
         if response['errmsg'] == 'ok':
             print(f"Send VOICE Message Success")
         else:
@@ -240,7 +241,7 @@ class WechatComServiceChannel(ChatChannel):
             data["msgid"] = msgid
         # 发送图文链接消息
         url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/send_msg?access_token={self.client.fetch_access_token()}"
-        response = requests.post(url, json=data).json()
+        response = http_client.post(url, json=data).json()
         if response['errmsg'] == 'ok':
             print("Send LINK Message Success")
         else:
@@ -258,7 +259,7 @@ class WechatComServiceChannel(ChatChannel):
         if next_cursor:
             data["cursor"] = next_cursor
 
-        response = requests.post(url, json=data)
+        response = http_client.post(url, json=data)
         response_data = response.json()
         # if response_data["errcode"] == 0 and response_data["msg_list"]:
         #     return response_data["msg_list"][-1]  # 返回最新的一条消息
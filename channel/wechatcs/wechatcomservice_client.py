@@ -1,9 +1,9 @@
 import threading
 import time
-import requests
 import time
 from wechatpy.enterprise import WeChatClient
 from config import conf
+from common import http_client
 
 
 class WeChatTokenManager:
@@ -20,7 +20,7 @@ class WeChatTokenManager:
         corpsecret = conf().get("wechatcomapp_secret")
         url = f"https://qyapi.weixin.qq.com/cgi-bin/gettoken?corpid={corpid}&corpsecret={corpsecret}"
 
-        response = requests.get(url).json()
+        response = http_client.get(url).json()
         if 'access_token' in response:
             self.access_token = response['access_token']
             self.expires_at = current_time + response['expires_in'] - 60
@@ -22,7 +22,7 @@ class WechatComServiceMessage(ChatMessage):
         elif self.msgtype == "image":
             self.ctype = ContextType.IMAGE
             # 实现图像消息的处理逻辑
-            self.content = TmpDir().path() + msg.get("image", {}).get("media_id", "") + "." + 'jpg'  # 假设图片格式为jpg
+            self.content = TmpDir().file(msg.get("image", {}).get("media_id", "") + "." + 'jpg')  # 假设图片格式为jpg
 
             def download_image():
                 # 下载图片逻辑
@@ -37,7 +37,7 @@ class WechatComServiceMessage(ChatMessage):
             self._prepare_fn = download_image
         elif self.msgtype == "voice":
             self.ctype = ContextType.VOICE
-            self.content = TmpDir().path() + msg.get("voice", {}).get("media_id", "") + "." + 'mp3'  # content直接存临时目录路径
+            self.content = TmpDir().file(msg.get("voice", {}).get("media_id", "") + "." + 'mp3')  # content直接存临时目录路径
 
             def download_voice():
                 # 如果响应状态码是200，则将响应内容写入本地文件
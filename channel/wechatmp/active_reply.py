@@ -10,6 +10,7 @@ from channel.wechatmp.common import *
 from channel.wechatmp.wechatmp_channel import WechatMPChannel
 from channel.wechatmp.wechatmp_message import WeChatMPMessage
 from common.log import logger
+from common.shared_state import get_shared_state
 from config import conf, subscribe_msg
 
 
@@ -50,6 +51,10 @@ class Query:
                         content,
                     )
                 )
+                # 微信服务器未及时收到响应会重试，多进程部署时重试可能落到其他进程
+                if not get_shared_state().add_if_absent("wechatmp:msg:{}".format(message_id), ttl=60 * 10):
+                    logger.debug("[wechatmp] ignore duplicated message, msg_id={}".format(message_id))
+                    return "success"
                 if msg.type == "voice" and wechatmp_msg.ctype == ContextType.TEXT and conf().get("voice_reply_voice", False):
                     context = channel._compose_context(wechatmp_msg.ctype, content, isgroup=False, desire_rtype=ReplyType.VOICE, msg=wechatmp_msg)
                 else:
@@ -6,6 +6,7 @@ from wechatpy.utils import check_signature
 from config import conf
 
 MAX_UTF8_LEN = 2048
+PASSIVE_REPLY_TTL = 3600  # 被动回复缓存、处理中标记的过期时间，单位秒
 
 
 class WeChatAPIException(Exception):
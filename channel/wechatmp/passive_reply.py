@@ -49,10 +49,10 @@ class Query:
 
                 # New request
                 if (
-                    channel.cache_dict.get(from_user) is None
-                    and from_user not in channel.running
+                    not channel.has_reply(from_user)
+                    and not channel.is_running(from_user)
                     or content.startswith("#")
-                    and message_id not in channel.request_cnt  # insert the godcmd
+                    and not channel.has_request(message_id)  # insert the godcmd
                 ):
                     # The first query begin
                     if msg.type == "voice" and wechatmp_msg.ctype == ContextType.TEXT and conf().get("voice_reply_voice", False):
@@ -62,7 +62,7 @@ class Query:
                     logger.debug("[wechatmp] context: {} {} {}".format(context, wechatmp_msg, supported))
 
                     if supported and context:
-                        channel.running.add(from_user)
+                        channel.set_running(from_user)
                         channel.produce(context)
                     else:
                         trigger_prefix = conf().get("single_chat_prefix", [""])[0]
@@ -91,9 +91,8 @@ class Query:
                         return encrypt_func(replyPost.render())
 
                 # Wechat official server will request 3 times (5 seconds each), with the same message_id.
-                # Because the interval is 5 seconds, here assumed that do not have multithreading problems.
-                request_cnt = channel.request_cnt.get(message_id, 0) + 1
-                channel.request_cnt[message_id] = request_cnt
+                # The counter is kept in the shared state, so the retries can reach any worker process.
+                request_cnt = channel.count_request(message_id)
                 logger.info(
                     "[wechatmp] Request {} from {} {} {}:{}\n{}".format(
                         request_cnt, from_user, message_id, web.ctx.env.get("REMOTE_ADDR"), web.ctx.env.get("REMOTE_PORT"), content
@@ -103,7 +102,7 @@ class Query:
                 task_running = True
                 waiting_until = request_time + 4
                 while time.time() < waiting_until:
-                    if from_user in channel.running:
+                    if channel.is_running(from_user):
                         time.sleep(0.1)
                     else:
                         task_running = False
@@ -123,19 +122,17 @@ class Query:
                         return encrypt_func(replyPost.render())
 
                 # reply is ready
-                channel.request_cnt.pop(message_id)
+                channel.clear_request(message_id)
 
                 # no return because of bandwords or other reasons
-                if from_user not in channel.cache_dict and from_user not in channel.running:
+                if not channel.has_reply(from_user) and not channel.is_running(from_user):
                     return "success"
 
                 # Only one request can access to the cached data
-                try:
-                    (reply_type, reply_content) = channel.cache_dict[from_user].pop(0)
-                    if not channel.cache_dict[from_user]:  # If popping the message makes the list empty, delete the user entry from cache
-                        del channel.cache_dict[from_user]
-                except IndexError:
+                cached = channel.pop_reply(from_user)
+                if cached is None:
                     return "success"
+                (reply_type, reply_content) = cached
 
                 if reply_type == "text":
                     if len(reply_content.encode("utf8")) <= MAX_UTF8_LEN:
@@ -148,7 +145,7 @@ class Query:
                             max_split=1,
                         )
                         reply_text = splits[0] + continue_text
-                        channel.cache_dict[from_user].append(("text", splits[1]))
+                        channel.cache_reply(from_user, "text", splits[1])
 
                     logger.info(
                         "[wechatmp] Request {} do send to {} {}: {}\n{}".format(
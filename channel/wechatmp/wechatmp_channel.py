@@ -6,11 +6,9 @@ import os
 import threading
 import time
 
-import requests
 import web
 from wechatpy.crypto import WeChatCrypto
 from wechatpy.exceptions import WeChatClientException
-from collections import defaultdict
 
 from bridge.context import *
 from bridge.reply import *
@@ -18,8 +16,11 @@ from channel.chat_channel import ChatChannel
 from channel.wechatmp.common import *
 from channel.wechatmp.wechatmp_client import WechatMPClient
 from common.log import logger
+from common.shared_state import get_shared_state
 from common.singleton import singleton
 from common.utils import split_string_by_utf8_length, remove_markdown_symbol
+from common import http_client
+from common.web_server import run_web_app
 from config import conf
 from voice.audio_convert import any_to_mp3, split_audio
 
@@ -37,6 +38,8 @@ class WechatMPChannel(ChatChannel):
         super().__init__()
         self.passive_reply = passive_reply
         self.NOT_SUPPORT_REPLYTYPE = []
+        # 被动回复每次请求只能回复一条消息，缓存的多条回复需要用户多次请求才能取完
+        self.SUPPORT_STREAM_REPLY = not passive_reply
         appid = conf().get("wechatmp_app_id")
         secret = conf().get("wechatmp_app_secret")
         token = conf().get("wechatmp_token")
@@ -46,12 +49,9 @@ class WechatMPChannel(ChatChannel):
         if aes_key:
             self.crypto = WeChatCrypto(token, aes_key, appid)
         if self.passive_reply:
-            # Cache the reply to the user's first message
-            self.cache_dict = defaultdict(list)
-            # Record whether the current message is being processed
-            self.running = set()
-            # Count the request from wechat official server by message_id
-            self.request_cnt = dict()
+            # The cached replies, the running flags and the request counters are kept in the shared state,
+            # because the retried requests from wechat official server may reach another worker process
+            self.state = get_shared_state()
             # The permanent media need to be deleted to avoid media number limit
             self.delete_media_loop = asyncio.new_event_loop()
             t = threading.Thread(target=self.start_loop, args=(self.delete_media_loop,))
@@ -65,7 +65,35 @@ class WechatMPChannel(ChatChannel):
             urls = ("/wx", "channel.wechatmp.active_reply.Query")
         app = web.application(urls, globals(), autoreload=False)
         port = conf().get("wechatmp_port", 8080)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        run_web_app(app, port, name="wechatmp")
+
+    def cache_reply(self, receiver, reply_type, content):
+        self.state.push("wechatmp:reply:" + receiver, [reply_type, content], PASSIVE_REPLY_TTL)
+
+    def pop_reply(self, receiver):
+        item = self.state.pop("wechatmp:reply:" + receiver)
+        return tuple(item) if item else None
+
+    def has_reply(self, receiver):
+        return self.state.length("wechatmp:reply:" + receiver) > 0
+
+    def set_running(self, user):
+        self.state.set("wechatmp:running:" + user, 1, PASSIVE_REPLY_TTL)
+
+    def is_running(self, user):
+        return self.state.get("wechatmp:running:" + user) is not None
+
+    def clear_running(self, user):
+        self.state.delete("wechatmp:running:" + user)
+
+    def count_request(self, message_id):
+        return self.state.incr("wechatmp:request:{}".format(message_id), PASSIVE_REPLY_TTL)
+
+    def has_request(self, message_id):
+        return self.state.get("wechatmp:request:{}".format(message_id)) is not None
+
+    def clear_request(self, message_id):
+        self.state.delete("wechatmp:request:{}".format(message_id))
 
     def start_loop(self, loop):
         asyncio.set_event_loop(loop)
@@ -83,7 +111,7 @@ class WechatMPChannel(ChatChannel):
             if reply.type == ReplyType.TEXT or reply.type == ReplyType.INFO or reply.type == ReplyType.ERROR:
                 reply_text = remove_markdown_symbol(reply.content)
                 logger.info("[wechatmp] text cached, receiver {}\n{}".format(receiver, reply_text))
-                self.cache_dict[receiver].append(("text", reply_text))
+                self.cache_reply(receiver, "text", reply_text)
             elif reply.type == ReplyType.VOICE:
                 voice_file_path = reply.content
                 duration, files = split_audio(voice_file_path, 60 * 1000)
@@ -104,11 +132,11 @@ class WechatMPChannel(ChatChannel):
                         return
                     media_id = response["media_id"]
                     logger.info("[wechatmp] voice uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                    self.cache_dict[receiver].append(("voice", media_id))
+                    self.cache_reply(receiver, "voice", media_id)
 
             elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
                 img_url = reply.content
-                pic_res = requests.get(img_url, stream=True)
+                pic_res = http_client.get(img_url, stream=True)
                 image_storage = io.BytesIO()
                 for block in pic_res.iter_content(1024):
                     image_storage.write(block)
@@ -124,7 +152,7 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] image uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("image", media_id))
+                self.cache_reply(receiver, "image", media_id)
             elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
                 image_storage = reply.content
                 image_storage.seek(0)
@@ -139,10 +167,10 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] image uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("image", media_id))
+                self.cache_reply(receiver, "image", media_id)
             elif reply.type == ReplyType.VIDEO_URL:  # 从网络下载视频
                 video_url = reply.content
-                video_res = requests.get(video_url, stream=True)
+                video_res = http_client.get(video_url, stream=True)
                 video_storage = io.BytesIO()
                 for block in video_res.iter_content(1024):
                     video_storage.write(block)
@@ -158,7 +186,7 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] video uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("video", media_id))
+                self.cache_reply(receiver, "video", media_id)
 
             elif reply.type == ReplyType.VIDEO:  # 从文件读取视频
                 video_storage = reply.content
@@ -174,7 +202,7 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] video uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("video", media_id))
+                self.cache_reply(receiver, "video", media_id)
 
         else:
             if reply.type == ReplyType.TEXT or reply.type == ReplyType.INFO or reply.type == ReplyType.ERROR:
@@ -228,7 +256,7 @@ class WechatMPChannel(ChatChannel):
                 logger.info("[wechatmp] Do send voice to {}".format(receiver))
             elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
                 img_url = reply.content
-                pic_res = requests.get(img_url, stream=True)
+                pic_res = http_client.get(img_url, stream=True)
                 image_storage = io.BytesIO()
                 for block in pic_res.iter_content(1024):
                     image_storage.write(block)
@@ -260,7 +288,7 @@ class WechatMPChannel(ChatChannel):
                 logger.info("[wechatmp] Do send image to {}".format(receiver))
             elif reply.type == ReplyType.VIDEO_URL:  # 从网络下载视频
                 video_url = reply.content
-                video_res = requests.get(video_url, stream=True)
+                video_res = http_client.get(video_url, stream=True)
                 video_storage = io.BytesIO()
                 for block in video_res.iter_content(1024):
                     video_storage.write(block)
@@ -295,10 +323,9 @@ class WechatMPChannel(ChatChannel):
     def _success_callback(self, session_id, context, **kwargs):  # 线程异常结束时的回调函数
         logger.debug("[wechatmp] Success to generate reply, msgId={}".format(context["msg"].msg_id))
         if self.passive_reply:
-            self.running.remove(session_id)
+            self.clear_running(session_id)
 
     def _fail_callback(self, session_id, exception, context, **kwargs):  # 线程异常结束时的回调函数
         logger.exception("[wechatmp] Fail to generate reply to user, msgId={}, exception={}".format(context["msg"].msg_id, exception))
         if self.passive_reply:
-            assert session_id not in self.cache_dict
-            self.running.remove(session_id)
+            self.clear_running(session_id)
@@ -19,7 +19,7 @@ class WeChatMPMessage(ChatMessage):
         elif msg.type == "voice":
             if msg.recognition == None:
                 self.ctype = ContextType.VOICE
-                self.content = TmpDir().path() + msg.media_id + "." + msg.format  # content直接存临时目录路径
+                self.content = TmpDir().file(msg.media_id + "." + msg.format)  # content直接存临时目录路径
 
                 def download_voice():
                     # 如果响应状态码是200，则将响应内容写入本地文件
@@ -36,7 +36,7 @@ class WeChatMPMessage(ChatMessage):
                 self.content = msg.recognition
         elif msg.type == "image":
             self.ctype = ContextType.IMAGE
-            self.content = TmpDir().path() + msg.media_id + ".png"  # content直接存临时目录路径
+            self.content = TmpDir().file(msg.media_id + ".png")  # content直接存临时目录路径
 
             def download_image():
                 # 如果响应状态码是200，则将响应内容写入本地文件
@@ -5,7 +5,6 @@ import tempfile
 import threading
 os.environ['ntwork_LOG'] = "ERROR"
 import ntwork
-import requests
 import uuid
 
 from bridge.context import *
@@ -17,6 +16,8 @@ from common.singleton import singleton
 from common.log import logger
 from common.time_check import time_checker
 from common.utils import compress_imgfile, fsize
+from common.worker_pool import run_in_cpu_pool
+from common import http_client
 from config import conf
 from channel.wework.run import wework
 from channel.wework import run
@@ -39,7 +40,7 @@ def download_and_compress_image(url, filename, quality=30):
         os.makedirs(directory)
 
     # 下载图片
-    pic_res = requests.get(url, stream=True)
+    pic_res = http_client.get(url, stream=True)
     image_storage = io.BytesIO()
     for block in pic_res.iter_content(1024):
         image_storage.write(block)
@@ -48,7 +49,7 @@ def download_and_compress_image(url, filename, quality=30):
     sz = fsize(image_storage)
     if sz >= 10 * 1024 * 1024:  # 如果图片大于 10 MB
         logger.info("[wework] image too large, ready to compress, sz={}".format(sz))
-        image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
+        image_storage = run_in_cpu_pool(compress_imgfile, image_storage, 10 * 1024 * 1024 - 1)
         logger.info("[wework] image compressed, sz={}".format(fsize(image_storage)))
 
     # 将内存缓冲区的指针重置到起始位置
@@ -70,7 +71,7 @@ def download_video(url, filename):
         os.makedirs(directory)
 
     # 下载视频
-    response = requests.get(url, stream=True)
+    response = http_client.get(url, stream=True)
     total_size = 0
 
     video_path = os.path.join(directory, f"{filename}.mp4")
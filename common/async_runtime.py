@@ -0,0 +1,81 @@
+"""
+asyncio运行时：提供一个后台事件循环线程和共享的aiohttp会话，供异步模式下的channel和bot使用
+"""
+
+import asyncio
+import json
+import threading
+
+from common.log import logger
+
+_loop = None
+_loop_lock = threading.Lock()
+_http_sessions = {}  # event loop -> aiohttp.ClientSession
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """获取后台事件循环，首次调用时启动事件循环线程"""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                t = threading.Thread(target=_run_loop, args=(loop,), name="async_runtime", daemon=True)
+                t.start()
+                _loop = loop
+                logger.info("[async_runtime] event loop started")
+    return _loop
+
+
+def _run_loop(loop: asyncio.AbstractEventLoop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def run_coroutine(coro):
+    """
+    在后台事件循环中执行协程
+    :return: concurrent.futures.Future，可在线程中等待结果或添加回调
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+async def run_sync(func, *args):
+    """在默认线程池中执行同步函数，避免阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, func, *args)
+
+
+def get_http_session():
+    """获取当前事件循环共享的aiohttp会话，复用连接"""
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    session = _http_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession()
+        _http_sessions[loop] = session
+    return session
+
+
+def bind_openai_session():
+    """让openai的acreate等异步接口复用共享的aiohttp会话，需在协程中调用"""
+    import openai
+
+    openai.aiosession.set(get_http_session())
+
+
+async def post_json(url, body=None, headers=None, timeout=None):
+    """
+    异步发送json请求
+    :return: (status_code, 响应内容)，响应为json时返回dict，否则返回文本
+    """
+    import aiohttp
+
+    client_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+    async with get_http_session().post(url, json=body, headers=headers, timeout=client_timeout) as res:
+        text = await res.text()
+        try:
+            return res.status, json.loads(text)
+        except ValueError:
+            return res.status, text
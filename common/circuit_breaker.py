@@ -0,0 +1,59 @@
+import threading
+import time
+
+CLOSED = "closed"  # 正常调用
+OPEN = "open"  # 熔断中，调用直接跳过
+HALF_OPEN = "half_open"  # 冷却结束，放行一次调用试探是否恢复
+
+
+class CircuitBreaker(object):
+    """
+    熔断器：连续失败threshold次后熔断cooldown秒，期间allow()返回False
+    冷却结束后放行一次调用，成功则恢复，失败则继续熔断
+    """
+
+    def __init__(self, threshold=5, cooldown=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0  # 连续失败次数
+        self.opened_at = 0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        with self.lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                return True
+            return False  # 熔断中，或半开状态下已有一次试探调用
+
+    def record_success(self):
+        if self.state == CLOSED and not self.failures:
+            return
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> bool:
+        """:return: 本次失败是否导致熔断"""
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.threshold and self.failures >= self.threshold):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def release_probe(self):
+        """半开状态下放行的试探调用没有执行（如线程池繁忙）时调用，恢复熔断并重新计算冷却时间，否则熔断器会一直停在半开状态"""
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def reset(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
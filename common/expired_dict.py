@@ -1,22 +1,81 @@
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
 
 
-class ExpiredDict(dict):
-    def __init__(self, expires_in_seconds):
-        super().__init__()
+class ExpiredDict(MutableMapping):
+    """
+    带过期时间和容量上限的线程安全字典
+    - 读写会刷新key的过期时间并移到末尾，因此内部顺序即过期顺序，每次访问时从头部清理过期的key，均摊O(1)
+    - max_size大于0时，超出容量会淘汰最久未使用的key
+    - keys()、items()、values()、in 不会刷新过期时间
+    - on_evict(key, value) 在key过期或被淘汰时调用，主动删除时不调用
+    """
+
+    def __init__(self, expires_in_seconds, max_size=0, on_evict=None):
         self.expires_in_seconds = expires_in_seconds if expires_in_seconds else 3600
+        self.max_size = max_size or 0
+        self.on_evict = on_evict
+        self._data = OrderedDict()  # key -> (value, expiry_time)
+        self._lock = threading.RLock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
 
     def __getitem__(self, key):
-        value, expiry_time = super().__getitem__(key)
-        if datetime.now() > expiry_time:
-            del self[key]
-            raise KeyError("expired {}".format(key))
-        self.__setitem__(key, value)
-        return value
+        evicted = []
+        with self._lock:
+            now = time.monotonic()
+            self._purge(now, evicted)
+            item = self._data.get(key)
+            if item is None:
+                self.stats["misses"] += 1
+            else:
+                self.stats["hits"] += 1
+                self._data[key] = (item[0], now + self.expires_in_seconds)
+                self._data.move_to_end(key)
+        self._notify(evicted)
+        if item is None:
+            raise KeyError(key)
+        return item[0]
 
     def __setitem__(self, key, value):
-        expiry_time = datetime.now() + timedelta(seconds=self.expires_in_seconds)
-        super().__setitem__(key, (value, expiry_time))
+        evicted = []
+        with self._lock:
+            now = time.monotonic()
+            self._purge(now, evicted)
+            self._data[key] = (value, now + self.expires_in_seconds)
+            self._data.move_to_end(key)
+            while self.max_size and len(self._data) > self.max_size:
+                old_key, (old_value, _) = self._data.popitem(last=False)
+                self.stats["evicted"] += 1
+                evicted.append((old_key, old_value))
+        self._notify(evicted)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key):
+        evicted = []
+        with self._lock:
+            self._purge(time.monotonic(), evicted)
+            result = key in self._data
+        self._notify(evicted)
+        return result
+
+    def __len__(self):
+        evicted = []
+        with self._lock:
+            self._purge(time.monotonic(), evicted)
+            result = len(self._data)
+        self._notify(evicted)
+        return result
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __repr__(self):
+        return "ExpiredDict({})".format(dict(self.items()))
 
     def get(self, key, default=None):
         try:
@@ -24,19 +83,55 @@ class ExpiredDict(dict):
         except KeyError:
             return default
 
-    def __contains__(self, key):
-        try:
-            self[key]
-            return True
-        except KeyError:
-            return False
+    def pop(self, key, *default):
+        with self._lock:
+            if key in self._data:
+                return self._data.pop(key)[0]
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def setdefault(self, key, default=None):
+        with self._lock:
+            if key in self:
+                return self[key]
+            self[key] = default
+            return default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
 
     def keys(self):
-        keys = list(super().keys())
-        return [key for key in keys if key in self]
+        return [key for key, _ in self.items()]
+
+    def values(self):
+        return [value for _, value in self.items()]
 
     def items(self):
-        return [(key, self[key]) for key in self.keys()]
+        evicted = []
+        with self._lock:
+            self._purge(time.monotonic(), evicted)
+            result = [(key, item[0]) for key, item in self._data.items()]
+        self._notify(evicted)
+        return result
 
-    def __iter__(self):
-        return self.keys().__iter__()
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats, size=len(self._data), max_size=self.max_size)
+
+    def _purge(self, now, evicted):
+        """从头部清理已过期的key，需持有锁"""
+        while self._data:
+            key, (value, expiry_time) = next(iter(self._data.items()))
+            if expiry_time > now:
+                break
+            del self._data[key]
+            self.stats["expired"] += 1
+            evicted.append((key, value))
+
+    def _notify(self, evicted):
+        # 回调可能较慢（如写数据库），在锁外执行
+        if self.on_evict:
+            for key, value in evicted:
+                self.on_evict(key, value)
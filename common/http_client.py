@@ -0,0 +1,171 @@
+"""
+共享的HTTP连接池：复用keep-alive连接，按host限制连接数（连接用满时等待空闲连接），带重试退避和默认超时
+用法与requests一致，如 http_client.get(url, params=...)、http_client.post(url, json=...)
+"""
+
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+from urllib3.util.retry import Retry
+
+from common.log import logger
+from config import conf
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _bounded_pool(pool_cls, pool_timeout):
+    """requests取连接时不传超时，pool_block为True时会一直等待空闲连接，这里改为最多等待pool_timeout秒"""
+
+    class BoundedPool(pool_cls):
+        def _get_conn(self, timeout=None):
+            return super()._get_conn(pool_timeout if timeout is None else timeout)
+
+    return BoundedPool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """记录每个host的请求数、失败数和耗时"""
+
+    def __init__(self, *args, pool_timeout=None, **kwargs):
+        self.host_stats = {}
+        self._stats_lock = threading.Lock()
+        self.pool_timeout = pool_timeout
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        if self._pool_block and self.pool_timeout is not None:
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": _bounded_pool(HTTPConnectionPool, self.pool_timeout),
+                "https": _bounded_pool(HTTPSConnectionPool, self.pool_timeout),
+            }
+
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).netloc
+        start = time.monotonic()
+        error = True
+        try:
+            response = super().send(request, **kwargs)
+            error = response.status_code >= 500
+            return response
+        except EmptyPoolError as e:
+            raise requests.exceptions.ConnectionError(e, request=request)
+        finally:
+            self._record(host, time.monotonic() - start, error)
+
+    def _record(self, host, cost, error):
+        with self._stats_lock:
+            stats = self.host_stats.get(host)
+            if stats is None:
+                stats = {"requests": 0, "errors": 0, "latency_total": 0.0, "latency_max": 0.0}
+                self.host_stats[host] = stats
+            stats["requests"] += 1
+            stats["latency_total"] += cost
+            stats["latency_max"] = max(stats["latency_max"], cost)
+            if error:
+                stats["errors"] += 1
+
+    def get_pool_stats(self) -> dict:
+        """返回每个host的连接池使用情况"""
+        pools = {}
+        for key in list(self.poolmanager.pools.keys()):
+            pool = self.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            host = pool.host if pool.port in (None, 80, 443) else "{}:{}".format(pool.host, pool.port)
+            pools[host] = {
+                "connections_created": pool.num_connections,
+                "requests_sent": pool.num_requests,
+                "idle_connections": sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0,
+                "maxsize": pool.pool.maxsize if pool.pool else 0,
+            }
+        result = {}
+        with self._stats_lock:
+            for host, stats in self.host_stats.items():
+                item = {
+                    "requests": stats["requests"],
+                    "errors": stats["errors"],
+                    "latency_avg_ms": round(stats["latency_total"] * 1000 / stats["requests"], 2),
+                    "latency_max_ms": round(stats["latency_max"] * 1000, 2),
+                }
+                item.update(pools.pop(host, {}))
+                result[host] = item
+        result.update(pools)
+        return result
+
+
+class PooledSession(requests.Session):
+    """未指定timeout的请求使用默认超时，避免请求无限期挂起"""
+
+    def __init__(self, default_timeout):
+        super().__init__()
+        self.default_timeout = default_timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.default_timeout
+        return super().request(method, url, **kwargs)
+
+
+def _create_session() -> PooledSession:
+    session = PooledSession((conf().get("http_connect_timeout", 10), conf().get("http_read_timeout", 300)))
+    retries = conf().get("http_max_retries", 2)
+    # 连接失败对所有请求重试；读超时和5xx只对幂等请求重试，避免POST重复调用模型接口
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=conf().get("http_retry_backoff", 0.5),
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False,
+    )
+    adapter = PooledHTTPAdapter(
+        pool_connections=conf().get("http_pool_connections", 20),
+        pool_maxsize=conf().get("http_pool_maxsize", 20),
+        pool_block=conf().get("http_pool_block", True),
+        pool_timeout=conf().get("http_pool_timeout", 30),
+        max_retries=retry,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # 会话在所有用户和插件间共享，禁用cookie防止串号
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    logger.debug("[http_client] session created, pool_maxsize={}, pool_block={}, retries={}".format(adapter._pool_maxsize, adapter._pool_block, retries))
+    return session
+
+
+def get_session() -> PooledSession:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def request(method, url, **kwargs) -> requests.Response:
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url, params=None, **kwargs) -> requests.Response:
+    return get_session().request("GET", url, params=params, **kwargs)
+
+
+def post(url, data=None, json=None, **kwargs) -> requests.Response:
+    return get_session().request("POST", url, data=data, json=json, **kwargs)
+
+
+def get_pool_stats() -> dict:
+    """按host返回请求数、失败数、耗时和连接池使用情况"""
+    if _session is None:
+        return {}
+    return _session.get_adapter("https://").get_pool_stats()
@@ -0,0 +1,176 @@
+"""
+运行指标：消息处理各阶段的耗时直方图，以及队列深度、线程池使用率等状态，按Prometheus文本格式导出
+- 配置metrics开启，关闭时span()返回空操作，几乎没有额外开销
+- 开启后webhook类channel的web服务器在metrics_path（默认/metrics）提供指标
+- 耗时按阶段(stage)、channel、bot类型、插件名和消息类型分组
+- 状态类指标由各模块注册采集函数，只在抓取时计算，不影响消息处理
+"""
+
+import bisect
+import threading
+import time
+
+from common.log import logger
+from config import conf
+
+PREFIX = "dow_"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+STAGE_LABELS = ("stage", "channel", "bot", "plugin", "context_type")
+
+
+def enabled() -> bool:
+    return bool(conf().get("metrics", False))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, _escape(value)) for key, value in labels.items()) + "}"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+class Histogram(object):
+    def __init__(self, name, help, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # label值的tuple -> [各桶计数..., 总和, 总数]
+        self.lock = threading.Lock()
+
+    def observe(self, value, labels: tuple):
+        """:param labels: 与labelnames顺序一致的label值"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = [0] * (len(self.buckets) + 2)
+                self.series[labels] = series
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        with self.lock:
+            items = [(labels, list(series)) for labels, series in self.series.items()]
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} histogram".format(self.name)]
+        for labels, series in sorted(items):
+            label_dict = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(self.name, _format_labels(dict(label_dict, le=_format_value(float(bound)))), cumulative))
+            lines.append("{}_bucket{} {}".format(self.name, _format_labels(dict(label_dict, le="+Inf")), series[-1]))
+            lines.append("{}_sum{} {}".format(self.name, _format_labels(label_dict), _format_value(float(series[-2]))))
+            lines.append("{}_count{} {}".format(self.name, _format_labels(label_dict), series[-1]))
+        return lines
+
+
+stage_duration = Histogram(PREFIX + "stage_duration_seconds", "Duration of message handling stages in seconds", STAGE_LABELS)
+
+
+class _Span(object):
+    __slots__ = ("labels", "start")
+
+    def __init__(self, labels):
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        stage_duration.observe(time.perf_counter() - self.start, self.labels)
+        return False
+
+
+class _NoopSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(stage, channel="", bot="", plugin="", context_type=""):
+    """
+    记录代码块的耗时，未开启metrics时不计时
+    用法：
+        with metrics.span("bot_reply", bot=bot_type, context_type=context.type.name):
+            reply = bot.reply(query, context)
+    """
+    if not enabled():
+        return _NOOP_SPAN
+    return _Span((stage, channel or "", bot or "", plugin or "", context_type or ""))
+
+
+def observe(stage, seconds, channel="", bot="", plugin="", context_type=""):
+    """直接记录一个耗时，用于开始和结束不在同一代码块的阶段，如出站队列中的发送"""
+    if enabled():
+        stage_duration.observe(seconds, (stage, channel or "", bot or "", plugin or "", context_type or ""))
+
+
+def context_type_name(context) -> str:
+    ctype = getattr(context, "type", None)
+    return ctype.name if ctype is not None else ""
+
+
+_collectors = []
+_collectors_lock = threading.Lock()
+
+
+def register_collector(collector):
+    """
+    注册状态类指标的采集函数，在抓取指标时调用
+    :param collector: 返回[(指标名, 类型gauge|counter, 说明, [(labels字典, 值)])]，指标名不含前缀
+    """
+    with _collectors_lock:
+        _collectors.append(collector)
+
+
+def unregister_collector(collector):
+    with _collectors_lock:
+        if collector in _collectors:
+            _collectors.remove(collector)
+
+
+def render() -> str:
+    """返回Prometheus文本格式的全部指标"""
+    lines = stage_duration.render()
+    families = {}  # 多个采集函数可能输出同名指标（如多个channel），合并到一起
+    with _collectors_lock:
+        collectors = list(_collectors)
+    for collector in collectors:
+        try:
+            for name, metric_type, help, samples in collector():
+                family = families.setdefault(name, (metric_type, help, []))
+                family[2].extend(samples)
+        except Exception as e:
+            logger.warning("[metrics] collector {} error: {}".format(getattr(collector, "__qualname__", collector), e))
+    for name, (metric_type, help, samples) in families.items():
+        lines.append("# HELP {}{} {}".format(PREFIX, name, help))
+        lines.append("# TYPE {}{} {}".format(PREFIX, name, metric_type))
+        for labels, value in samples:
+            lines.append("{}{}{} {}".format(PREFIX, name, _format_labels(labels), _format_value(value)))
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """清空已记录的耗时，用于测试"""
+    with stage_duration.lock:
+        stage_duration.series.clear()
@@ -0,0 +1,169 @@
+"""
+会话持久化存储，配置session_store启用：
+- 空（默认）：不持久化，会话只保存在内存中
+- sqlite: 保存到appdata_dir下的sessions.db，重启后按需加载
+
+写入是异步批量的：save只把最新数据放入待写队列，后台线程每session_store_flush_interval秒
+在一个事务中写入，同一会话多次修改只写最后一次。读取时优先读待写队列，保证读到最新数据。
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from common.log import logger
+from config import conf, get_appdata_dir
+
+_DELETED = object()
+
+
+class SessionStore(object):
+    """会话存储接口，namespace用于区分不同的SessionManager"""
+
+    def load(self, namespace, key):
+        """返回保存的数据和更新时间(data, updated_at)，不存在时返回None"""
+        raise NotImplementedError
+
+    def save(self, namespace, key, data):
+        raise NotImplementedError
+
+    def delete(self, namespace, key):
+        raise NotImplementedError
+
+    def clear(self, namespace):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SqliteSessionStore(SessionStore):
+    def __init__(self, path, flush_interval=1.0, batch_size=500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size  # 待写数量达到该值时立即写入
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL模式下进程崩溃不会损坏已提交的数据
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self.conn.commit()
+        self.db_lock = threading.Lock()
+        self.pending = {}  # (namespace, key) -> (json, updated_at) 或 _DELETED
+        self.pending_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.stats = {"loads": 0, "writes": 0, "flushes": 0}
+        self.writer = threading.Thread(target=self._write_loop, name="session-store-writer", daemon=True)
+        self.writer.start()
+
+    def load(self, namespace, key):
+        with self.pending_lock:
+            item = self.pending.get((namespace, key))
+        if item is _DELETED:
+            return None
+        if item is not None:
+            return json.loads(item[0]), item[1]
+        with self.db_lock:
+            self.stats["loads"] += 1
+            row = self.conn.execute("SELECT data, updated_at FROM sessions WHERE namespace=? AND key=?", (namespace, key)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def save(self, namespace, key, data):
+        # 立即序列化，之后会话再被修改也不影响本次写入的内容
+        item = (json.dumps(data, ensure_ascii=False), time.time())
+        self._put((namespace, key), item)
+
+    def delete(self, namespace, key):
+        self._put((namespace, key), _DELETED)
+
+    def clear(self, namespace):
+        self.flush()
+        with self.db_lock:
+            self.conn.execute("DELETE FROM sessions WHERE namespace=?", (namespace,))
+            self.conn.commit()
+
+    def flush(self):
+        # 先持有db_lock再取出待写数据，写入完成前load会等待，不会读到旧数据
+        with self.db_lock:
+            with self.pending_lock:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return
+            upserts = [(ns, key, item[0], item[1]) for (ns, key), item in pending.items() if item is not _DELETED]
+            deletes = [(ns, key) for (ns, key), item in pending.items() if item is _DELETED]
+            with self.conn:
+                if upserts:
+                    self.conn.executemany("INSERT OR REPLACE INTO sessions (namespace, key, data, updated_at) VALUES (?, ?, ?, ?)", upserts)
+                if deletes:
+                    self.conn.executemany("DELETE FROM sessions WHERE namespace=? AND key=?", deletes)
+            self.stats["writes"] += len(pending)
+            self.stats["flushes"] += 1
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup.set()
+        self.writer.join(timeout=5)
+        self.flush()
+        with self.db_lock:
+            self.conn.close()
+
+    def get_stats(self) -> dict:
+        with self.pending_lock:
+            pending = len(self.pending)
+        return dict(self.stats, pending=pending)
+
+    def _put(self, pending_key, item):
+        with self.pending_lock:
+            self.pending[pending_key] = item
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def _write_loop(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            if self.closed:
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("[SessionStore] flush error: {}".format(e))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """返回配置的会话存储，未启用时返回None"""
+    global _store
+    backend = conf().get("session_store", "")
+    if not backend:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if backend != "sqlite":
+                    logger.warning("[SessionStore] unknown session_store: {}, sessions will not be persisted".format(backend))
+                    return None
+                path = os.path.join(get_appdata_dir(), "sessions.db")
+                _store = SqliteSessionStore(path, conf().get("session_store_flush_interval", 1))
+                atexit.register(_store.close)
+                logger.info("[SessionStore] sqlite session store enabled: {}".format(path))
+    return _store
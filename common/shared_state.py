@@ -0,0 +1,249 @@
+"""
+多进程共享状态，用于多个进程在负载均衡后共同处理同一个webhook时的会话锁、消息去重和被动回复缓存
+配置shared_state选择实现：
+- 空或local（默认）：进程内存，与单进程部署行为一致
+- redis: 使用shared_state_redis_url连接Redis（需要安装redis库），也可以传入任意兼容redis-py接口的客户端
+"""
+
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from common.log import logger
+from config import conf
+
+
+class SharedState(object):
+    """共享状态接口，所有key都带过期时间，防止进程崩溃后残留"""
+
+    distributed = False  # 是否跨进程共享，为False时会话顺序由进程内的调度保证
+
+    def add_if_absent(self, key, value=1, ttl=600) -> bool:
+        """key不存在时写入并返回True，已存在时返回False，用于去重和抢占"""
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=600):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key, ttl=600) -> int:
+        raise NotImplementedError
+
+    def push(self, key, value, ttl=600):
+        """追加到列表末尾"""
+        raise NotImplementedError
+
+    def pop(self, key):
+        """取出列表第一个元素，列表为空时返回None"""
+        raise NotImplementedError
+
+    def length(self, key) -> int:
+        raise NotImplementedError
+
+    def acquire_lock(self, key, ttl=600, timeout=None):
+        """
+        获取锁，ttl后自动释放，防止持有锁的进程崩溃后死锁
+        :param timeout: 最多等待的秒数，None表示一直等待
+        :return: 释放锁时需要的token，超时返回None
+        """
+        token = uuid.uuid4().hex
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.01
+        while not self.add_if_absent(key, token, ttl):
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(delay)
+            delay = min(delay * 2, 0.2)
+        return token
+
+    def release_lock(self, key, token):
+        raise NotImplementedError
+
+    @contextmanager
+    def lock(self, key, ttl=600, timeout=None):
+        token = self.acquire_lock(key, ttl, timeout)
+        try:
+            yield token is not None
+        finally:
+            if token is not None:
+                self.release_lock(key, token)
+
+
+class LocalSharedState(SharedState):
+    def __init__(self):
+        self.data = {}  # key -> (value, expiry_time)
+        self.mutex = threading.Lock()
+
+    def _get_item(self, key, now):
+        # 需持有锁
+        item = self.data.get(key)
+        if item is not None and item[1] <= now:
+            del self.data[key]
+            item = None
+        return item
+
+    def add_if_absent(self, key, value=1, ttl=600) -> bool:
+        with self.mutex:
+            now = time.monotonic()
+            if self._get_item(key, now) is not None:
+                return False
+            self.data[key] = (value, now + ttl)
+            self._purge(now)
+            return True
+
+    def get(self, key):
+        with self.mutex:
+            item = self._get_item(key, time.monotonic())
+            return item[0] if item else None
+
+    def set(self, key, value, ttl=600):
+        with self.mutex:
+            self.data[key] = (value, time.monotonic() + ttl)
+
+    def delete(self, key):
+        with self.mutex:
+            self.data.pop(key, None)
+
+    def incr(self, key, ttl=600) -> int:
+        with self.mutex:
+            now = time.monotonic()
+            item = self._get_item(key, now)
+            value = (item[0] if item else 0) + 1
+            self.data[key] = (value, item[1] if item else now + ttl)
+            return value
+
+    def push(self, key, value, ttl=600):
+        with self.mutex:
+            now = time.monotonic()
+            item = self._get_item(key, now)
+            values = item[0] if item else []
+            values.append(value)
+            self.data[key] = (values, now + ttl)
+
+    def pop(self, key):
+        with self.mutex:
+            item = self._get_item(key, time.monotonic())
+            if not item or not item[0]:
+                return None
+            value = item[0].pop(0)
+            if not item[0]:
+                del self.data[key]
+            return value
+
+    def length(self, key) -> int:
+        with self.mutex:
+            item = self._get_item(key, time.monotonic())
+            return len(item[0]) if item else 0
+
+    def release_lock(self, key, token):
+        with self.mutex:
+            item = self._get_item(key, time.monotonic())
+            if item and item[0] == token:
+                del self.data[key]
+
+    def _purge(self, now):
+        # 去重key只写不删，写入量大时顺带清理过期的key
+        if len(self.data) > 10000 and len(self.data) % 1000 == 0:
+            for key in [key for key, item in self.data.items() if item[1] <= now]:
+                del self.data[key]
+
+
+# 只删除自己持有的锁，避免锁过期后误删其他进程的锁
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+else
+    return 0
+end
+"""
+
+# 自增和设置过期时间在同一个脚本中执行，避免进程在两步之间退出后key永不过期
+_INCR_SCRIPT = """
+local value = redis.call("incr", KEYS[1])
+if redis.call("ttl", KEYS[1]) < 0 then
+    redis.call("expire", KEYS[1], ARGV[1])
+end
+return value
+"""
+
+
+class RedisSharedState(SharedState):
+    distributed = True
+
+    def __init__(self, client, prefix="dow:"):
+        """
+        :param client: redis.Redis或兼容的客户端，需要decode_responses=True
+        """
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def add_if_absent(self, key, value=1, ttl=600) -> bool:
+        return bool(self.client.set(self._key(key), json.dumps(value), nx=True, ex=int(ttl)))
+
+    def get(self, key):
+        value = self.client.get(self._key(key))
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=600):
+        self.client.set(self._key(key), json.dumps(value), ex=int(ttl))
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+    def incr(self, key, ttl=600) -> int:
+        return int(self.client.eval(_INCR_SCRIPT, 1, self._key(key), int(ttl)))
+
+    def push(self, key, value, ttl=600):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(self._key(key), json.dumps(value))
+        pipe.expire(self._key(key), int(ttl))
+        pipe.execute()
+
+    def pop(self, key):
+        value = self.client.lpop(self._key(key))
+        return json.loads(value) if value is not None else None
+
+    def length(self, key) -> int:
+        return self.client.llen(self._key(key))
+
+    def release_lock(self, key, token):
+        self.client.eval(_RELEASE_LOCK_SCRIPT, 1, self._key(key), json.dumps(token))
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_shared_state() -> SharedState:
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                _state = _create_shared_state()
+    return _state
+
+
+def _create_shared_state():
+    backend = conf().get("shared_state", "")
+    if backend == "redis":
+        try:
+            import redis
+
+            client = redis.Redis.from_url(conf().get("shared_state_redis_url", "redis://localhost:6379/0"), decode_responses=True)
+            logger.info("[SharedState] use redis shared state")
+            return RedisSharedState(client, conf().get("shared_state_prefix", "dow:"))
+        except ImportError:
+            logger.error("[SharedState] redis is not installed, please run `pip install redis`, fallback to local shared state")
+    elif backend and backend != "local":
+        logger.warning("[SharedState] unknown shared_state: {}, fallback to local".format(backend))
+    return LocalSharedState()
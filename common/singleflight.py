@@ -0,0 +1,91 @@
+"""
+请求合并（single-flight）：相同key的请求同时进行时只执行一次，其余调用等待并共享同一个结果
+- 用于群聊中多人同时发送相同问题或链接时，避免重复请求bot、总结接口等耗时的外部服务
+- 只合并正在进行的请求，执行完成后不保留结果，需要缓存时使用reply_cache
+- 线程和协程调用共享同一组进行中的请求
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class Group(object):
+    def __init__(self, name=""):
+        self.name = name
+        self.calls = {}  # key -> Future，正在进行的请求
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "executed": 0, "shared": 0}
+
+    def _join(self, key):
+        """
+        :return: (future, leader)，leader为True时由调用者执行请求并设置结果
+        """
+        with self.lock:
+            self.stats["calls"] += 1
+            future = self.calls.get(key)
+            if future is not None:
+                self.stats["shared"] += 1
+                return future, False
+            future = Future()
+            self.calls[key] = future
+            self.stats["executed"] += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self.lock:
+            if self.calls.get(key) is future:
+                del self.calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        执行fn(*args, **kwargs)，相同key的请求正在进行时等待其结果
+        :return: (结果, 是否为共享的结果)，fn抛出的异常会传给所有等待者
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, False
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """do的异步版本，fn返回协程，等待时不占用线程"""
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future), True
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, False
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats, inflight=len(self.calls))
+        stats["name"] = self.name
+        return stats
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def get_group(name) -> Group:
+    """按名称共享的请求合并组，如bridge、jina_sum"""
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = Group(name)
+            _groups[name] = group
+        return group
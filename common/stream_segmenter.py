@@ -0,0 +1,85 @@
+"""
+流式回复分段：把模型逐字返回的文本切成完整的句子、图片和文件，便于边生成边发送
+"""
+
+import re
+from typing import Dict, List
+
+from common.utils import parse_markdown_text
+
+# 与parse_markdown_text一致的图片/文件链接语法
+LINK_PATTERN = re.compile(r"!?\[[^\n]*?\]\([^\n]*?\)")
+# 句子结束符，段落换行优先
+SENTENCE_END_PATTERN = re.compile(r"\n\n|[。！？!?；;\n]")
+
+
+class StreamSegmenter(object):
+    """
+    用法：
+        segmenter = StreamSegmenter()
+        for delta in stream:
+            for item in segmenter.feed(delta):
+                send(item)
+        for item in segmenter.flush():
+            send(item)
+    返回的item与parse_markdown_text相同：{"type": "text"|"image"|"file", "content": str}
+    """
+
+    def __init__(self, min_length=20, max_length=500):
+        self.min_length = min_length  # 文本段至少达到该长度才在句子边界切分，避免消息过碎
+        self.max_length = max_length  # 没有句子边界时，超过该长度强制切分
+        self.buffer = ""
+
+    def feed(self, text: str) -> List[Dict]:
+        if not text:
+            return []
+        self.buffer += text
+        items = []
+        while True:
+            match = LINK_PATTERN.search(self.buffer)
+            if not match:
+                break
+            # 链接之前的文本和链接本身都已完整，直接输出
+            items.extend(parse_markdown_text(self.buffer[: match.end()]))
+            self.buffer = self.buffer[match.end() :]
+        safe_end = self._safe_end()
+        cut = self._find_cut(safe_end)
+        if cut > 0:
+            items.extend(self._text_item(self.buffer[:cut]))
+            self.buffer = self.buffer[cut:]
+        return items
+
+    def flush(self) -> List[Dict]:
+        """输出剩余的全部内容，生成结束或需要强制分段时调用"""
+        items = parse_markdown_text(self.buffer) if self.buffer.strip() else []
+        self.buffer = ""
+        return items
+
+    def _safe_end(self) -> int:
+        """可能是未完成链接的部分不能输出，返回可安全切分的结束位置"""
+        start = self.buffer.find("[")
+        while start >= 0:
+            if "\n" not in self.buffer[start:]:
+                if start > 0 and self.buffer[start - 1] == "!":
+                    start -= 1
+                return start
+            start = self.buffer.find("[", start + 1)
+        if self.buffer.endswith("!"):
+            return len(self.buffer) - 1
+        return len(self.buffer)
+
+    def _find_cut(self, end: int) -> int:
+        cut = 0
+        for match in SENTENCE_END_PATTERN.finditer(self.buffer, 0, end):
+            if len(self.buffer[: match.end()].strip()) >= self.min_length:
+                cut = match.end()
+                if match.group() == "\n\n":
+                    break
+        if cut == 0 and end >= self.max_length:
+            cut = end
+        return cut
+
+    @staticmethod
+    def _text_item(text: str) -> List[Dict]:
+        text = text.strip()
+        return [{"type": "text", "content": text}] if text else []
@@ -1,18 +1,262 @@
+"""
+临时文件目录./tmp/的管理：
+- TmpDir().path()返回临时目录，TmpDir().file(name)返回按文件名哈希分到子目录中的路径，避免单个目录文件过多
+- 发送中的文件用hold()/release()引用计数，最后一个引用释放时删除文件，如文字转语音生成的回复文件在发送完成后删除
+- 后台清理线程定期删除超过tmp_dir_max_age的文件，总大小超过tmp_dir_max_size时从最旧的文件开始删除，被引用的文件不会被清理
+"""
+
 import os
 import pathlib
+import threading
+import time
+import zlib
 
+from bridge.reply import Reply, ReplyType
+from common import metrics
+from common.log import logger
 from config import conf
 
+MIN_CLEAN_AGE = 60  # 按总大小清理时跳过最近写入的文件，避免删除正在下载或转换的文件
+FILE_REPLY_TYPES = (ReplyType.VOICE, ReplyType.IMAGE, ReplyType.FILE, ReplyType.VIDEO)
 
-class TmpDir(object):
-    """A temporary directory that is deleted when the object is destroyed."""
 
-    tmpFilePath = pathlib.Path("./tmp/")
+def reply_file(reply: Reply):
+    """回复对应的本地文件路径，不是文件回复时返回None"""
+    if reply is None or reply.type not in FILE_REPLY_TYPES or not isinstance(reply.content, str):
+        return None
+    return reply.content
+
+
+class TmpStore(object):
+    def __init__(self, root, shards=64, max_age=86400, max_size=1024 * 1024 * 1024, clean_interval=600):
+        """
+        :param shards: 子目录数量，0表示不分子目录
+        :param max_age: 文件保留时间（秒），0表示不按时间清理
+        :param max_size: 目录总大小上限（字节），0表示不限制
+        :param clean_interval: 后台清理的间隔（秒），0表示不启动清理线程
+        """
+        self.root = str(root)
+        self.abs_root = os.path.abspath(self.root)
+        self.shards = shards
+        self.max_age = max_age
+        self.max_size = max_size
+        self.clean_interval = clean_interval
+        self.refs = {}  # 文件绝对路径 -> 引用计数
+        self.created_dirs = set()
+        self.lock = threading.Lock()
+        self.janitor = None
+        self.stopped = threading.Event()
+        self.stats = {"files": 0, "bytes": 0, "deleted_age": 0, "deleted_size": 0, "deleted_release": 0, "scans": 0, "scan_ms": 0.0}
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self) -> str:
+        return self.root + "/"
+
+    def file(self, name: str) -> str:
+        """返回临时文件的路径，文件名相同时路径相同"""
+        if not self.shards:
+            return self.path() + name
+        shard = "{:02x}".format(zlib.crc32(name.encode("utf-8")) % self.shards)
+        directory = os.path.join(self.root, shard)
+        if shard not in self.created_dirs:
+            os.makedirs(directory, exist_ok=True)
+            self.created_dirs.add(shard)
+        return os.path.join(directory, name)
+
+    def _key(self, path):
+        """临时目录中的文件返回绝对路径，其他文件返回None"""
+        if not isinstance(path, str) or not path:
+            return None
+        abs_path = os.path.abspath(path)
+        if not abs_path.startswith(self.abs_root + os.sep):
+            return None
+        return abs_path
+
+    def hold(self, path) -> bool:
+        """引用临时文件，引用期间不会被清理。不在临时目录中的文件不处理，返回False"""
+        key = self._key(path)
+        if key is None:
+            return False
+        with self.lock:
+            self.refs[key] = self.refs.get(key, 0) + 1
+        return True
+
+    def release(self, path):
+        """释放hold()的引用，最后一个引用释放时删除文件"""
+        key = self._key(path)
+        if key is None:
+            return
+        with self.lock:
+            count = self.refs.get(key, 0) - 1
+            if count > 0:
+                self.refs[key] = count
+                return
+            self.refs.pop(key, None)
+        if self._remove(key):
+            with self.lock:
+                self.stats["deleted_release"] += 1
+
+    def is_held(self, path) -> bool:
+        key = self._key(path)
+        with self.lock:
+            return key in self.refs
+
+    @staticmethod
+    def _remove(path) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning("[TmpDir] remove {} failed: {}".format(path, e))
+            return False
+
+    def _scan(self) -> list:
+        """:return: [(修改时间, 大小, 绝对路径)]"""
+        files = []
+        stack = [self.abs_root]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                stat = entry.stat(follow_symlinks=False)
+                                files.append((stat.st_mtime, stat.st_size, entry.path))
+                        except FileNotFoundError:
+                            continue
+            except FileNotFoundError:
+                continue
+        return files
+
+    def clean(self, now=None) -> dict:
+        """
+        删除过期的文件，总大小超出上限时从最旧的文件开始删除，直到低于上限的90%
+        :return: 本次删除的文件数 {"age": n, "size": n}
+        """
+        start = time.perf_counter()
+        now = now or time.time()
+        files = self._scan()
+        with self.lock:
+            held = set(self.refs)
+        deleted = {"age": 0, "size": 0}
+        kept = []
+        for mtime, size, path in files:
+            if path in held:
+                kept.append((mtime, size, path))
+            elif self.max_age and now - mtime > self.max_age:
+                if self._remove(path):
+                    deleted["age"] += 1
+            else:
+                kept.append((mtime, size, path))
+        total = sum(size for _, size, _ in kept)
+        if self.max_size and total > self.max_size:
+            target = self.max_size * 0.9
+            for mtime, size, path in sorted(kept):
+                if total <= target or now - mtime < MIN_CLEAN_AGE:
+                    break
+                if path in held:
+                    continue
+                if self._remove(path):
+                    deleted["size"] += 1
+                    total -= size
+        cost = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.stats["files"] = len(kept) - deleted["size"]
+            self.stats["bytes"] = total
+            self.stats["deleted_age"] += deleted["age"]
+            self.stats["deleted_size"] += deleted["size"]
+            self.stats["scans"] += 1
+            self.stats["scan_ms"] = round(cost, 2)
+        if deleted["age"] or deleted["size"]:
+            logger.info("[TmpDir] cleaned {} expired and {} oversize files in {:.0f}ms, {} files left".format(deleted["age"], deleted["size"], cost, self.stats["files"]))
+        return deleted
+
+    def start_janitor(self):
+        if not self.clean_interval or self.janitor is not None:
+            return
+        self.janitor = threading.Thread(target=self._run_janitor, name="tmp_janitor", daemon=True)
+        self.janitor.start()
+
+    def stop_janitor(self):
+        self.stopped.set()
+
+    def _run_janitor(self):
+        # 启动后先清理一次，清除上次运行遗留的文件
+        while True:
+            try:
+                self.clean()
+            except Exception as e:
+                logger.warning("[TmpDir] clean error: {}".format(e))
+            if self.stopped.wait(self.clean_interval):
+                return
+
+    def get_stats(self) -> dict:
+        """文件数和总大小为上次清理时的统计"""
+        with self.lock:
+            return dict(self.stats, held=len(self.refs))
+
+    def _collect_metrics(self):
+        stats = self.get_stats()
+        return [
+            ("tmp_files", "gauge", "Files in the tmp directory at the last scan", [({}, stats["files"])]),
+            ("tmp_bytes", "gauge", "Total size of the tmp directory at the last scan", [({}, stats["bytes"])]),
+            ("tmp_held_files", "gauge", "Tmp files referenced by replies being sent", [({}, stats["held"])]),
+            (
+                "tmp_deleted_total",
+                "counter",
+                "Tmp files deleted by the janitor or after release",
+                [({"reason": "age"}, stats["deleted_age"]), ({"reason": "size"}, stats["deleted_size"]), ({"reason": "release"}, stats["deleted_release"])],
+            ),
+        ]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_tmp_store() -> TmpStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TmpStore(
+                    pathlib.Path("./tmp/"),
+                    shards=conf().get("tmp_dir_shards", 64),
+                    max_age=conf().get("tmp_dir_max_age", 86400),
+                    max_size=conf().get("tmp_dir_max_size", 1024) * 1024 * 1024,
+                    clean_interval=conf().get("tmp_dir_clean_interval", 600),
+                )
+                _store.start_janitor()
+                metrics.register_collector(_store._collect_metrics)
+    return _store
+
+
+class TmpDir(object):
+    """临时文件目录，所有实例共享同一个TmpStore"""
 
     def __init__(self):
-        pathExists = os.path.exists(self.tmpFilePath)
-        if not pathExists:
-            os.makedirs(self.tmpFilePath)
+        self.store = get_tmp_store()
 
     def path(self):
-        return str(self.tmpFilePath) + "/"
+        return self.store.path()
+
+    def file(self, name: str) -> str:
+        return self.store.file(name)
+
+    def hold(self, path) -> bool:
+        return self.store.hold(path)
+
+    def release(self, path):
+        self.store.release(path)
+
+    def hold_reply(self, reply: Reply) -> bool:
+        """引用回复中的临时文件（如文字转语音生成的语音），发送完成后用release_reply释放"""
+        return self.store.hold(reply_file(reply))
+
+    def release_reply(self, reply: Reply):
+        self.store.release(reply_file(reply))
@@ -1,39 +1,113 @@
+import asyncio
 import threading
 import time
 
+from common.expired_dict import ExpiredDict
+
 
 class TokenBucket:
-    def __init__(self, tpm, timeout=None):
-        self.capacity = int(tpm)  # 令牌桶容量
-        self.tokens = 0  # 初始令牌数为0
+    """
+    令牌桶限流，每次取令牌时根据经过的时间补充令牌，不需要后台线程
+    令牌不足时先预订令牌再等待，多个线程等待时按预订顺序获得令牌
+    """
+
+    def __init__(self, tpm, timeout=None, capacity=None):
+        self.capacity = int(capacity if capacity is not None else tpm)  # 令牌桶容量
         self.rate = int(tpm) / 60  # 令牌每秒生成速率
         self.timeout = timeout  # 等待令牌超时时间
-        self.cond = threading.Condition()  # 条件变量
-        self.is_running = True
-        # 开启令牌生成线程
-        threading.Thread(target=self._generate_tokens).start()
-
-    def _generate_tokens(self):
-        """生成令牌"""
-        while self.is_running:
-            with self.cond:
-                if self.tokens < self.capacity:
-                    self.tokens += 1
-                self.cond.notify()  # 通知获取令牌的线程
-            time.sleep(1 / self.rate)
+        self.tokens = min(1, self.capacity)  # 初始令牌数，可以立即处理第一个请求
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
 
-    def get_token(self):
-        """获取令牌"""
-        with self.cond:
-            while self.tokens <= 0:
-                flag = self.cond.wait(self.timeout)
-                if not flag:  # 超时
-                    return False
+    def reserve(self, timeout=None):
+        """
+        预订一个令牌
+        :return: 需要等待的秒数，0表示令牌可以立即使用；等待时间超过timeout时不预订，返回None
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_time) * self.rate)
+            self.last_time = now
+            wait = 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if timeout is not None and wait > timeout:
+                return None
             self.tokens -= 1
+            return wait
+
+    def try_acquire(self):
+        """不等待，有令牌时返回True"""
+        return self.reserve(0) is not None
+
+    def get_token(self):
+        """获取令牌，最多等待timeout秒"""
+        wait = self.reserve(self.timeout)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    async def acquire(self):
+        """get_token的异步版本，等待时不占用线程"""
+        wait = self.reserve(self.timeout)
+        if wait is None:
+            return False
+        if wait > 0:
+            await asyncio.sleep(wait)
         return True
 
     def close(self):
-        self.is_running = False
+        """兼容旧接口，没有需要释放的资源"""
+
+
+class KeyedTokenBucket:
+    """按key（用户、群、API Key等）分别限流，长时间未使用的key会被清理"""
+
+    def __init__(self, tpm, timeout=None, capacity=None, idle_seconds=3600, max_keys=100000):
+        self.tpm = tpm
+        self.timeout = timeout
+        self.capacity = capacity
+        self.buckets = ExpiredDict(idle_seconds, max_size=max_keys)
+        self.lock = threading.Lock()
+
+    def bucket(self, key) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            with self.lock:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(self.tpm, self.timeout, self.capacity)
+                    self.buckets[key] = bucket
+        return bucket
+
+    def try_acquire(self, key):
+        return self.bucket(key).try_acquire()
+
+    def get_token(self, key):
+        return self.bucket(key).get_token()
+
+    async def acquire(self, key):
+        return await self.bucket(key).acquire()
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_token_bucket(name, tpm, timeout=None, capacity=None, keyed=False):
+    """
+    按名称共享的令牌桶，同一个名称的限流在所有bot、channel实例间共享
+    参数变化（如修改了配置）时重新创建
+    """
+    key = (name, keyed)
+    params = (tpm, timeout, capacity)
+    with _buckets_lock:
+        item = _buckets.get(key)
+        if item is None or item[0] != params:
+            bucket = KeyedTokenBucket(tpm, timeout, capacity) if keyed else TokenBucket(tpm, timeout, capacity)
+            item = (params, bucket)
+            _buckets[key] = item
+        return item[1]
 
 
 if __name__ == "__main__":
@@ -4,7 +4,6 @@ import os
 from typing import List, Dict
 
 from urllib.parse import urlparse
-from PIL import Image
 from common.log import logger
 
 def fsize(file):
@@ -25,6 +24,8 @@ def fsize(file):
 def compress_imgfile(file, max_size):
     if fsize(file) <= max_size:
         return file
+    from PIL import Image
+
     file.seek(0)
     img = Image.open(file)
     rgb_image = img.convert("RGB")
@@ -0,0 +1,175 @@
+"""
+各webhook channel共用的HTTP服务启动入口，支持通过web_server_backend选择服务器实现：
+- simple: web.py自带的runsimple服务器（默认，与原有行为一致）
+- cheroot: 可配置线程数、队列长度、keep-alive超时的多线程cheroot服务器
+开启metrics时，所有服务器都在metrics_path提供Prometheus格式的指标
+"""
+
+import hmac
+import re
+import threading
+import time
+
+from common import metrics
+from common.log import logger
+from config import conf
+
+_servers = []
+_servers_lock = threading.Lock()
+_stats = {}  # "server:路由" -> {"requests", "errors", "latency_total", "latency_max"}
+OTHER_ROUTE = "other"  # 不匹配任何路由的请求（如扫描器访问的随机路径）合并统计
+_stats_lock = threading.Lock()
+
+
+class LatencyMiddleware(object):
+    """开启metrics时按路由记录请求数、5xx数和处理耗时"""
+
+    def __init__(self, app, name, routes=()):
+        """
+        :param routes: web.py的路由规则，统计按匹配到的规则分组（如/sse/(.+)），避免每个用户或随机路径都产生一组统计
+        """
+        self.app = app
+        self.name = name
+        self.routes = [(re.compile("^" + pattern + r"\Z"), pattern) for pattern in routes]
+
+    def _route(self, path) -> str:
+        for regex, pattern in self.routes:
+            if regex.match(path):
+                return pattern
+        return OTHER_ROUTE
+
+    def __call__(self, environ, start_response):
+        start = time.monotonic()
+        status_holder = []
+
+        def _start_response(status, headers, exc_info=None):
+            status_holder.append(status)
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.app(environ, _start_response)
+        except Exception:
+            status_holder.append("500")
+            raise
+        finally:
+            cost = time.monotonic() - start
+            error = bool(status_holder) and status_holder[-1].startswith("5")
+            if metrics.enabled():
+                _record(self.name, self._route(environ.get("PATH_INFO", "")), cost, error)
+            logger.debug("[web_server] {} {} {} cost={:.3f}s".format(environ.get("REQUEST_METHOD"), environ.get("PATH_INFO"), status_holder[-1] if status_holder else "-", cost))
+
+
+class MetricsMiddleware(object):
+    """开启metrics时在metrics_path返回指标，配置了metrics_token时需要携带 Authorization: Bearer <token>"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if not metrics.enabled() or environ.get("PATH_INFO") != conf().get("metrics_path", "/metrics"):
+            return self.app(environ, start_response)
+        token = conf().get("metrics_token", "")
+        if token and not hmac.compare_digest(environ.get("HTTP_AUTHORIZATION", ""), "Bearer " + token):
+            start_response("401 Unauthorized", [("Content-Type", "text/plain")])
+            return [b"unauthorized"]
+        body = metrics.render().encode("utf-8")
+        start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4; charset=utf-8"), ("Content-Length", str(len(body)))])
+        return [body]
+
+
+def _record(name, route, cost, error):
+    key = "{}:{}".format(name, route)
+    with _stats_lock:
+        stats = _stats.get(key)
+        if stats is None:
+            stats = {"requests": 0, "errors": 0, "latency_total": 0.0, "latency_max": 0.0}
+            _stats[key] = stats
+        stats["requests"] += 1
+        stats["latency_total"] += cost
+        stats["latency_max"] = max(stats["latency_max"], cost)
+        if error:
+            stats["errors"] += 1
+
+
+def get_server_stats() -> dict:
+    """按channel和路由返回请求数、错误数和耗时，未开启metrics时不统计"""
+    with _stats_lock:
+        return {
+            key: {
+                "requests": stats["requests"],
+                "errors": stats["errors"],
+                "latency_avg_ms": round(stats["latency_total"] * 1000 / stats["requests"], 2),
+                "latency_max_ms": round(stats["latency_max"] * 1000, 2),
+            }
+            for key, stats in _stats.items()
+        }
+
+
+def _collect_metrics():
+    with _stats_lock:
+        items = [(key.split(":", 1), dict(stats)) for key, stats in _stats.items()]
+    return [
+        ("http_requests_total", "counter", "HTTP requests handled by channel web servers", [({"server": name, "path": path}, stats["requests"]) for (name, path), stats in items]),
+        ("http_errors_total", "counter", "HTTP requests answered with 5xx", [({"server": name, "path": path}, stats["errors"]) for (name, path), stats in items]),
+        ("http_latency_seconds_total", "counter", "Total HTTP handling time in seconds", [({"server": name, "path": path}, stats["latency_total"]) for (name, path), stats in items]),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
+
+
+def run_web_app(app, port, host="0.0.0.0", name="web"):
+    """
+    启动web.py应用并阻塞，直到服务器停止
+    :param app: web.application
+    :param name: 用于日志和统计的名称，一般为channel名
+    """
+    from web.httpserver import StaticMiddleware
+
+    routes = [pattern for pattern, _ in app.mapping] + [conf().get("metrics_path", "/metrics")]
+    func = LatencyMiddleware(MetricsMiddleware(StaticMiddleware(app.wsgifunc())), name, routes)
+    server = _create_server(func, (host, port))
+    with _servers_lock:
+        _servers.append(server)
+    logger.info("[web_server] {} server listening on http://{}:{}/, backend={}".format(name, host, port, conf().get("web_server_backend", "simple")))
+    try:
+        server.start()
+    except (KeyboardInterrupt, SystemExit):
+        server.stop()
+        raise
+    finally:
+        with _servers_lock:
+            if server in _servers:
+                _servers.remove(server)
+
+
+def _create_server(func, bind_addr):
+    backend = conf().get("web_server_backend", "simple")
+    if backend == "cheroot":
+        from cheroot import wsgi
+
+        return wsgi.Server(
+            bind_addr,
+            func,
+            numthreads=conf().get("web_server_threads", 20),
+            max=conf().get("web_server_max_threads", -1),
+            request_queue_size=conf().get("web_server_queue_size", 64),
+            timeout=conf().get("web_server_timeout", 10),
+            shutdown_timeout=conf().get("web_server_shutdown_timeout", 5),
+        )
+    if backend != "simple":
+        logger.warning("[web_server] unknown web_server_backend: {}, fallback to simple".format(backend))
+    from web.httpserver import WSGIServer
+
+    return WSGIServer(bind_addr, func)
+
+
+def stop_servers():
+    """停止所有服务器：不再接受新连接，并等待处理中的请求完成（最多web_server_shutdown_timeout秒）"""
+    with _servers_lock:
+        servers = list(_servers)
+    for server in servers:
+        try:
+            server.stop()
+        except Exception as e:
+            logger.warning("[web_server] stop server error: {}".format(e))
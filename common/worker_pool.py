@@ -0,0 +1,216 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from common import metrics
+from common.log import logger
+from config import conf
+
+# 任务优先级，数值越小越先执行
+PRIORITY_ADMIN = 0  # 管理命令，如 #清除记忆
+PRIORITY_PLUGIN = 1  # 插件指令，如 $xxx
+PRIORITY_NORMAL = 2  # 普通消息
+
+
+class PoolBusyError(Exception):
+    """线程池积压队列已满"""
+
+
+class PriorityThreadPool(object):
+    """
+    支持优先级和有界积压队列的线程池，submit接口与ThreadPoolExecutor保持一致
+    积压队列满时，除PRIORITY_ADMIN以外的任务会被拒绝并抛出PoolBusyError
+    """
+
+    def __init__(self, max_workers, max_backlog=0, name="pool"):
+        self.max_workers = max(1, int(max_workers))
+        self.max_backlog = max(0, int(max_backlog or 0))  # 0表示不限制
+        self.name = name
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._idle = 0
+        self._wakeups = 0  # 已notify但还未醒来的空闲线程数，避免连续提交时重复唤醒同一个线程
+        self._busy = 0
+        self._shutdown = False
+        self._initializer = None  # 兼容ThreadPoolExecutor，工作线程启动时调用
+        self.stats = {"submitted": 0, "completed": 0, "rejected": 0}
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        return self.submit_with_priority(PRIORITY_NORMAL, fn, *args, **kwargs)
+
+    def submit_with_priority(self, priority, fn, *args, **kwargs) -> Future:
+        future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            if self.max_backlog and priority > PRIORITY_ADMIN and len(self._queue) >= self.max_backlog:
+                self.stats["rejected"] += 1
+                raise PoolBusyError("[{}] backlog is full, size={}".format(self.name, len(self._queue)))
+            heapq.heappush(self._queue, (priority, next(self._counter), future, fn, args, kwargs))
+            self.stats["submitted"] += 1
+            if self._idle > self._wakeups:
+                self._wakeups += 1
+                self._cond.notify()
+            elif len(self._threads) < self.max_workers:
+                self._start_worker()
+        return future
+
+    def _start_worker(self):
+        t = threading.Thread(target=self._worker, name="{}_{}".format(self.name, len(self._threads)), daemon=True)
+        self._threads.append(t)
+        t.start()
+
+    def _worker(self):
+        if callable(self._initializer):
+            try:
+                self._initializer()
+            except Exception as e:
+                logger.exception("[{}] worker initializer error: {}".format(self.name, e))
+        while True:
+            with self._cond:
+                while not self._queue and not self._shutdown:
+                    self._idle += 1
+                    self._cond.wait()
+                    self._idle -= 1
+                    if self._wakeups > 0:
+                        self._wakeups -= 1
+                if not self._queue:
+                    self._threads.remove(threading.current_thread())
+                    return
+                _, _, future, fn, args, kwargs = heapq.heappop(self._queue)
+                self._busy += 1
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._busy -= 1
+                    self.stats["completed"] += 1
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for t in list(self._threads):
+                t.join()
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            return dict(
+                self.stats,
+                name=self.name,
+                max_workers=self.max_workers,
+                workers=len(self._threads),
+                busy=self._busy,
+                backlog=len(self._queue),
+                max_backlog=self.max_backlog,
+            )
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_handler_pool() -> PriorityThreadPool:
+    """处理消息的I/O线程池，主要用于调用bot、插件等耗时的网络请求"""
+    return _get_pool("handler_pool", lambda: PriorityThreadPool(conf().get("handler_pool_size", 8), conf().get("handler_pool_max_backlog", 0), "handler_pool"))
+
+
+def get_cpu_pool() -> PriorityThreadPool:
+    """CPU密集任务的线程池，如语音转换、图片压缩、敏感词扫描等，与I/O任务隔离"""
+    return _get_pool("cpu_pool", lambda: PriorityThreadPool(conf().get("cpu_pool_size") or min(4, os.cpu_count() or 1), 0, "cpu_pool"))
+
+
+def get_outbound_pool() -> PriorityThreadPool:
+    """发送消息的线程池，由各channel的出站队列使用"""
+    return _get_pool("outbound_pool", lambda: PriorityThreadPool(conf().get("outbound_pool_size", 4), 0, "outbound_pool"))
+
+
+def get_plugin_pool() -> PriorityThreadPool:
+    """设置了插件超时时间时执行插件的线程池，超时的插件在其中继续运行直到结束"""
+    return _get_pool("plugin_pool", lambda: PriorityThreadPool(conf().get("plugin_pool_size", 8), 0, "plugin_pool"))
+
+
+def run_in_cpu_pool(fn, *args, **kwargs):
+    """在CPU线程池中同步执行fn并返回结果，用于限制CPU密集任务的并发"""
+    return get_cpu_pool().submit(fn, *args, **kwargs).result()
+
+
+def _get_pool(name, factory):
+    pool = _pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(name)
+            if pool is None:
+                pool = factory()
+                _pools[name] = pool
+                logger.debug("[{}] created, max_workers={}, max_backlog={}".format(name, pool.max_workers, pool.max_backlog))
+    return pool
+
+
+def get_pool_stats() -> list:
+    return [pool.get_stats() for pool in list(_pools.values())]
+
+
+def _collect_metrics():
+    stats = get_pool_stats()
+    return [
+        ("pool_busy_workers", "gauge", "Workers running a task", [({"pool": item["name"]}, item["busy"]) for item in stats]),
+        ("pool_max_workers", "gauge", "Maximum workers of the pool", [({"pool": item["name"]}, item["max_workers"]) for item in stats]),
+        ("pool_utilization", "gauge", "Busy workers divided by maximum workers", [({"pool": item["name"]}, item["busy"] / item["max_workers"]) for item in stats]),
+        ("pool_backlog", "gauge", "Tasks waiting for a worker", [({"pool": item["name"]}, item["backlog"]) for item in stats]),
+        ("pool_completed_total", "counter", "Tasks completed by the pool", [({"pool": item["name"]}, item["completed"]) for item in stats]),
+        ("pool_rejected_total", "counter", "Tasks rejected because the backlog was full", [({"pool": item["name"]}, item["rejected"]) for item in stats]),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
+
+
+class _DelayedScheduler(object):
+    """单线程的定时器，替代在工作线程中sleep等待"""
+
+    def __init__(self):
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def call_later(self, delay, fn, *args, **kwargs):
+        with self._cond:
+            heapq.heappush(self._queue, (time.monotonic() + max(0, delay), next(self._counter), fn, args, kwargs))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="delayed_scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue or self._queue[0][0] > time.monotonic():
+                    self._cond.wait(self._queue[0][0] - time.monotonic() if self._queue else None)
+                _, _, fn, args, kwargs = heapq.heappop(self._queue)
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                logger.exception("[delayed_scheduler] callback error: {}".format(e))
+
+
+_scheduler = _DelayedScheduler()
+
+
+def call_later(delay, fn, *args, **kwargs):
+    """
+    delay秒后调用fn，所有回调在同一个定时线程中执行，耗时操作应在回调中提交到线程池
+    如：call_later(3, get_handler_pool().submit, send, reply)
+    """
+    _scheduler.call_later(delay, fn, *args, **kwargs)
@@ -5,6 +5,8 @@ import logging
 import os
 import pickle
 import copy
+from collections.abc import Mapping
+from types import MappingProxyType
 
 from common.log import logger
 
@@ -56,12 +58,67 @@ available_setting = {
     "image_proxy": True,  # 是否需要图片代理，国内访问LinkAI时需要
     "image_create_prefix": ["画", "看", "找"],  # 开启图片回复的前缀
     "concurrency_in_session": 1,  # 同一会话最多有多少条消息在处理中，大于1可能乱序
+    "handler_pool_size": 8,  # 处理消息的线程池大小
+    "handler_pool_max_backlog": 0,  # 处理消息线程池的最大积压任务数，超过后回复busy_reply，0表示不限制
+    "cpu_pool_size": 0,  # 语音转换、图片压缩等CPU密集任务的线程池大小，0表示根据CPU核数自动设置
+    "busy_reply": "",  # 消息积压过多时的回复，为空则不回复
+    "channel_async_mode": False,  # 是否使用asyncio处理消息，开启后等待bot回复时不占用线程
+    "http_pool_connections": 20,  # 共享HTTP连接池缓存的host数
+    "http_pool_maxsize": 20,  # 每个host的最大连接数
+    "http_pool_block": True,  # 某个host的连接数达到http_pool_maxsize时是否等待空闲连接，为False时会临时新建连接，连接数不受限制
+    "http_pool_timeout": 30,  # 等待空闲连接的最长时间，单位秒，超时后请求失败
+    "http_max_retries": 2,  # 连接失败、幂等请求5xx时的重试次数
+    "http_retry_backoff": 0.5,  # 重试退避系数，第n次重试等待 backoff * 2^(n-1) 秒
+    "http_connect_timeout": 10,  # 未指定timeout的HTTP请求的连接超时时间
+    "http_read_timeout": 300,  # 未指定timeout的HTTP请求的读取超时时间
+    "stream_reply": False,  # 是否流式回复，开启后边生成边把完整的句子、图片、文件分段发送，支持dify和OpenAI兼容接口的bot（chatgpt、deepseek、moonshot、modelscope、智谱）
+    "stream_min_segment_length": 20,  # 流式回复时每段文本的最小长度，避免消息过碎
+    "web_server_backend": "simple",  # webhook类channel的HTTP服务器，simple: web.py自带服务器，cheroot: 可配置线程数的cheroot服务器
+    "web_server_threads": 20,  # cheroot工作线程数
+    "web_server_max_threads": -1,  # cheroot最大工作线程数，-1表示不限制
+    "web_server_queue_size": 64,  # cheroot等待处理的连接队列长度
+    "web_server_timeout": 10,  # cheroot连接超时时间（秒），也是keep-alive空闲连接的保持时间
+    "web_server_shutdown_timeout": 5,  # 退出时等待处理中请求完成的最长时间（秒）
+    "plugin_timeout": 0,  # 插件处理单个事件的时间预算（秒），超时后跳过该插件继续处理消息，从插件开始执行时计算，0表示不限制
+    "plugin_timeouts": {},  # 按插件名单独设置时间预算，如 {"JinaSum": 90}
+    "plugin_pool_size": 8,  # 设置了时间预算时执行插件的线程数，排队超过时间预算的调用被跳过，不计入插件的失败
+    "plugin_breaker_threshold": 5,  # 插件连续失败或超时多少次后熔断，0表示不熔断
+    "plugin_breaker_cooldown": 60,  # 插件熔断后暂停调用的时间（秒）
+    "tmp_dir_shards": 64,  # 临时目录./tmp/下按文件名哈希分成的子目录数，0表示不分子目录
+    "tmp_dir_max_age": 86400,  # 临时文件保留时间（秒），超过后由后台线程删除，0表示不按时间清理
+    "tmp_dir_max_size": 1024,  # 临时目录总大小上限（MB），超过时从最旧的文件开始删除，0表示不限制
+    "tmp_dir_clean_interval": 600,  # 临时目录后台清理的间隔（秒），0表示不清理
+    "metrics": False,  # 是否记录各处理阶段的耗时和队列、线程池状态，开启后webhook类channel的web服务器提供Prometheus格式的指标
+    "metrics_path": "/metrics",  # 指标的访问路径
+    "metrics_token": "",  # 访问指标时需要的token（Authorization: Bearer <token>），为空表示不校验
     "image_create_size": "256x256",  # 图片大小,可选有 256x256, 512x512, 1024x1024 (dall-e-3默认为1024x1024)
     "group_chat_exit_group": False,
     "group_exit_msg": "",  # 退出群聊的消息
     "accept_friend_msg": "",  # 接受好友请求后发送的消息
     # chatgpt会话参数
     "expires_in_seconds": 3600,  # 无操作会话的过期时间
+    "session_store": "",  # 会话持久化存储，可选：空（仅保存在内存中）、sqlite（保存到appdata_dir/sessions.db，重启后可恢复上下文）
+    "session_store_flush_interval": 1,  # 会话批量写入存储的间隔，单位秒
+    "session_cache_size": 10000,  # 启用会话存储时内存中最多保留的会话数，超出后淘汰最久未使用的会话，需要时再从存储加载
+    "shared_state": "",  # 多进程共享状态，用于多个进程处理同一个webhook时的会话锁、消息去重和公众号被动回复缓存，可选：空（进程内存）、redis
+    "shared_state_redis_url": "redis://localhost:6379/0",  # shared_state为redis时的连接地址
+    "shared_state_prefix": "dow:",  # 共享状态key的前缀，多个机器人共用一个Redis时需区分
+    "shared_state_lock_ttl": 600,  # 会话锁的最长持有时间，单位秒，防止进程崩溃后会话一直被锁住
+    "shared_state_lock_wait": 5,  # 会话锁被其他进程持有时最多等待的秒数，超时后消息放回会话队列稍后重试，不占用处理线程
+    "reply_cache": False,  # 是否开启回复缓存，相同的问题在有效期内直接返回缓存的回复，缓存不考虑会话上下文
+    "reply_cache_apps": ["dify:workflow"],  # 开启缓存的应用，可填 dify:<app_type>、dify:<api_key>、<bot_type>、<bot_type>:<model>，只应填写不依赖历史消息的应用；dify只有workflow应用生效，开启stream_reply时其他bot不生效
+    "reply_cache_ttl": 600,  # 回复缓存的有效期，单位秒
+    "reply_cache_max_size": 1000,  # 最多缓存的回复数，超出后淘汰最久未使用的
+    "singleflight": True,  # reply_cache_apps中的应用同时收到相同问题时只请求一次bot，结果发给所有提问者
+    "semantic_cache": False,  # 是否开启语义缓存，对reply_cache_apps中的应用，问题与缓存的问题足够相似时直接返回缓存的回复，需要安装numpy
+    "semantic_cache_threshold": 0.8,  # 语义缓存的相似度阈值，0~1，越大匹配越严格；问题中的数字和英文单词（如订单号、选项字母）还需要完全相同
+    "semantic_cache_max_size": 5000,  # 语义缓存最多保存的问题数，超出后覆盖最早的
+    "semantic_cache_ttl": 86400,  # 语义缓存的有效期，单位秒
+    "outbound_pool_size": 4,  # 发送消息的线程数，gewechat、企业微信应用的回复通过出站队列按接收者顺序发送
+    "outbound_max_retries": 2,  # 出站消息发送失败的重试次数，重试延后调度，不占用线程
+    "outbound_coalesce_text": True,  # 同一接收者有消息积压时，是否把相邻的文本回复合并为一条发送
+    "gewechat_send_qps": 5,  # gewechat每秒最多发送的消息数，0表示不限制
+    "wechatcomapp_send_qps": 10,  # 企业微信应用每秒最多发送的消息数，0表示不限制
     # 人格描述
     "character_desc": "你是ChatGPT, 一个由OpenAI训练的大型语言模型, 你旨在回答并解决人们的任何问题，并且可以使用多种语言与人交流。",
     "conversation_max_tokens": 1000,  # 支持上下文记忆的最多字符数
@@ -181,6 +238,9 @@ available_setting = {
     "gewechat_token": "",
     "gewechat_app_id": "",
     "gewechat_callback_url": "", # 回调地址，示例：http://172.17.0.1:9919/v2/api/callback/collect
+    "gewechat_contact_cache_ttl": 3600, # 好友昵称和群成员列表的缓存时间，联系人变更时会自动刷新
+    "gewechat_ingress_queue_size": 1000, # 回调消息队列长度，队列满时丢弃新消息
+    "gewechat_ingress_workers": 2, # 处理回调消息的线程数
     
     # chatgpt指令自定义触发词
     "clear_memory_commands": ["#清除记忆"],  # 重置会话指令，必须以#开头
@@ -231,17 +291,18 @@ class Config(dict):
         return super().__getitem__(key)
 
     def __setitem__(self, key, value):
+        global _config_version
         if key not in available_setting:
             raise Exception("key {} not in available_setting".format(key))
-        return super().__setitem__(key, value)
+        _config_version += 1
+        super().__setitem__(key, value)
+        if self is config:
+            _notify_config_change()
 
     def get(self, key, default=None):
-        try:
-            return self[key]
-        except KeyError as e:
-            return default
-        except Exception as e:
-            raise e
+        if key not in available_setting:
+            raise Exception("key {} not in available_setting".format(key))
+        return super().get(key, default)
             
     def set(self, key, value):
         try:
@@ -275,9 +336,91 @@ class Config(dict):
             logger.info("[Config] User datas error: {}".format(e))
 
 
+_config_version = 0  # 配置每次修改或重新加载都会递增，用于判断基于配置预计算的数据是否需要重建
 config = Config()
 
 
+def config_version() -> int:
+    return _config_version
+
+
+class ConfigSnapshot(Mapping):
+    """
+    某个版本配置的只读快照，支持属性访问，如 snapshot.model
+    列表和字典会转换为tuple和只读字典，可以放心地基于快照预计算数据
+    """
+
+    def __init__(self, d: dict, version: int):
+        object.__setattr__(self, "_data", {k: _freeze(v) for k, v in d.items()})
+        object.__setattr__(self, "version", version)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def __getattr__(self, key):
+        try:
+            return self._data[key]
+        except KeyError:
+            if key in available_setting:
+                return None
+            raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("ConfigSnapshot is read-only")
+
+
+def _freeze(value):
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    return value
+
+
+_snapshot = None
+_subscribers = []
+
+
+def config_snapshot() -> ConfigSnapshot:
+    """返回当前配置的快照，配置未变化时返回同一个对象"""
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is None or snapshot.version != _config_version:
+        version = _config_version
+        snapshot = ConfigSnapshot(dict(config), version)
+        _snapshot = snapshot
+    return snapshot
+
+
+def on_config_change(callback):
+    """
+    订阅配置变化，配置修改或重新加载后以新的ConfigSnapshot调用callback
+    :return: 取消订阅的函数
+    """
+    _subscribers.append(callback)
+    return lambda: _subscribers.remove(callback) if callback in _subscribers else None
+
+
+def _notify_config_change():
+    if not _subscribers:
+        return
+    snapshot = config_snapshot()
+    for callback in list(_subscribers):
+        try:
+            callback(snapshot)
+        except Exception as e:
+            logger.exception("[Config] config change callback error: {}".format(e))
+
+
 def drag_sensitive(config):
     try:
         if isinstance(config, str):
@@ -303,7 +446,7 @@ def drag_sensitive(config):
 
 
 def load_config():
-    global config
+    global config, _config_version
     config_path = "./config.json"
     if not os.path.exists(config_path):
         logger.info("配置文件不存在，将使用config-template.json模板")
@@ -338,6 +481,8 @@ def load_config():
     logger.info("[INIT] load config: {}".format(drag_sensitive(config)))
 
     config.load_user_datas()
+    _config_version += 1
+    _notify_config_change()
 
 def save_config():
     global config
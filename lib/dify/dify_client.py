@@ -1,4 +1,4 @@
-import requests
+from common import http_client
 
 
 class DifyClient:
@@ -13,7 +13,7 @@ class DifyClient:
         }
 
         url = f"{self.base_url}{endpoint}"
-        response = requests.request(method, url, json=json, params=params, headers=headers, stream=stream)
+        response = http_client.request(method, url, json=json, params=params, headers=headers, stream=stream)
 
         return response
 
@@ -23,7 +23,7 @@ class DifyClient:
         }
 
         url = f"{self.base_url}{endpoint}"
-        response = requests.request(method, url, data=data, headers=headers, files=files)
+        response = http_client.request(method, url, data=data, headers=headers, files=files)
 
         return response
 
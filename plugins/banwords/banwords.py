@@ -7,6 +7,7 @@ import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common.worker_pool import run_in_cpu_pool
 from plugins import *
 
 from .lib.WordsSearch import WordsSearch
@@ -19,6 +20,7 @@ from .lib.WordsSearch import WordsSearch
     desc="判断消息中是否有敏感词、决定是否回复。",
     version="1.0",
     author="lanvent",
+    context_types=[ContextType.TEXT, ContextType.IMAGE_CREATE],
 )
 class Banwords(Plugin):
     def __init__(self):
@@ -64,13 +66,13 @@ class Banwords(Plugin):
         content = e_context["context"].content
         logger.debug("[Banwords] on_handle_context. content: %s" % content)
         if self.action == "ignore":
-            f = self.searchr.FindFirst(content)
+            f = run_in_cpu_pool(self.searchr.FindFirst, content)
             if f:
                 logger.info("[Banwords] %s in message" % f["Keyword"])
                 e_context.action = EventAction.BREAK_PASS
                 return
         elif self.action == "replace":
-            if self.searchr.ContainsAny(content):
+            if run_in_cpu_pool(self.searchr.ContainsAny, content):
                 reply = Reply(ReplyType.INFO, "发言中包含敏感词，请重试: \n" + self.searchr.Replace(content))
                 e_context["reply"] = reply
                 e_context.action = EventAction.BREAK_PASS
@@ -83,14 +85,14 @@ class Banwords(Plugin):
         reply = e_context["reply"]
         content = reply.content
         if self.reply_action == "ignore":
-            f = self.searchr.FindFirst(content)
+            f = run_in_cpu_pool(self.searchr.FindFirst, content)
             if f:
                 logger.info("[Banwords] %s in reply" % f["Keyword"])
                 e_context["reply"] = None
                 e_context.action = EventAction.BREAK_PASS
                 return
         elif self.reply_action == "replace":
-            if self.searchr.ContainsAny(content):
+            if run_in_cpu_pool(self.searchr.ContainsAny, content):
                 reply = Reply(ReplyType.INFO, "已替换回复中的敏感词: \n" + self.searchr.Replace(content))
                 e_context["reply"] = reply
                 e_context.action = EventAction.CONTINUE
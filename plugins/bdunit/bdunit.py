@@ -4,12 +4,12 @@ import os
 import uuid
 from uuid import getnode as get_mac
 
-import requests
 
 import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common import http_client
 from plugins import *
 
 """利用百度UNIT实现智能对话
@@ -24,6 +24,7 @@ from plugins import *
     desc="Baidu unit bot system",
     version="0.1",
     author="jackson",
+    context_types=[ContextType.TEXT],
 )
 class BDunit(Plugin):
     def __init__(self):
@@ -75,7 +76,7 @@ class BDunit(Plugin):
         payload = ""
         headers = {"Content-Type": "application/json", "Accept": "application/json"}
 
-        response = requests.request("POST", url, headers=headers, data=payload)
+        response = http_client.request("POST", url, headers=headers, data=payload)
 
         # print(response.text)
         return response.json()["access_token"]
@@ -102,7 +103,7 @@ class BDunit(Plugin):
         }
         try:
             headers = {"Content-Type": "application/json"}
-            response = requests.post(url, json=body, headers=headers)
+            response = http_client.post(url, json=body, headers=headers)
             return json.loads(response.text)
         except Exception:
             return None
@@ -125,7 +126,7 @@ class BDunit(Plugin):
         }
         try:
             headers = {"Content-Type": "application/json"}
-            response = requests.post(url, json=body, headers=headers)
+            response = http_client.post(url, json=body, headers=headers)
             return json.loads(response.text)
         except Exception:
             return None
@@ -49,6 +49,7 @@ class StoryTeller:
     version="1.0",
     enabled=False,
     author="lanvent",
+    context_types=[ContextType.TEXT],
 )
 class Dungeon(Plugin):
     def __init__(self):
@@ -15,6 +15,8 @@ from plugins import *
     desc="A plugin that check unknown command",
     version="1.0",
     author="js00000",
+    context_types=[ContextType.TEXT],
+    prefixes=["{trigger_prefix}"],
 )
 class Finish(Plugin):
     def __init__(self):
@@ -92,6 +92,10 @@ ADMIN_COMMANDS = {
         "alias": ["plist", "插件"],
         "desc": "打印当前插件列表",
     },
+    "pstats": {
+        "alias": ["pstats", "插件统计"],
+        "desc": "打印插件的调用次数、耗时、失败和熔断状态",
+    },
     "setpri": {
         "alias": ["setpri", "设置插件优先级"],
         "args": ["插件名", "优先级"],
@@ -213,6 +217,8 @@ def get_help_text(isadmin, isgroup):
     desc="为你的机器人添加指令集，有用户和管理员两种角色，加载顺序请放在首位，初次运行后插件目录会生成配置文件, 填充管理员密码后即可认证",
     version="1.0",
     author="lanvent",
+    context_types=[ContextType.TEXT],
+    prefixes=["#"],
 )
 class Godcmd(Plugin):
     def __init__(self):
@@ -369,9 +375,17 @@ class Godcmd(Plugin):
                         cmd = next(c for c, info in ADMIN_COMMANDS.items() if cmd in info["alias"])
                         if cmd == "stop":
                             self.isrunning = False
+                            # 暂停期间需要拦截所有消息
+                            self.context_types = None
+                            self.prefixes = None
+                            PluginManager().refresh_dispatch()
                             ok, result = True, "服务已暂停"
                         elif cmd == "resume":
                             self.isrunning = True
+                            # 恢复注册时声明的消息类型和前缀
+                            self.context_types = Godcmd.context_types
+                            self.prefixes = Godcmd.prefixes
+                            PluginManager().refresh_dispatch()
                             ok, result = True, "服务已恢复"
                         elif cmd == "reconf":
                             load_config()
@@ -402,6 +416,18 @@ class Godcmd(Plugin):
                                     result += "已启用\n"
                                 else:
                                     result += "未启用\n"
+                            for info in PluginManager().lazy_plugins.values():
+                                result += f"{info['name']} - 未启用\n"
+                        elif cmd == "pstats":
+                            stats = PluginManager().get_plugin_stats()
+                            ok = True
+                            result = "插件统计：\n" if stats else "暂无插件统计"
+                            for name, item in stats.items():
+                                result += f"{name}: 调用{item['calls']} 平均{item['time_avg_ms']}ms 最长{item['time_max_ms']}ms"
+                                result += f" 失败{item['failures']} 超时{item['timeouts']} 跳过{item['skipped']}"
+                                if item["state"] != "closed":
+                                    result += " 熔断中"
+                                result += "\n"
                         elif cmd == "scanp":
                             new_plugins = PluginManager().scan_plugins()
                             ok, result = True, "插件扫描完成"
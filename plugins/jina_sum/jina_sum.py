@@ -6,28 +6,33 @@ import re
 from urllib.parse import urlparse
 import time
 import random
-import asyncio
-import nest_asyncio
 import requests
-from newspaper import Article
-import newspaper
-from bs4 import BeautifulSoup
-
-# 导入requests_html用于动态内容提取
-from requests_html import HTMLSession
-
-# 应用nest_asyncio以解决事件循环问题
-try:
-    nest_asyncio.apply()
-except Exception as e:
-    logger.warning(f"[JinaSum] 无法应用nest_asyncio: {str(e)}")
 
 import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common import http_client
+from common.singleflight import get_group
 from plugins import *
 
+# newspaper、bs4、requests_html等依赖较重，在提取网页内容时才导入，插件未开启时不影响启动速度
+_nest_asyncio_applied = False
+
+
+def _apply_nest_asyncio():
+    """requests_html渲染页面时需要在已有的事件循环中运行，应用nest_asyncio以解决事件循环问题"""
+    global _nest_asyncio_applied
+    if _nest_asyncio_applied:
+        return
+    _nest_asyncio_applied = True
+    try:
+        import nest_asyncio
+
+        nest_asyncio.apply()
+    except Exception as e:
+        logger.warning(f"[JinaSum] 无法应用nest_asyncio: {str(e)}")
+
 @plugins.register(
     name="JinaSum",
     desire_priority=10,
@@ -36,6 +41,7 @@ from plugins import *
     desc="Sum url link content with jina reader and llm",
     version="0.0.1",
     author="hanfangyuan",
+    context_types=[ContextType.SHARING, ContextType.TEXT],
 )
 class JinaSum(Plugin):
 
@@ -87,45 +93,16 @@ class JinaSum(Plugin):
 
             target_url = html.unescape(content) # 解决公众号卡片链接校验问题，参考 https://github.com/fatwang2/sum4all/commit/b983c49473fc55f13ba2c44e4d8b226db3517c45
 
-            # 先尝试使用newspaper3k提取内容
-            target_url_content = None
-            
-            # 使用newspaper3k
-            logger.debug("[JinaSum] 尝试使用newspaper3k提取内容")
-            target_url_content = self._get_content_via_newspaper(target_url)
-            
-            # 如果newspaper3k提取失败，尝试使用通用方法
-            if not target_url_content:
-                logger.debug("[JinaSum] newspaper3k提取失败，尝试使用通用方法")
-                target_url_content = self._extract_content_general(target_url)
-            
-            # 如果前两种方法都失败，使用jina提取
-            if not target_url_content:
-                logger.debug("[JinaSum] 所有方法都失败，回退到使用jina提取")
-                target_url_content = self._extract_content_by_jina(target_url)
-            
-            if not target_url_content:
-                logger.error("[JinaSum] 所有方法都失败，无法提取内容")
+            # 多人同时分享同一链接时只提取和总结一次
+            result, shared = get_group("jina_sum").do(target_url, self._summarize_url, target_url)
+            if shared:
+                logger.debug(f"[JinaSum] share in-flight summary: {target_url}")
+            if not result:
                 reply = Reply(ReplyType.ERROR, "我暂时无法总结链接，请稍后再试")
                 e_context["reply"] = reply
                 e_context.action = EventAction.BREAK_PASS
                 return
 
-            # 清洗网页内容
-            if target_url_content:
-                target_url_content = self._clean_content(target_url_content)
-            
-            # 获取API参数
-            openai_chat_url = self._get_openai_chat_url()
-            openai_headers = self._get_openai_headers()
-            openai_payload = self._get_openai_payload(target_url_content)
-            logger.debug(f"[JinaSum] openai_chat_url: {openai_chat_url}, openai_headers: {openai_headers}, openai_payload: {openai_payload}")
-            
-            # 发送请求获取摘要
-            response = requests.post(openai_chat_url, headers=openai_headers, json=openai_payload, timeout=60)
-            response.raise_for_status()
-            result = response.json()['choices'][0]['message']['content']
-            
             # 构建回复
             reply = Reply(ReplyType.TEXT, result)
             e_context["reply"] = reply
@@ -142,6 +119,43 @@ class JinaSum(Plugin):
             e_context["reply"] = reply
             e_context.action = EventAction.BREAK_PASS
 
+    def _summarize_url(self, target_url):
+        """提取网页内容并总结，所有方法都无法提取内容时返回None"""
+        # 先尝试使用newspaper3k提取内容
+        target_url_content = None
+        
+        # 使用newspaper3k
+        logger.debug("[JinaSum] 尝试使用newspaper3k提取内容")
+        target_url_content = self._get_content_via_newspaper(target_url)
+        
+        # 如果newspaper3k提取失败，尝试使用通用方法
+        if not target_url_content:
+            logger.debug("[JinaSum] newspaper3k提取失败，尝试使用通用方法")
+            target_url_content = self._extract_content_general(target_url)
+        
+        # 如果前两种方法都失败，使用jina提取
+        if not target_url_content:
+            logger.debug("[JinaSum] 所有方法都失败，回退到使用jina提取")
+            target_url_content = self._extract_content_by_jina(target_url)
+        
+        if not target_url_content:
+            logger.error("[JinaSum] 所有方法都失败，无法提取内容")
+            return None
+
+        # 清洗网页内容
+        target_url_content = self._clean_content(target_url_content)
+        
+        # 获取API参数
+        openai_chat_url = self._get_openai_chat_url()
+        openai_headers = self._get_openai_headers()
+        openai_payload = self._get_openai_payload(target_url_content)
+        logger.debug(f"[JinaSum] openai_chat_url: {openai_chat_url}, openai_headers: {openai_headers}, openai_payload: {openai_payload}")
+        
+        # 发送请求获取摘要
+        response = http_client.post(openai_chat_url, headers=openai_headers, json=openai_payload, timeout=60)
+        response.raise_for_status()
+        return response.json()['choices'][0]['message']['content']
+
     def get_help_text(self, verbose, **kwargs):
         return f'使用多种网页内容提取方式和ChatGPT总结网页链接内容'
 
@@ -175,7 +189,7 @@ class JinaSum(Plugin):
             logger.debug(f"[JinaSum] 使用Jina提取内容: {target_url}")
             jina_url = self._get_jina_url(target_url)
             headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"}
-            response = requests.get(jina_url, headers=headers, timeout=60)
+            response = http_client.get(jina_url, headers=headers, timeout=60)
             response.raise_for_status()
             return response.text
         except Exception as e:
@@ -193,6 +207,10 @@ class JinaSum(Plugin):
             str: 文章内容,失败返回None
         """
         try:
+            import newspaper
+            from bs4 import BeautifulSoup
+            from newspaper import Article
+
             # 处理B站短链接
             if "b23.tv" in url:
                 # 先获取重定向后的真实URL
@@ -531,7 +549,11 @@ class JinaSum(Plugin):
         """
         try:
             logger.debug(f"[JinaSum] 开始动态提取内容: {url}")
-            
+            from bs4 import BeautifulSoup
+            from requests_html import HTMLSession
+
+            _apply_nest_asyncio()
+
             # 创建会话并设置超时
             session = HTMLSession()
             
@@ -2,11 +2,11 @@
 
 import json
 import os
-import requests
 import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common import http_client
 from plugins import *
 import random
 
@@ -18,6 +18,7 @@ import random
     desc="关键词匹配过滤",
     version="0.1",
     author="fengyege.top",
+    context_types=[ContextType.TEXT],
 )
 class Keyword(Plugin):
     def __init__(self):
@@ -73,7 +74,7 @@ class Keyword(Plugin):
                     os.makedirs(file_path)
                 file_name = reply_text.split("/")[-1]  # 获取文件名
                 file_path = os.path.join(file_path, file_name)
-                response = requests.get(reply_text)
+                response = http_client.get(reply_text)
                 with open(file_path, "wb") as f:
                     f.write(response.content)
                 #channel/wechat/wechat_channel.py和channel/wechat_channel.py中缺少ReplyType.FILE类型。
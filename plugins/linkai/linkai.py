@@ -18,7 +18,8 @@ from config import plugin_config, conf
     version="0.1.0",
     enabled=False,
     author="https://link-ai.tech",
-    desire_priority=99
+    desire_priority=99,
+    context_types=[ContextType.TEXT, ContextType.IMAGE, ContextType.IMAGE_CREATE, ContextType.FILE, ContextType.SHARING],
 )
 class LinkAI(Plugin):
     def __init__(self):
@@ -1,6 +1,7 @@
-import requests
 from config import conf
 from common.log import logger
+from common import http_client
+from common.singleflight import get_group
 import os
 import html
 
@@ -19,24 +20,31 @@ class LinkSummary:
         }
         url = self.base_url() + "/v1/summary/file"
         logger.info(f"[LinkSum] file summary, app_code={app_code}")
-        res = requests.post(url, headers=self.headers(), files=file_body, data=body, timeout=(5, 300))
+        res = http_client.post(url, headers=self.headers(), files=file_body, data=body, timeout=(5, 300))
         return self._parse_summary_res(res)
 
     def summary_url(self, url: str, app_code: str):
         url = html.unescape(url)
+        # 多人同时分享同一篇文章时只请求一次总结
+        res, shared = get_group("linkai_summary").do((url, app_code), self._summary_url, url, app_code)
+        if shared:
+            logger.info(f"[LinkSum] share in-flight url summary, app_code={app_code}")
+        return res
+
+    def _summary_url(self, url: str, app_code: str):
         body = {
             "url": url,
             "app_code": app_code
         }
         logger.info(f"[LinkSum] url summary, app_code={app_code}")
-        res = requests.post(url=self.base_url() + "/v1/summary/url", headers=self.headers(), json=body, timeout=(5, 180))
+        res = http_client.post(url=self.base_url() + "/v1/summary/url", headers=self.headers(), json=body, timeout=(5, 180))
         return self._parse_summary_res(res)
 
     def summary_chat(self, summary_id: str):
         body = {
             "summary_id": summary_id
         }
-        res = requests.post(url=self.base_url() + "/v1/summary/chat", headers=self.headers(), json=body, timeout=(5, 180))
+        res = http_client.post(url=self.base_url() + "/v1/summary/chat", headers=self.headers(), json=body, timeout=(5, 180))
         if res.status_code == 200:
             res = res.json()
             logger.debug(f"[LinkSum] chat open, res={res}")
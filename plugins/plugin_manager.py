@@ -1,14 +1,23 @@
 # encoding:utf-8
 
+import copy
 import importlib
 import importlib.util
 import json
 import os
 import sys
-
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+from bridge.context import Context, ContextType
+from bridge.reply import Reply
+from common import metrics
+from common.circuit_breaker import CircuitBreaker
 from common.log import logger
 from common.singleton import singleton
 from common.sorted_dict import SortedDict
+from common.worker_pool import PoolBusyError, get_plugin_pool
 from config import conf, remove_plugin_config, write_plugin_config
 
 from .event import *
@@ -23,6 +32,15 @@ class PluginManager:
         self.pconf = {}
         self.current_plugin_path = None
         self.loaded = {}
+        self.lazy_plugins = {}  # 启动时未导入的未开启插件，插件名(大写) -> {name, module, path}
+        self.breakers = {}  # 插件名 -> CircuitBreaker
+        self.stats = {}  # 插件名 -> 调用次数、失败、超时、熔断跳过次数和耗时
+        self.stats_lock = threading.Lock()
+        self.dispatch_cache = {}  # (事件, 消息类型, 首字符) -> 需要调用的插件名列表，按优先级排序
+        self.dispatch_prefixes = {}  # 插件名 -> 触发前缀的tuple，None表示不限制
+        self.dispatch_chars = set()  # 所有触发前缀的首字符
+        self.dispatch_trigger_prefix = None  # 生成索引时的plugin_trigger_prefix
+        metrics.register_collector(self._collect_metrics)
 
     def register(self, name: str, desire_priority: int = 0, **kwargs):
         def wrapper(plugincls):
@@ -35,6 +53,9 @@ class PluginManager:
             plugincls.namecn = kwargs.get("namecn") if kwargs.get("namecn") != None else name
             plugincls.hidden = kwargs.get("hidden") if kwargs.get("hidden") != None else False
             plugincls.enabled = kwargs.get("enabled") if kwargs.get("enabled") != None else True
+            # 插件处理的消息类型和触发前缀，只对ON_HANDLE_CONTEXT事件生效，None表示不限制
+            plugincls.context_types = kwargs.get("context_types")
+            plugincls.prefixes = kwargs.get("prefixes")
             if self.current_plugin_path == None:
                 raise Exception("Plugin path not set")
             self.plugins[name.upper()] = plugincls
@@ -94,6 +115,12 @@ class PluginManager:
                 # 判断插件是否包含同名__init__.py文件
                 main_module_path = os.path.join(plugin_path, "__init__.py")
                 if os.path.isfile(main_module_path):
+                    # 未开启的插件暂不导入，避免加载其依赖，开启时再导入
+                    rawname = self._find_disabled_plugin(plugin_name)
+                    if rawname and plugin_path not in self.loaded:
+                        self.lazy_plugins[rawname.upper()] = {"name": rawname, "module": plugin_name, "path": plugin_path}
+                        logger.debug("Plugin %s is disabled, skip importing" % rawname)
+                        continue
                     # 导入插件
                     import_path = "plugins.{}".format(plugin_name)
                     try:
@@ -118,14 +145,20 @@ class PluginManager:
         modified = False
         for name, plugincls in self.plugins.items():
             rawname = plugincls.name
+            self.lazy_plugins.pop(name, None)
+            module = os.path.basename(plugincls.path)  # 插件所在目录，用于启动时不导入就能找到未开启的插件
             if rawname not in pconf["plugins"]:
                 modified = True
                 logger.info("Plugin %s not found in pconfig, adding to pconfig..." % name)
                 pconf["plugins"][rawname] = {
                     "enabled": plugincls.enabled,
                     "priority": plugincls.priority,
+                    "module": module,
                 }
             else:
+                if pconf["plugins"][rawname].get("module") != module:
+                    modified = True
+                    pconf["plugins"][rawname]["module"] = module
                 self.plugins[name].enabled = pconf["plugins"][rawname]["enabled"]
                 self.plugins[name].priority = pconf["plugins"][rawname]["priority"]
                 self.plugins._update_heap(name)  # 更新下plugins中的顺序
@@ -133,9 +166,46 @@ class PluginManager:
             self.save_config()
         return new_plugins
 
+    def _find_disabled_plugin(self, module):
+        """根据plugins.json查找目录对应的插件，插件未开启时返回插件名"""
+        for rawname, pconfig in self.pconf.get("plugins", {}).items():
+            if pconfig.get("module") == module and not pconfig.get("enabled", True):
+                return rawname
+        return None
+
+    def _load_lazy_plugin(self, name: str) -> bool:
+        """导入启动时跳过的未开启插件，用于开启、卸载等需要插件信息的操作"""
+        info = self.lazy_plugins.get(name)
+        if info is None or name in self.plugins:
+            return False
+        logger.info("Loading plugin %s" % info["name"])
+        try:
+            self.current_plugin_path = info["path"]
+            self.loaded[info["path"]] = importlib.import_module("plugins.{}".format(info["module"]))
+        except Exception as e:
+            logger.warn("Failed to import plugin %s: %s" % (info["module"], e))
+            return False
+        finally:
+            self.current_plugin_path = None
+        del self.lazy_plugins[name]
+        if name not in self.plugins:
+            return False
+        pconfig = self.pconf["plugins"].get(self.plugins[name].name)
+        if pconfig:
+            self.plugins[name].enabled = pconfig["enabled"]
+            self.plugins[name].priority = pconfig["priority"]
+            self.plugins._update_heap(name)
+        return True
+
     def refresh_order(self):
         for event in self.listening_plugins.keys():
             self.listening_plugins[event].sort(key=lambda name: self.plugins[name].priority, reverse=True)
+        self.refresh_dispatch()
+
+    def refresh_dispatch(self):
+        """清空插件分发索引，插件的监听列表、顺序或声明的消息类型、触发前缀变化后调用"""
+        self.dispatch_cache = {}
+        self.dispatch_trigger_prefix = None
 
     def activate_plugins(self):  # 生成新开启的插件实例
         failed_plugins = []
@@ -155,6 +225,7 @@ class PluginManager:
                 if name in self.instances:
                     self.instances[name].handlers.clear()
                 self.instances[name] = instance
+                self.breakers.pop(name, None)  # 重新加载的插件恢复调用
                 for event in instance.handlers:
                     if event not in self.listening_plugins:
                         self.listening_plugins[event] = []
@@ -184,24 +255,237 @@ class PluginManager:
         pconf = self.pconf
         logger.debug("plugins.json config={}".format(pconf))
         for name, plugin in pconf["plugins"].items():
-            if name.upper() not in self.plugins:
+            if name.upper() not in self.plugins and name.upper() not in self.lazy_plugins:
                 logger.error("Plugin %s not found, but found in plugins.json" % name)
         self.activate_plugins()
 
     def emit_event(self, e_context: EventContext, *args, **kwargs):
         if e_context.event in self.listening_plugins:
-            for name in self.listening_plugins[e_context.event]:
-                if self.plugins[name].enabled and e_context.action == EventAction.CONTINUE:
-                    logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
-                    instance = self.instances[name]
-                    instance.handlers[e_context.event](e_context, *args, **kwargs)
-                    if e_context.is_break():
-                        e_context["breaked_by"] = name
-                        logger.debug("Plugin %s breaked event %s" % (name, e_context.event))
+            stage = "plugin_" + e_context.event.name.lower()
+            channel = getattr(e_context.econtext.get("channel"), "channel_type", "")
+            context = e_context.econtext.get("context")
+            context_type = metrics.context_type_name(context)
+            key = self._dispatch_key(e_context.event, context)
+            names = self._dispatch_names(e_context.event, key)
+            pos = 0
+            while pos < len(names) and e_context.action == EventAction.CONTINUE:
+                name = names[pos]
+                pos += 1
+                if not self.plugins[name].enabled or (key is not None and not self._match_prefix(name, context)):
+                    continue
+                logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
+                with metrics.span(stage, channel=channel, plugin=name, context_type=context_type):
+                    self._call_handler(name, e_context, *args, **kwargs)
+                if e_context.is_break():
+                    e_context["breaked_by"] = name
+                    logger.debug("Plugin %s breaked event %s" % (name, e_context.event))
+                    break
+                # 插件修改了消息类型或内容后，按修改后的消息重新选择后续的插件
+                context = e_context.econtext.get("context")
+                new_key = self._dispatch_key(e_context.event, context)
+                if new_key != key:
+                    key = new_key
+                    names = self._remaining_names(e_context.event, key, name)
+                    pos = 0
         return e_context
 
+    def _dispatch_key(self, event, context):
+        """
+        插件分发索引的key，相同key的消息调用相同的插件
+        只有ON_HANDLE_CONTEXT事件按消息类型和触发前缀的首字符分发，其他事件调用全部监听的插件
+        """
+        if event != Event.ON_HANDLE_CONTEXT or context is None:
+            return None
+        trigger_prefix = conf().get("plugin_trigger_prefix", "$")
+        if self.dispatch_trigger_prefix != trigger_prefix:
+            self._build_dispatch_index(trigger_prefix)
+        first = None
+        if context.type == ContextType.TEXT and isinstance(context.content, str):
+            first = context.content[:1]
+            if first not in self.dispatch_chars:
+                first = None  # 不是任何触发前缀的开头，只调用不限制前缀的插件
+        return context.type, first
+
+    def _build_dispatch_index(self, trigger_prefix):
+        """
+        读取插件声明的触发前缀，前缀中的{trigger_prefix}替换为配置的plugin_trigger_prefix
+        插件实例的context_types、prefixes属性优先于注册时的声明，可以根据配置或运行状态调整
+        """
+        self.dispatch_prefixes = {}
+        self.dispatch_chars = set()
+        for name, instance in self.instances.items():
+            prefixes = getattr(instance, "prefixes", None)
+            if prefixes:
+                prefixes = tuple(prefix.replace("{trigger_prefix}", trigger_prefix) for prefix in prefixes)
+            if not prefixes or "" in prefixes:
+                self.dispatch_prefixes[name] = None
+                continue
+            self.dispatch_prefixes[name] = prefixes
+            self.dispatch_chars.update(prefix[0] for prefix in prefixes)
+        self.dispatch_cache = {}
+        self.dispatch_trigger_prefix = trigger_prefix
+
+    def _dispatch_names(self, event, key) -> list:
+        """返回key对应的插件列表，首次遇到时从监听列表中筛选并缓存"""
+        if key is None:
+            return list(self.listening_plugins.get(event, []))
+        names = self.dispatch_cache.get((event,) + key)
+        if names is None:
+            context_type, first = key
+            names = []
+            for name in self.listening_plugins.get(event, []):
+                context_types = getattr(self.instances.get(name), "context_types", None)
+                if context_types and context_type not in context_types:
+                    continue
+                prefixes = self.dispatch_prefixes.get(name)
+                if prefixes and context_type == ContextType.TEXT and not any(prefix[0] == first for prefix in prefixes):
+                    continue
+                names.append(name)
+            self.dispatch_cache[(event,) + key] = names
+        return names
+
+    def _remaining_names(self, event, key, current) -> list:
+        """key对应的插件中，优先级排在current之后的插件"""
+        listening = self.listening_plugins.get(event, [])
+        if current not in listening:
+            return []
+        later = set(listening[listening.index(current) + 1 :])
+        return [name for name in self._dispatch_names(event, key) if name in later]
+
+    def _match_prefix(self, name, context) -> bool:
+        """首字符相同的前缀可能有多个，调用前检查完整的前缀"""
+        prefixes = self.dispatch_prefixes.get(name)
+        if not prefixes or context.type != ContextType.TEXT:
+            return True
+        return isinstance(context.content, str) and context.content.startswith(prefixes)
+
+    def _call_handler(self, name, e_context: EventContext, *args, **kwargs):
+        """
+        调用插件的事件处理函数并统计耗时，出错或超时的插件被跳过，事件继续交给后续插件和默认逻辑处理
+        连续失败多次的插件会被熔断一段时间，期间直接跳过
+        """
+        breaker = self._get_breaker(name)
+        if not breaker.allow():
+            self._record(name, "skipped")
+            logger.debug("Plugin %s is tripped, skip event %s" % (name, e_context.event))
+            return
+        handler = self.instances[name].handlers[e_context.event]
+        timeout = self._get_timeout(name)
+        start = time.monotonic()
+        try:
+            if timeout:
+                self._call_with_timeout(handler, e_context, timeout, *args, **kwargs)
+            else:
+                handler(e_context, *args, **kwargs)
+        except PoolBusyError as e:
+            # 插件线程池被其他插件占满，不计入该插件的失败
+            breaker.release_probe()
+            self._record(name, "skipped")
+            logger.warning("[PluginManager] plugin %s skipped on event %s: %s" % (name, e_context.event, e))
+            return
+        except Exception as e:
+            cost = time.monotonic() - start
+            if isinstance(e, TimeoutError):
+                self._record(name, "timeouts", cost)
+                logger.warning("[PluginManager] plugin %s timed out after %.1fs on event %s, skipped" % (name, cost, e_context.event))
+            else:
+                self._record(name, "failures", cost)
+                logger.exception("[PluginManager] plugin %s failed on event %s: %s" % (name, e_context.event, e))
+            if breaker.record_failure():
+                logger.warning("[PluginManager] plugin %s failed %d times in a row, disabled for %ss" % (name, breaker.failures, breaker.cooldown))
+            return
+        self._record(name, "calls", time.monotonic() - start)
+        breaker.record_success()
+
+    def _call_with_timeout(self, handler, e_context: EventContext, timeout, *args, **kwargs):
+        """
+        插件在线程池中处理事件的副本，context和reply也是副本，超时后放弃副本，避免插件稍后修改正在处理的消息
+        时间预算从插件开始执行时计算，在线程池中排队超过timeout时取消调用并抛出PoolBusyError
+        """
+        copies = {key: _copy_event_value(value) for key, value in e_context.econtext.items()}
+        shadow = EventContext(e_context.event, dict(copies))
+        started = threading.Event()
+        started_at = []
+
+        def run():
+            started_at.append(time.monotonic())
+            started.set()
+            return handler(shadow, *args, **kwargs)
+
+        future = get_plugin_pool().submit(run)
+        if not started.wait(timeout) and future.cancel():
+            raise PoolBusyError("plugin pool is busy, waited %ss" % timeout)
+        started.wait()  # 取消失败说明已经开始执行
+        try:
+            future.result(max(0, timeout - (time.monotonic() - started_at[0])))
+        except TimeoutError:
+            future.cancel()
+            raise
+        for key, value in shadow.econtext.items():
+            original = e_context.econtext.get(key)
+            if key in copies and value is copies[key] and value is not original:
+                # 写回原对象，调用方持有的context、reply引用保持有效
+                vars(original).update(vars(value))
+            else:
+                e_context.econtext[key] = value
+        e_context.action = shadow.action
+
+    def _get_timeout(self, name):
+        """插件的时间预算（秒），plugin_timeouts中按插件名单独配置，0表示不限制"""
+        timeouts = conf().get("plugin_timeouts", {})
+        rawname = self.plugins[name].name
+        return timeouts.get(rawname, timeouts.get(name, conf().get("plugin_timeout", 0)))
+
+    def _get_breaker(self, name) -> CircuitBreaker:
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(conf().get("plugin_breaker_threshold", 5), conf().get("plugin_breaker_cooldown", 60))
+            self.breakers[name] = breaker
+        return breaker
+
+    def _record(self, name, field, cost=0.0):
+        with self.stats_lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = {"calls": 0, "failures": 0, "timeouts": 0, "skipped": 0, "time_total": 0.0, "time_max": 0.0}
+                self.stats[name] = stats
+            stats[field] += 1
+            stats["time_total"] += cost
+            stats["time_max"] = max(stats["time_max"], cost)
+
+    def get_plugin_stats(self) -> dict:
+        """
+        按插件返回事件处理统计
+        :return: {插件名: {calls, failures, timeouts, skipped, time_avg_ms, time_max_ms, state}}
+        """
+        with self.stats_lock:
+            items = [(name, dict(stats)) for name, stats in self.stats.items()]
+        result = {}
+        for name, stats in items:
+            count = stats["calls"] + stats["failures"] + stats["timeouts"]
+            result[self.plugins[name].name if name in self.plugins else name] = {
+                "calls": stats["calls"],
+                "failures": stats["failures"],
+                "timeouts": stats["timeouts"],
+                "skipped": stats["skipped"],
+                "time_avg_ms": round(stats["time_total"] * 1000 / count, 2) if count else 0,
+                "time_max_ms": round(stats["time_max"] * 1000, 2),
+                "state": self.breakers[name].state if name in self.breakers else "closed",
+            }
+        return result
+
+    def _collect_metrics(self):
+        stats = self.get_plugin_stats()
+        return [
+            ("plugin_failures_total", "counter", "Plugin handler exceptions", [({"plugin": name}, item["failures"]) for name, item in stats.items()]),
+            ("plugin_timeouts_total", "counter", "Plugin handlers that exceeded their time budget", [({"plugin": name}, item["timeouts"]) for name, item in stats.items()]),
+            ("plugin_skipped_total", "counter", "Plugin handler calls skipped by the circuit breaker", [({"plugin": name}, item["skipped"]) for name, item in stats.items()]),
+            ("plugin_circuit_open", "gauge", "Whether the plugin circuit breaker is open", [({"plugin": name}, int(item["state"] != "closed")) for name, item in stats.items()]),
+        ]
+
     def set_plugin_priority(self, name: str, priority: int):
         name = name.upper()
+        self._load_lazy_plugin(name)
         if name not in self.plugins:
             return False
         if self.plugins[name].priority == priority:
@@ -217,6 +501,7 @@ class PluginManager:
 
     def enable_plugin(self, name: str):
         name = name.upper()
+        self._load_lazy_plugin(name)
         if name not in self.plugins:
             return False, "插件不存在"
         if not self.plugins[name].enabled:
@@ -297,6 +582,7 @@ class PluginManager:
         from dulwich import porcelain
 
         name = name.upper()
+        self._load_lazy_plugin(name)
         if name not in self.plugins:
             return False, "插件不存在"
         if name in [
@@ -323,6 +609,7 @@ class PluginManager:
 
     def uninstall_plugin(self, name: str):
         name = name.upper()
+        self._load_lazy_plugin(name)
         if name not in self.plugins:
             return False, "插件不存在"
         if name in self.instances:
@@ -336,6 +623,7 @@ class PluginManager:
             for event in self.listening_plugins:
                 if name in self.listening_plugins[event]:
                     self.listening_plugins[event].remove(name)
+            self.refresh_dispatch()
             del self.plugins[name]
             del self.pconf["plugins"][rawname]
             self.loaded[dirname] = None
@@ -344,3 +632,13 @@ class PluginManager:
         except Exception as e:
             logger.error("Failed to uninstall plugin, {}".format(e))
             return False, "卸载插件失败，请手动删除文件夹完成卸载，" + str(e)
+
+
+def _copy_event_value(value):
+    """复制插件会原地修改的事件参数：Context连同kwargs，以及Reply"""
+    if isinstance(value, Context):
+        value = copy.copy(value)
+        value.kwargs = dict(value.kwargs)
+    elif isinstance(value, Reply):
+        value = copy.copy(value)
+    return value
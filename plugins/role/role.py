@@ -40,6 +40,7 @@ class RolePlay:
     version="1.0",
     enabled=False,
     author="lanvent",
+    context_types=[ContextType.TEXT],
 )
 class Role(Plugin):
     def __init__(self):
@@ -17,6 +17,8 @@ from plugins import *
     version="0.5",
     author="goldfishh",
     desire_priority=0,
+    context_types=[ContextType.TEXT],
+    prefixes=["{trigger_prefix}tool"],
 )
 class Tool(Plugin):
     def __init__(self):
@@ -0,0 +1,50 @@
+"""
+语义缓存的微基准测试：不同索引大小下的单次查询耗时，以及改写后的问题能否命中
+用法：python scripts/bench_semantic_cache.py [查询次数]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bridge.semantic_cache import SemanticCache, load_numpy  # noqa: E402
+
+TOPICS = ["怎么使用", "如何开通会员", "价格是多少", "支持哪些模型", "怎么清除记忆", "能画图吗", "如何联系客服", "退款流程", "怎么绑定手机号", "在哪里下载"]
+# (缓存的问题, 换一种说法)，查询前与写入缓存时一样先经过normalize_query
+PARAPHRASES = [("怎么使用这个机器人", "这个机器人怎么使用"), ("支持哪些模型", "都支持哪些模型"), ("怎么用", "怎么用啊"), ("如何开通会员", "会员怎么开通")]
+
+
+def random_question(rng):
+    return "{}{}{}".format(rng.choice(TOPICS), rng.choice(TOPICS), rng.randint(0, 10 ** 6))
+
+
+def main():
+    if load_numpy() is None:
+        print("numpy is not installed")
+        return
+    lookups = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = random.Random(0)
+    for size in [1000, 10000, 50000]:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = SemanticCache(os.path.join(tmp, "index.npz"), max_size=size, save_every=10 ** 9)
+            for i in range(size):
+                cache.add("app", random_question(rng), "回复{}".format(i))
+            for question, _ in PARAPHRASES:
+                cache.add("app", question, "答案:" + question)
+            start = time.perf_counter()
+            for _ in range(lookups):
+                cache.lookup("app", rng.choice(PARAPHRASES)[1])
+            cost = (time.perf_counter() - start) / lookups
+            start = time.perf_counter()
+            cache.save()
+            save_cost = time.perf_counter() - start
+            hits = sum(1 for question, paraphrase in PARAPHRASES if cache.lookup("app", paraphrase))
+            print("size={:>6}  lookup={:.3f}ms  save={:.1f}ms  paraphrase_hits={}/{}".format(size, cost * 1000, save_cost * 1000, hits, len(PARAPHRASES)))
+
+
+if __name__ == "__main__":
+    main()
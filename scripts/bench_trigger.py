@@ -0,0 +1,63 @@
+"""
+消息触发规则匹配的微基准测试，对比逐条遍历配置列表与预编译的TriggerIndex
+用法：python scripts/bench_trigger.py [重复次数]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from channel.chat_channel import check_contain, check_prefix  # noqa: E402
+from channel.trigger_index import TriggerIndex, mention_pattern  # noqa: E402
+
+CONFIG = {
+    "group_name_white_list": ["群{}".format(i) for i in range(200)],
+    "group_name_keyword_white_list": ["关键词{}".format(i) for i in range(50)],
+    "group_chat_in_one_session": ["群{}".format(i) for i in range(0, 200, 2)],
+    "nick_name_black_list": ["黑名单{}".format(i) for i in range(200)],
+    "group_chat_prefix": ["@bot", "bot", "机器人", "小助手"],
+    "group_chat_keyword": ["天气", "翻译", "总结", "画图", "搜索"] * 4,
+    "single_chat_prefix": ["bot", "@bot"],
+    "image_create_prefix": ["画", "看", "找"],
+}
+AT_LIST = ["用户{}".format(i) for i in range(5)]
+MESSAGES = [("群{}".format(i % 300), "黑名单{}".format(i % 400), "@bot 用户{}说了第{}句话，帮我总结一下今天的天气".format(i % 7, i)) for i in range(1000)]
+
+
+def route_with_lists(config):
+    for group_name, nick_name, content in MESSAGES:
+        group_name_white_list = config.get("group_name_white_list", [])
+        any([group_name in group_name_white_list, "ALL_GROUP" in group_name_white_list, check_contain(group_name, config.get("group_name_keyword_white_list", []))])
+        group_chat_in_one_session = config.get("group_chat_in_one_session", [])
+        any([group_name in group_chat_in_one_session, "ALL_GROUP" in group_chat_in_one_session])
+        nick_name in config.get("nick_name_black_list", [])
+        check_prefix(content, config.get("group_chat_prefix"))
+        check_contain(content, config.get("group_chat_keyword"))
+        subtract_res = re.sub(f"@{re.escape('bot')}(\u2005|\u0020)", r"", content)
+        for at in AT_LIST:
+            subtract_res = re.sub(f"@{re.escape(at)}(\u2005|\u0020)", r"", subtract_res)
+        check_prefix(subtract_res, config.get("image_create_prefix", [""]))
+
+
+def route_with_index(index):
+    for group_name, nick_name, content in MESSAGES:
+        index.is_group_allowed(group_name)
+        group_name in index.group_chat_in_one_session
+        nick_name in index.nick_name_black_list
+        index.group_chat_prefix.match(content)
+        index.group_chat_keyword.contains(content)
+        subtract_res = mention_pattern("bot").sub(r"", content)
+        for at in AT_LIST:
+            subtract_res = mention_pattern(at).sub(r"", subtract_res)
+        index.image_create_prefix.match(subtract_res)
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    index = TriggerIndex(CONFIG)
+    for name, func in [("list scan", lambda: route_with_lists(CONFIG)), ("trigger index", lambda: route_with_index(index))]:
+        cost = min(timeit.repeat(func, number=1, repeat=rounds))
+        print("{:<14} {:>8.2f} us/msg".format(name, cost * 1e6 / len(MESSAGES)))
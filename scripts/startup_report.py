@@ -0,0 +1,125 @@
+"""
+启动耗时和内存报告：用python -X importtime在子进程中导入app并加载插件，统计导入耗时最多的模块和包、启动后的内存占用
+用于跟踪每个版本的冷启动时间和RSS，不会创建channel或连接任何服务；加载插件时与正常启动一样会读写plugins/plugins.json
+用法：python scripts/startup_report.py [--no-plugins] [--top 20] [--json report.json] [--compare 上个版本的report.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+REPORT_MARK = "STARTUP_REPORT:"
+
+# 在子进程中执行，模拟app.py启动时的导入和插件加载
+CHILD_CODE = r"""
+import json, os, sys, time
+sys.path.insert(0, os.getcwd())
+start = time.perf_counter()
+import app
+from config import load_config
+load_config()
+imported = time.perf_counter()
+if {load_plugins}:
+    from plugins import PluginManager
+    PluginManager().load_plugins()
+loaded = time.perf_counter()
+try:
+    import resource
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    max_rss = max_rss / 1024 / 1024 if sys.platform == "darwin" else max_rss / 1024  # macOS单位为字节，Linux为KB
+except ImportError:
+    max_rss = None
+print("{mark}" + json.dumps({{
+    "import_app_ms": (imported - start) * 1000,
+    "load_plugins_ms": (loaded - imported) * 1000,
+    "max_rss_mb": max_rss,
+    "modules": len(sys.modules),
+}}))
+"""
+
+
+def parse_importtime(stderr: str) -> list:
+    """
+    解析-X importtime的输出
+    :return: [(模块名, 自身耗时us, 累计耗时us)]
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        try:
+            modules.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+        except (IndexError, ValueError):
+            continue  # 表头
+    return modules
+
+
+def run_child(load_plugins: bool) -> dict:
+    code = CHILD_CODE.format(load_plugins=load_plugins, mark=REPORT_MARK)
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    result = None
+    for line in proc.stdout.splitlines():
+        if line.startswith(REPORT_MARK):
+            result = json.loads(line[len(REPORT_MARK) :])
+    if proc.returncode != 0 or result is None:
+        sys.stderr.write(proc.stderr[-3000:])
+        raise SystemExit("startup failed, exit code {}".format(proc.returncode))
+    modules = parse_importtime(proc.stderr)
+    packages = {}
+    for name, self_us, _ in modules:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    result.update(
+        {
+            "python": sys.version.split()[0],
+            "wall_ms": wall_ms,
+            "import_total_ms": sum(self_us for _, self_us, _ in modules) / 1000,
+            "top_modules": [{"name": name, "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000} for name, self_us, cumulative_us in sorted(modules, key=lambda m: -m[1])],
+            "top_packages": [{"name": name, "self_ms": self_us / 1000} for name, self_us in sorted(packages.items(), key=lambda p: -p[1])],
+        }
+    )
+    return result
+
+
+def print_report(report: dict, top: int, baseline: dict = None):
+    def diff(key):
+        if not baseline or baseline.get(key) is None or report.get(key) is None:
+            return ""
+        return "  ({:+.1f})".format(report[key] - baseline[key])
+
+    print("python {}, {} modules".format(report["python"], report["modules"]))
+    for key, title in [("wall_ms", "wall time (ms)"), ("import_app_ms", "import app (ms)"), ("load_plugins_ms", "load plugins (ms)"), ("import_total_ms", "import total (ms)"), ("max_rss_mb", "max RSS (MB)")]:
+        if report.get(key) is not None:
+            print("{:<20} {:>9.1f}{}".format(title, report[key], diff(key)))
+    print("\ntop packages by import time (self, ms):")
+    for item in report["top_packages"][:top]:
+        print("  {:<40} {:>9.1f}".format(item["name"], item["self_ms"]))
+    print("\ntop modules by import time (self / cumulative, ms):")
+    for item in report["top_modules"][:top]:
+        print("  {:<40} {:>9.1f} {:>9.1f}".format(item["name"], item["self_ms"], item["cumulative_ms"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="startup import time and memory report")
+    parser.add_argument("--no-plugins", action="store_true", help="只导入app，不加载插件")
+    parser.add_argument("--top", type=int, default=20, help="显示耗时最多的模块数")
+    parser.add_argument("--json", help="把报告保存为json文件")
+    parser.add_argument("--compare", help="与之前保存的json报告对比")
+    args = parser.parse_args()
+
+    report = run_child(not args.no_plugins)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, args.top, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,73 @@
+import importlib.util
+import unittest
+from unittest import mock
+
+from bot.chatgpt import chat_gpt_session
+from bot.chatgpt.chat_gpt_session import ChatGPTSession, num_tokens_from_messages
+
+
+class TestTokenCache(unittest.TestCase):
+    model = "wenxin"  # 按字符计数，不依赖tiktoken
+
+    def setUp(self):
+        self.session = ChatGPTSession("s1", system_prompt="你是一个助手", model=self.model)
+
+    def assert_tokens(self):
+        self.assertEqual(self.session.calc_tokens(), num_tokens_from_messages(self.session.messages, self.model))
+
+    def test_add_and_reset(self):
+        """测试添加消息和重置后维护的计数与直接计算一致"""
+        for i in range(5):
+            self.session.add_query("问题{}：今天天气怎么样".format(i))
+            self.assert_tokens()
+            self.session.add_reply("回答{}：晴天".format(i))
+            self.assert_tokens()
+        self.session.reset()
+        self.assert_tokens()
+        self.assertEqual(len(self.session._token_counts), 1)
+
+    def test_count_once(self):
+        """测试每条消息只在加入会话时计算一次，计算总数时不再遍历历史消息"""
+        with mock.patch.object(chat_gpt_session, "num_tokens_from_message", wraps=chat_gpt_session.num_tokens_from_message) as counter:
+            for i in range(5):
+                self.session.add_query("问题{}".format(i))
+                self.session.add_reply("回答{}".format(i))
+                self.session.discard_exceeding(10000)
+            self.assertEqual(counter.call_count, 10)
+
+    def test_rebuilt_messages(self):
+        """测试消息被重建（如从存储加载）后计数不变，相同内容的消息各自计数"""
+        self.session.add_query("你好")
+        self.session.add_reply("你好")
+        self.session.add_query("你好")
+        self.session.calc_tokens()
+        self.session.load_dict({"messages": [dict(message) for message in self.session.messages]})
+        self.assert_tokens()
+
+    def test_discard_exceeding(self):
+        """测试按缓存的计数丢弃历史消息，剩余计数与直接计算一致"""
+        for i in range(10):
+            self.session.add_query("问题{}：今天天气怎么样".format(i))
+            self.session.add_reply("回答{}：晴天".format(i))
+        self.session.calc_tokens()
+        max_tokens = num_tokens_from_messages(self.session.messages, self.model) // 3
+        cur_tokens = self.session.discard_exceeding(max_tokens)
+        self.assertLessEqual(cur_tokens, max_tokens)
+        self.assertEqual(cur_tokens, num_tokens_from_messages(self.session.messages, self.model))
+        self.assertEqual(self.session.messages[0]["role"], "system")
+        self.assert_tokens()
+
+    def test_messages_changed_directly(self):
+        """测试直接修改messages后重新计算"""
+        self.session.add_query("你好")
+        self.session.messages.append({"role": "assistant", "content": "你好，有什么可以帮你"})
+        self.assert_tokens()
+
+
+@unittest.skipIf(importlib.util.find_spec("tiktoken") is None, "tiktoken is not installed")
+class TestTiktokenCache(TestTokenCache):
+    model = "gpt-4"
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+import config
+from config import conf, config_snapshot, on_config_change
+
+
+class TestConfigSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.backup = dict(config.config)
+
+    def tearDown(self):
+        config.config.clear()
+        config.config.update(self.backup)
+        config.config["debug"] = self.backup.get("debug", False)  # 递增版本号
+
+    def test_snapshot_readonly(self):
+        """测试快照只读，列表转换为tuple"""
+        conf()["group_chat_prefix"] = ["@bot"]
+        snapshot = config_snapshot()
+        self.assertEqual(snapshot.group_chat_prefix, ("@bot",))
+        self.assertEqual(snapshot["group_chat_prefix"], ("@bot",))
+        self.assertIs(snapshot, config_snapshot())
+        with self.assertRaises(AttributeError):
+            snapshot.model = "gpt-4"
+        with self.assertRaises(AttributeError):
+            snapshot.not_a_setting
+        conf().pop("voice_reply_voice", None)
+        self.assertIsNone(config_snapshot().voice_reply_voice)
+
+    def test_version_and_subscribe(self):
+        """测试配置修改后生成新快照并通知订阅者"""
+        old = config_snapshot()
+        received = []
+        unsubscribe = on_config_change(received.append)
+        try:
+            conf()["group_at_off"] = True
+        finally:
+            unsubscribe()
+        new = config_snapshot()
+        self.assertGreater(new.version, old.version)
+        self.assertTrue(new.group_at_off)
+        self.assertEqual(received, [new])
+        conf()["group_at_off"] = False
+        self.assertEqual(len(received), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from unittest import mock
+
+from common.expired_dict import ExpiredDict
+
+
+class TestExpiredDict(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("common.expired_dict.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_expire_without_access(self):
+        """测试未被再次访问的key也会过期清理"""
+        evicted = []
+        d = ExpiredDict(10, on_evict=lambda k, v: evicted.append(k))
+        d["a"] = 1
+        d["b"] = 2
+        self.now += 11
+        d["c"] = 3
+        self.assertEqual(evicted, ["a", "b"])
+        self.assertEqual(len(d), 1)
+        self.assertEqual(d.get_stats()["expired"], 2)
+
+    def test_get_refresh_expiry(self):
+        """测试读取会刷新过期时间，keys()和in不会刷新"""
+        d = ExpiredDict(10)
+        d["a"] = 1
+        d["b"] = 2
+        self.now += 6
+        self.assertEqual(d["a"], 1)
+        self.assertEqual(d.keys(), ["b", "a"])
+        self.assertIn("b", d)
+        self.now += 6
+        self.assertNotIn("b", d)
+        self.assertEqual(d.get("a"), 1)
+        self.assertIsNone(d.get("b"))
+
+    def test_max_size(self):
+        """测试超出容量时淘汰最久未使用的key"""
+        evicted = []
+        d = ExpiredDict(10, max_size=2, on_evict=lambda k, v: evicted.append((k, v)))
+        d["a"] = 1
+        d["b"] = 2
+        d["a"]
+        d["c"] = 3
+        self.assertEqual(evicted, [("b", 2)])
+        self.assertEqual(sorted(d.keys()), ["a", "c"])
+        stats = d.get_stats()
+        self.assertEqual((stats["hits"], stats["evicted"], stats["size"]), (1, 1, 2))
+
+    def test_dict_api(self):
+        """测试常用的字典接口"""
+        d = ExpiredDict(10)
+        d["a"] = 1
+        self.assertEqual(d.setdefault("a", 2), 1)
+        self.assertEqual(d.pop("a"), 1)
+        self.assertEqual(d.pop("a", None), None)
+        with self.assertRaises(KeyError):
+            d["a"]
+        d.update({"x": 1, "y": 2})
+        del d["x"]
+        self.assertEqual(d.items(), [("y", 2)])
+        d.clear()
+        self.assertEqual(len(d), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import json
+import unittest
+from unittest import mock
+
+from bridge.context import ContextType
+from channel.feishu.feishu_channel import FeiShuChanel, FeishuController
+
+
+class TestFeishuController(unittest.TestCase):
+    def _post(self, event):
+        channel = FeiShuChanel()
+        produced = []
+        request = {"header": {"token": "token", "event_type": FeishuController.MESSAGE_RECEIVE_TYPE, "event_id": "e1"}, "event": event}
+        with mock.patch.object(channel, "feishu_token", "token"), mock.patch.object(channel, "fetch_access_token", lambda: "access"), mock.patch.object(
+            channel, "produce", produced.append
+        ), mock.patch("channel.feishu.feishu_channel.web.data", lambda: json.dumps(request).encode("utf-8")):
+            result = FeishuController().POST()
+        return result, produced
+
+    def test_receive_text(self):
+        """测试私聊文本事件构造context并放入消息队列"""
+        event = {
+            "app_id": "app",
+            "sender": {"sender_id": {"open_id": "ou_user"}},
+            "message": {"message_id": "om_test_receive_text", "chat_type": "p2p", "message_type": "text", "content": json.dumps({"text": " hello "})},
+        }
+        result, produced = self._post(event)
+        self.assertEqual(result, FeishuController.SUCCESS_MSG)
+        self.assertEqual(len(produced), 1)
+        context = produced[0]
+        self.assertEqual(context.type, ContextType.TEXT)
+        self.assertEqual(context.content, "hello")
+        self.assertEqual(context["session_id"], "ou_user")
+        self.assertEqual(context["receive_id_type"], "open_id")
+
+        # 重复的消息不再处理
+        result, produced = self._post(event)
+        self.assertEqual(result, FeishuController.SUCCESS_MSG)
+        self.assertEqual(produced, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
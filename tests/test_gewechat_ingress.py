@@ -0,0 +1,82 @@
+import json
+import queue
+import threading
+import time
+import unittest
+from unittest import mock
+
+from channel.gewechat.gewechat_channel import GeWeChatChannel, Query
+from common.shared_state import LocalSharedState
+
+
+def callback(msg_id):
+    return {"TypeName": "AddMsg", "Data": {"NewMsgId": msg_id}}
+
+
+class TestGewechatIngress(unittest.TestCase):
+    def setUp(self):
+        self.channel = GeWeChatChannel()
+        self.channel.ingress_queue = queue.Queue(maxsize=1)
+        self.channel.shared_state = LocalSharedState()
+        self.channel.ingress_stats = dict.fromkeys(self.channel.ingress_stats, 0)
+
+    def test_dedupe(self):
+        """测试相同NewMsgId的回调只入队一次"""
+        self.assertTrue(self.channel.enqueue_callback(callback(1)))
+        self.assertTrue(self.channel.enqueue_callback(callback(1)))
+        self.assertEqual(self.channel.ingress_queue.qsize(), 1)
+        self.assertEqual(self.channel.get_ingress_stats()["duplicated"], 1)
+
+    def test_drop_and_retry(self):
+        """测试队列满时丢弃回调且不记录去重，gewechat重发后可以入队"""
+        self.assertTrue(self.channel.enqueue_callback(callback(1)))
+        self.assertFalse(self.channel.enqueue_callback(callback(2)))
+        self.assertEqual(self.channel.get_ingress_stats()["dropped"], 1)
+        self.channel.ingress_queue.get_nowait()
+        self.assertTrue(self.channel.enqueue_callback(callback(2)))
+        self.assertEqual(self.channel.ingress_queue.get_nowait(), callback(2))
+        self.assertEqual(self.channel.get_ingress_stats()["duplicated"], 0)
+
+    def test_worker(self):
+        """测试ingress线程处理队列中的回调，处理出错时继续处理后续回调"""
+        handled = []
+        done = threading.Event()
+
+        def handle(data):
+            handled.append(data)
+            if data["Data"]["NewMsgId"] == 1:
+                raise ValueError("bad callback")
+            done.set()
+
+        self.channel._handle_callback = handle
+        self.channel.ingress_queue = queue.Queue()
+        self.assertTrue(self.channel.enqueue_callback(callback(1)))
+        self.assertTrue(self.channel.enqueue_callback(callback(2)))
+        worker = threading.Thread(target=self.channel._ingress_worker, daemon=True)
+        worker.start()
+        self.assertTrue(done.wait(5))
+        self.assertEqual([data["Data"]["NewMsgId"] for data in handled], [1, 2])
+        for _ in range(100):
+            if self.channel.get_ingress_stats()["processed"] == 1:
+                break
+            time.sleep(0.01)
+        stats = self.channel.get_ingress_stats()
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(stats["processed"], 1)
+        del self.channel._handle_callback
+
+    def test_contact_callback(self):
+        """测试联系人变更回调使缓存失效，内容不完整时忽略且不报错"""
+        cache = mock.Mock()
+        for data in [None, "wxid_a", {"string": None}, {"string": "wxid_a"}]:
+            payload = {"TypeName": "ModContacts", "Data": data if data is None else {"UserName": data}}
+            with mock.patch("channel.gewechat.gewechat_channel.web.data", lambda: json.dumps(payload)), mock.patch(
+                "channel.gewechat.gewechat_channel.get_contact_cache", lambda: cache
+            ):
+                self.assertEqual(Query().POST(), "success")
+        cache.invalidate.assert_called_once_with("wxid_a")
+        self.assertEqual(self.channel.ingress_queue.qsize(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from common.http_client import PooledHTTPAdapter, PooledSession
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPoolBlock(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _session(self, pool_block, pool_timeout=0.1):
+        session = PooledSession((5, 5))
+        adapter = PooledHTTPAdapter(pool_maxsize=1, pool_block=pool_block, pool_timeout=pool_timeout)
+        session.mount("http://", adapter)
+        self.addCleanup(session.close)
+        return session
+
+    def test_block(self):
+        """测试连接数达到上限时等待空闲连接，超时后抛出ConnectionError"""
+        session = self._session(True)
+        held = session.get(self.url, stream=True)  # 不读取响应，连接不归还
+        start = time.monotonic()
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            session.get(self.url)
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        held.close()
+        self.assertEqual(session.get(self.url).text, "ok")
+        stats = session.get_adapter(self.url).get_pool_stats()["127.0.0.1:{}".format(self.server.server_address[1])]
+        self.assertEqual(stats["connections_created"], 1)
+        self.assertEqual(stats["errors"], 1)
+
+    def test_release_wakes_waiter(self):
+        """测试等待中的请求在连接归还后继续执行"""
+        session = self._session(True, pool_timeout=5)
+        held = session.get(self.url, stream=True)
+        threading.Timer(0.05, held.close).start()
+        self.assertEqual(session.get(self.url).text, "ok")
+
+    def test_no_block(self):
+        """测试pool_block为False时临时新建连接"""
+        session = self._session(False)
+        held = session.get(self.url, stream=True)
+        self.assertEqual(session.get(self.url).text, "ok")
+        held.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+
+import config
+from common import metrics
+from common import web_server
+from common.web_server import LatencyMiddleware, MetricsMiddleware
+from config import conf
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.backup = dict(config.config)
+        metrics.reset()
+
+    def tearDown(self):
+        config.config.clear()
+        config.config.update(self.backup)
+        metrics.reset()
+
+    def test_disabled(self):
+        """测试未开启时不记录耗时"""
+        conf()["metrics"] = False
+        with metrics.span("bot_reply", bot="dify"):
+            pass
+        metrics.observe("deliver", 0.1)
+        self.assertEqual(metrics.stage_duration.series, {})
+
+    def test_histogram(self):
+        """测试耗时按label分组，桶计数为累计值"""
+        conf()["metrics"] = True
+        metrics.observe("bot_reply", 0.02, channel="gewechat", bot="dify", context_type="TEXT")
+        metrics.observe("bot_reply", 3, channel="gewechat", bot="dify", context_type="TEXT")
+        with metrics.span("plugin_on_handle_context", plugin="Godcmd"):
+            pass
+        text = metrics.render()
+        labels = 'stage="bot_reply",channel="gewechat",bot="dify",plugin="",context_type="TEXT"'
+        self.assertIn('dow_stage_duration_seconds_bucket{%s,le="0.01"} 0' % labels, text)
+        self.assertIn('dow_stage_duration_seconds_bucket{%s,le="0.025"} 1' % labels, text)
+        self.assertIn('dow_stage_duration_seconds_bucket{%s,le="5.0"} 2' % labels, text)
+        self.assertIn('dow_stage_duration_seconds_bucket{%s,le="+Inf"} 2' % labels, text)
+        self.assertIn("dow_stage_duration_seconds_count{%s} 2" % labels, text)
+        self.assertIn('plugin="Godcmd"', text)
+
+    def test_collector(self):
+        """测试采集函数输出的状态指标，同名指标合并，出错的采集函数被跳过"""
+
+        def collector():
+            return [("queue_depth", "gauge", "Queued messages", [({"channel": 'we"chat'}, 3)])]
+
+        def broken():
+            raise RuntimeError("broken")
+
+        metrics.register_collector(collector)
+        metrics.register_collector(broken)
+        try:
+            text = metrics.render()
+        finally:
+            metrics.unregister_collector(collector)
+            metrics.unregister_collector(broken)
+        self.assertEqual(text.count("# TYPE dow_queue_depth gauge"), 1)
+        self.assertIn('dow_queue_depth{channel="we\\"chat"} 3', text)
+
+    def test_endpoint(self):
+        """测试web服务器的指标路径和token校验，其他路径交给应用处理"""
+        conf()["metrics"] = True
+        conf()["metrics_token"] = "secret"
+        app = MetricsMiddleware(lambda environ, start_response: [b"app"])
+        statuses = []
+
+        def start_response(status, headers, exc_info=None):
+            statuses.append(status)
+
+        self.assertEqual(app({"PATH_INFO": "/wx"}, start_response), [b"app"])
+        app({"PATH_INFO": "/metrics"}, start_response)
+        self.assertEqual(statuses[-1], "401 Unauthorized")
+        body = app({"PATH_INFO": "/metrics", "HTTP_AUTHORIZATION": "Bearer secret"}, start_response)
+        self.assertEqual(statuses[-1], "200 OK")
+        self.assertIn(b"# TYPE dow_stage_duration_seconds histogram", body[0])
+
+    def test_request_stats_by_route(self):
+        """测试请求统计按路由分组，不匹配的路径合并为other，未开启metrics时不统计"""
+
+        def app(environ, start_response):
+            start_response("200 OK", [])
+            return [b"ok"]
+
+        middleware = LatencyMiddleware(app, "test_web", ["/sse/(.+)", "/message"])
+        conf()["metrics"] = False
+        middleware({"PATH_INFO": "/message"}, lambda *args: None)
+        self.assertNotIn("test_web:/message", web_server.get_server_stats())
+        conf()["metrics"] = True
+        for path in ["/sse/user1", "/sse/user2", "/message", "/wp-login.php", "/.env"]:
+            middleware({"PATH_INFO": path}, lambda *args: None)
+        stats = {key: item["requests"] for key, item in web_server.get_server_stats().items() if key.startswith("test_web:")}
+        self.assertEqual(stats, {"test_web:/sse/(.+)": 2, "test_web:/message": 1, "test_web:other": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import threading
+import time
+import unittest
+
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from channel.outbound_dispatcher import OutboundDispatcher
+
+
+def make_context(receiver):
+    return Context(ContextType.TEXT, "", {"receiver": receiver})
+
+
+class Recorder(object):
+    def __init__(self, fail_times=0, delay=0):
+        self.sent = []
+        self.fail_times = fail_times
+        self.delay = delay
+        self.done = threading.Event()
+        self.expected = 0
+        self.lock = threading.Lock()
+
+    def deliver(self, reply, context):
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                raise IOError("network error")
+            self.sent.append((context["receiver"], reply.content))
+            if len(self.sent) >= self.expected:
+                self.done.set()
+
+
+class TestOutboundDispatcher(unittest.TestCase):
+    def test_receiver_order(self):
+        """测试同一接收者按提交顺序发送，拆分后的消息不会被合并"""
+        recorder = Recorder(delay=0.01)
+        recorder.expected = 6
+        dispatcher = OutboundDispatcher("test", recorder.deliver, split=lambda r: [Reply(ReplyType.TEXT, s) for s in r.content.split("|")])
+        a, b = make_context("a"), make_context("b")
+        dispatcher.submit(Reply(ReplyType.TEXT, "1|2|3"), a)
+        dispatcher.submit(Reply(ReplyType.TEXT, "x|y"), b)
+        dispatcher.submit(Reply(ReplyType.TEXT, "4"), a)
+        self.assertTrue(recorder.done.wait(5))
+        self.assertEqual([c for r, c in recorder.sent if r == "a"], ["1", "2", "3", "4"])
+        self.assertEqual([c for r, c in recorder.sent if r == "b"], ["x", "y"])
+
+    def test_retry_keeps_order(self):
+        """测试发送失败延后重试，后续消息等待重试完成"""
+        recorder = Recorder(fail_times=1)
+        recorder.expected = 2
+        dispatcher = OutboundDispatcher("test", recorder.deliver, retry_delay=0.05)
+        context = make_context("a")
+        dispatcher.submit(Reply(ReplyType.TEXT, "1"), context)
+        dispatcher.submit(Reply(ReplyType.TEXT, "2"), context)
+        self.assertTrue(recorder.done.wait(5))
+        self.assertEqual([c for _, c in recorder.sent], ["1", "2"])
+        self.assertEqual(dispatcher.get_stats()["retried"], 1)
+
+    def test_coalesce(self):
+        """测试积压的文本消息合并发送"""
+        recorder = Recorder(delay=0.1)
+        dispatcher = OutboundDispatcher("test", recorder.deliver, coalesce_text=True)
+        context = make_context("a")
+        for text in ["1", "2", "3"]:
+            dispatcher.submit(Reply(ReplyType.TEXT, text), context)
+        recorder.expected = 2
+        self.assertTrue(recorder.done.wait(5))
+        self.assertEqual([c for _, c in recorder.sent], ["1", "2\n3"])
+        self.assertEqual(dispatcher.get_stats()["coalesced"], 1)
+
+    def test_rate_limit(self):
+        """测试限速时延后发送"""
+        recorder = Recorder()
+        recorder.expected = 3
+        dispatcher = OutboundDispatcher("test", recorder.deliver, qps=20)
+        start = time.monotonic()
+        for receiver in ["a", "b", "c"]:
+            dispatcher.submit(Reply(ReplyType.TEXT, receiver), make_context(receiver))
+        self.assertTrue(recorder.done.wait(5))
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+
+import config
+from bridge.context import Context, ContextType
+from bridge.reply import Reply
+from config import conf
+from plugins.event import Event, EventAction, EventContext
+from plugins.plugin_manager import PluginManager
+
+
+def make_plugin(name, calls, context_types=None, prefixes=None, handler=None):
+    def on_handle_context(e_context):
+        calls.append(name)
+        if handler:
+            handler(e_context)
+
+    plugincls = type(name, (object,), {"name": name, "priority": 0, "enabled": True, "context_types": context_types, "prefixes": prefixes})
+    instance = plugincls()
+    instance.handlers = {Event.ON_HANDLE_CONTEXT: on_handle_context, Event.ON_DECORATE_REPLY: on_handle_context}
+    return plugincls, instance
+
+
+class TestPluginDispatch(unittest.TestCase):
+    def setUp(self):
+        self.backup = dict(config.config)
+        conf()["plugin_trigger_prefix"] = "$"
+        self.manager = PluginManager()
+        self.listening = dict(self.manager.listening_plugins)
+        self.names = []
+        self.calls = []
+
+    def tearDown(self):
+        config.config.clear()
+        config.config.update(self.backup)
+        self.manager.listening_plugins.clear()
+        self.manager.listening_plugins.update(self.listening)
+        for name in self.names:
+            if name in self.manager.plugins:
+                del self.manager.plugins[name]  # SortedDict需要用del同步删除排序用的堆
+            self.manager.instances.pop(name, None)
+        self.manager.refresh_dispatch()
+
+    def use_plugins(self, *plugins):
+        """按优先级从高到低注册插件"""
+        for name, kwargs in plugins:
+            plugincls, instance = make_plugin(name, self.calls, **kwargs)
+            key = name.upper()
+            self.manager.plugins[key] = plugincls
+            self.manager.instances[key] = instance
+            self.names.append(key)
+        self.manager.listening_plugins[Event.ON_HANDLE_CONTEXT] = list(self.names)
+        self.manager.listening_plugins[Event.ON_DECORATE_REPLY] = list(self.names)
+        self.manager.refresh_dispatch()
+
+    def emit(self, context_type, content, event=Event.ON_HANDLE_CONTEXT):
+        self.calls.clear()
+        context = Context(context_type, content, {})
+        self.manager.emit_event(EventContext(event, {"channel": None, "context": context, "reply": Reply()}))
+        return list(self.calls)
+
+    def test_dispatch_by_type_and_prefix(self):
+        """测试按声明的消息类型和触发前缀分发"""
+        self.use_plugins(
+            ("Cmd", {"context_types": [ContextType.TEXT], "prefixes": ["#"]}),
+            ("Tool", {"context_types": [ContextType.TEXT], "prefixes": ["{trigger_prefix}tool"]}),
+            ("Image", {"context_types": [ContextType.IMAGE]}),
+            ("All", {}),
+        )
+        self.assertEqual(self.emit(ContextType.TEXT, "你好"), ["All"])
+        self.assertEqual(self.emit(ContextType.TEXT, "#help"), ["Cmd", "All"])
+        self.assertEqual(self.emit(ContextType.TEXT, "$tool 查天气"), ["Tool", "All"])
+        self.assertEqual(self.emit(ContextType.TEXT, "$role"), ["All"])
+        self.assertEqual(self.emit(ContextType.IMAGE, "/tmp/a.png"), ["Image", "All"])
+        # 其他事件不按声明过滤
+        self.assertEqual(self.emit(ContextType.TEXT, "你好", Event.ON_DECORATE_REPLY), ["Cmd", "Tool", "Image", "All"])
+
+    def test_trigger_prefix_changed(self):
+        """测试修改plugin_trigger_prefix后重新生成索引"""
+        self.use_plugins(("Tool", {"prefixes": ["{trigger_prefix}tool"]}))
+        self.assertEqual(self.emit(ContextType.TEXT, "$tool"), ["Tool"])
+        conf()["plugin_trigger_prefix"] = "/"
+        self.assertEqual(self.emit(ContextType.TEXT, "$tool"), [])
+        self.assertEqual(self.emit(ContextType.TEXT, "/tool"), ["Tool"])
+
+    def test_context_changed_by_plugin(self):
+        """测试插件修改消息类型后，后续插件按新的类型分发"""
+
+        def to_text(e_context):
+            e_context["context"].type = ContextType.TEXT
+            e_context["context"].content = "$tool 拍一拍"
+
+        self.use_plugins(
+            ("Patpat", {"context_types": [ContextType.PATPAT], "handler": to_text}),
+            ("Image", {"context_types": [ContextType.IMAGE]}),
+            ("Tool", {"context_types": [ContextType.TEXT], "prefixes": ["$tool"]}),
+        )
+        self.assertEqual(self.emit(ContextType.PATPAT, ""), ["Patpat", "Tool"])
+
+    def test_break(self):
+        """测试插件结束事件后不再调用后续插件"""
+
+        def stop(e_context):
+            e_context.action = EventAction.BREAK_PASS
+
+        self.use_plugins(("Cmd", {"prefixes": ["#"], "handler": stop}), ("All", {}))
+        self.assertEqual(self.emit(ContextType.TEXT, "#stop"), ["Cmd"])
+        self.assertEqual(self.emit(ContextType.TEXT, "hi"), ["All"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,202 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import config
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from common.circuit_breaker import CLOSED, OPEN, CircuitBreaker
+from common.worker_pool import PriorityThreadPool
+from config import conf
+from plugins.event import Event, EventAction, EventContext
+from plugins.plugin_manager import PluginManager
+
+
+class FakePlugin(object):
+    name = "Fake"
+    priority = 0
+    enabled = True
+
+    def __init__(self, handler):
+        self.handlers = {Event.ON_HANDLE_CONTEXT: handler}
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_open_and_recover(self):
+        """测试连续失败后熔断，冷却后试探成功恢复"""
+        breaker = CircuitBreaker(threshold=2, cooldown=0.05)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.record_failure())
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())  # 半开状态只放行一次
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_half_open_failure(self):
+        """测试试探失败后继续熔断"""
+        breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.record_failure())
+        self.assertFalse(breaker.allow())
+
+    def test_release_probe(self):
+        """测试试探调用没有执行时恢复熔断，冷却后可以再次试探"""
+        breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.release_probe()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+
+
+class TestPluginGuard(unittest.TestCase):
+    def setUp(self):
+        self.backup = dict(config.config)
+        conf()["plugin_breaker_threshold"] = 2
+        conf()["plugin_breaker_cooldown"] = 60
+        self.manager = PluginManager()
+        self.listening = self.manager.listening_plugins.get(Event.ON_HANDLE_CONTEXT)
+        self.manager.listening_plugins[Event.ON_HANDLE_CONTEXT] = ["FAKE"]
+        self.manager.refresh_dispatch()
+
+    def tearDown(self):
+        config.config.clear()
+        config.config.update(self.backup)
+        if self.listening is None:
+            self.manager.listening_plugins.pop(Event.ON_HANDLE_CONTEXT, None)
+        else:
+            self.manager.listening_plugins[Event.ON_HANDLE_CONTEXT] = self.listening
+        if "FAKE" in self.manager.plugins:
+            del self.manager.plugins["FAKE"]  # SortedDict需要用del同步删除排序用的堆
+        for store in (self.manager.instances, self.manager.breakers, self.manager.stats):
+            store.pop("FAKE", None)
+        self.manager.refresh_dispatch()
+
+    def use_handler(self, handler):
+        self.manager.plugins["FAKE"] = FakePlugin
+        self.manager.instances["FAKE"] = FakePlugin(handler)
+
+    def emit(self, context=None):
+        context = context or Context(ContextType.TEXT, "hello", {})
+        return self.manager.emit_event(EventContext(Event.ON_HANDLE_CONTEXT, {"channel": None, "context": context, "reply": Reply()}))
+
+    def test_failure_trips_breaker(self):
+        """测试插件出错时继续处理消息，连续出错后熔断跳过"""
+        calls = []
+
+        def broken(e_context):
+            calls.append(1)
+            raise ValueError("boom")
+
+        self.use_handler(broken)
+        for _ in range(3):
+            self.assertEqual(self.emit().action, EventAction.CONTINUE)
+        self.assertEqual(len(calls), 2)
+        stats = self.manager.get_plugin_stats()["Fake"]
+        self.assertEqual((stats["failures"], stats["skipped"], stats["state"]), (2, 1, OPEN))
+
+    def test_timeout(self):
+        """测试超时的插件被跳过，超时后对事件的修改不生效；未超时时修改正常生效"""
+
+        def slow(e_context):
+            time.sleep(0.3)
+            e_context["reply"] = Reply(ReplyType.TEXT, "late")
+            e_context.action = EventAction.BREAK_PASS
+
+        conf()["plugin_timeouts"] = {"Fake": 0.05}
+        self.use_handler(slow)
+        e_context = self.emit()
+        self.assertEqual(e_context.action, EventAction.CONTINUE)
+        time.sleep(0.35)
+        self.assertIsNone(e_context["reply"].content)
+        self.assertEqual(self.manager.get_plugin_stats()["Fake"]["timeouts"], 1)
+
+        conf()["plugin_timeouts"] = {"Fake": 1}
+        e_context = self.emit()
+        self.assertEqual(e_context.action, EventAction.BREAK_PASS)
+        self.assertEqual(e_context["reply"].content, "late")
+
+    def test_timeout_keeps_context(self):
+        """测试超时的插件稍后修改context不影响正在处理的消息；未超时时原地修改正常生效"""
+
+        def rewrite(e_context):
+            time.sleep(e_context["context"].get("delay"))
+            e_context["context"].type = ContextType.IMAGE_CREATE
+            e_context["context"].content = "rewritten"
+            e_context["context"]["rewritten"] = True
+
+        conf()["plugin_timeouts"] = {"Fake": 0.05}
+        self.use_handler(rewrite)
+        context = Context(ContextType.TEXT, "hello", {"delay": 0.2})
+        self.emit(context)
+        time.sleep(0.25)
+        self.assertEqual((context.type, context.content), (ContextType.TEXT, "hello"))
+        self.assertNotIn("rewritten", context)
+
+        context = Context(ContextType.TEXT, "hello", {"delay": 0})
+        e_context = self.emit(context)
+        self.assertIs(e_context["context"], context)
+        self.assertEqual((context.type, context.content, context["rewritten"]), (ContextType.IMAGE_CREATE, "rewritten", True))
+
+    def test_queue_wait_not_counted(self):
+        """测试插件线程池被占满时跳过插件且不计入超时，排队中的调用被取消"""
+        pool = PriorityThreadPool(1, name="test_plugin_pool")
+        gate = threading.Event()
+        pool.submit(gate.wait)
+        calls = []
+        conf()["plugin_timeouts"] = {"Fake": 0.05}
+        self.use_handler(lambda e_context: calls.append(1))
+        try:
+            with mock.patch("plugins.plugin_manager.get_plugin_pool", lambda: pool):
+                self.emit()
+            gate.set()
+            time.sleep(0.05)
+        finally:
+            gate.set()
+            pool.shutdown()
+        self.assertEqual(calls, [])
+        stats = self.manager.get_plugin_stats()["Fake"]
+        self.assertEqual((stats["timeouts"], stats["skipped"], stats["state"]), (0, 1, CLOSED))
+
+    def test_queue_wait_during_probe(self):
+        """测试半开状态下的试探调用因线程池繁忙没有执行时，熔断器恢复熔断而不是一直停在半开状态"""
+        conf()["plugin_breaker_threshold"] = 1
+        conf()["plugin_breaker_cooldown"] = 0
+        conf()["plugin_timeouts"] = {"Fake": 0.05}
+        calls = []
+
+        def handler(e_context):
+            calls.append(1)
+            if len(calls) == 1:
+                raise ValueError("boom")
+
+        self.use_handler(handler)
+        self.emit()
+        self.assertEqual(self.manager.breakers["FAKE"].state, OPEN)
+        pool = PriorityThreadPool(1, name="test_plugin_pool")
+        gate = threading.Event()
+        pool.submit(gate.wait)
+        try:
+            with mock.patch("plugins.plugin_manager.get_plugin_pool", lambda: pool):
+                self.emit()  # 冷却结束后的试探调用在线程池中排队超时
+        finally:
+            gate.set()
+            pool.shutdown()
+        self.assertEqual(self.manager.breakers["FAKE"].state, OPEN)
+        self.emit()
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.manager.breakers["FAKE"].state, CLOSED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+import config
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from bridge.reply_cache import ReplyCache, make_cache_key, normalize_query
+from common import const
+from config import conf
+
+
+class TestReplyCache(unittest.TestCase):
+    def setUp(self):
+        self.backup = dict(config.config)
+        conf()["reply_cache_apps"] = ["dify:workflow", "chatGPT:gpt-4o"]
+        conf()["dify_app_type"] = "chatbot"
+        conf()["model"] = "gpt-4o"
+        conf()["stream_reply"] = False
+        self.cache = ReplyCache(60, 10)
+
+    def tearDown(self):
+        config.config.clear()
+        config.config.update(self.backup)
+
+    def test_normalize(self):
+        """测试问题归一化"""
+        self.assertEqual(normalize_query("  怎么用？ "), "怎么用")
+        self.assertEqual(normalize_query("How  to\nUse!!"), normalize_query("how to use"))
+
+    def test_app_flags(self):
+        """测试只对配置的应用开启缓存"""
+        context = Context(ContextType.TEXT, "怎么用", {})
+        self.assertIsNone(make_cache_key(const.DIFY, "怎么用", context))
+        workflow = Context(ContextType.TEXT, "怎么用", {"dify_app_type": "workflow"})
+        self.assertIsNotNone(make_cache_key(const.DIFY, "怎么用", workflow))
+        self.assertIsNotNone(make_cache_key(const.CHATGPT, "怎么用", context))
+        self.assertIsNone(make_cache_key(const.CHATGPT, "怎么用", Context(ContextType.TEXT, "", {"gpt_model": "gpt-4"})))
+        self.assertIsNone(make_cache_key(const.CHATGPT, "画猫", Context(ContextType.IMAGE_CREATE, "画猫", {})))
+
+    def test_multi_reply_apps(self):
+        """测试会直接发送分段的应用不缓存，即使按api_key开启了缓存"""
+        conf()["dify_api_key"] = "app-key"
+        conf()["reply_cache_apps"] = ["dify:app-key", "chatGPT"]
+        for app_type in ["chatbot", "chatflow", "agent"]:
+            context = Context(ContextType.TEXT, "怎么用", {"dify_app_type": app_type})
+            self.assertIsNone(make_cache_key(const.DIFY, "怎么用", context))
+        workflow = Context(ContextType.TEXT, "怎么用", {"dify_app_type": "workflow"})
+        self.assertIsNotNone(make_cache_key(const.DIFY, "怎么用", workflow))
+        conf()["stream_reply"] = True
+        self.assertIsNone(make_cache_key(const.CHATGPT, "怎么用", Context(ContextType.TEXT, "怎么用", {})))
+        self.assertIsNotNone(make_cache_key(const.DIFY, "怎么用", workflow))
+
+    def test_hit_and_stats(self):
+        """测试命中返回新的Reply，不缓存错误回复"""
+        context = Context(ContextType.TEXT, "", {})
+        key = make_cache_key(const.CHATGPT, "怎么用？", context)
+        self.assertEqual(key, make_cache_key(const.CHATGPT, "怎么用", context))
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, Reply(ReplyType.ERROR, "出错了"))
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, Reply(ReplyType.TEXT, "发送消息即可"))
+        reply = self.cache.get(key)
+        reply.content = "@user " + reply.content
+        self.assertEqual(self.cache.get(key).content, "发送消息即可")
+        stats = self.cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["stores"]), (2, 2, 1))
+        conf()["character_desc"] = "另一个人设"
+        self.assertNotEqual(key, make_cache_key(const.CHATGPT, "怎么用", context))
+
+
+if __name__ == "__main__":
+    unittest.main()
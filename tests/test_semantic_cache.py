@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from bridge.semantic_cache import SemanticCache, load_numpy
+
+
+@unittest.skipIf(load_numpy() is None, "numpy is not installed")
+class TestSemanticCache(unittest.TestCase):
+    def test_paraphrase_hit(self):
+        """测试相似问法命中，不相关的问题和其他应用不命中"""
+        cache = SemanticCache(max_size=10)
+        cache.add("app", "怎么使用这个机器人", "发送消息即可")
+        result = cache.lookup("app", "这个机器人怎么使用")
+        self.assertIsNotNone(result)
+        self.assertEqual(result[0], "发送消息即可")
+        self.assertIsNone(cache.lookup("app", "今天天气怎么样"))
+        self.assertIsNone(cache.lookup("other", "怎么使用这个机器人"))
+
+    def test_exact_tokens(self):
+        """测试只差数字或字母的问题不命中"""
+        cache = SemanticCache(max_size=10)
+        cache.add("app", "what is the price of plan a", "99元")
+        cache.add("app", "订单123456的物流状态", "已发货")
+        self.assertIsNone(cache.lookup("app", "what is the price of plan b"))
+        self.assertIsNone(cache.lookup("app", "订单123457的物流状态"))
+        self.assertEqual(cache.lookup("app", "what is the price of  plan a")[0], "99元")
+        self.assertEqual(cache.lookup("app", "订单123456物流状态")[0], "已发货")
+
+    def test_namespace_not_hidden(self):
+        """测试其他应用中更相似的条目不会挤掉当前应用的匹配"""
+        cache = SemanticCache(max_size=20)
+        for i in range(10):
+            cache.add("other", "怎么使用这个机器人", str(i))
+        cache.add("app", "这个机器人怎么使用", "app")
+        self.assertEqual(cache.lookup("app", "怎么使用这个机器人")[0], "app")
+
+    def test_ring_buffer(self):
+        """测试超出容量时覆盖最早的条目"""
+        cache = SemanticCache(max_size=2)
+        for i, question in enumerate(["支持哪些模型", "怎么开通会员", "如何联系客服"]):
+            cache.add("app", question, str(i))
+        self.assertIsNone(cache.lookup("app", "支持哪些模型"))
+        self.assertEqual(cache.lookup("app", "如何联系客服")[0], "2")
+
+    def test_save_and_load(self):
+        """测试索引保存后重新加载，容量变小时保留最新的条目"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "index.npz")
+            cache = SemanticCache(path, max_size=3)
+            for i, question in enumerate(["支持哪些模型", "怎么开通会员", "如何联系客服", "怎么使用这个机器人"]):
+                cache.add("app", question, str(i))
+            cache.save()
+            loaded = SemanticCache(path, max_size=2)
+            self.assertEqual(loaded.count, 2)
+            self.assertIsNone(loaded.lookup("app", "怎么开通会员"))
+            self.assertEqual(loaded.lookup("app", "如何联系客服")[0], "2")
+            self.assertEqual(loaded.lookup("app", "怎么使用这个机器人")[0], "3")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+from common.session_store import SqliteSessionStore
+
+
+class TestSqliteSessionStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "sessions.db")
+        self.store = SqliteSessionStore(self.path, flush_interval=60)
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+
+    def test_write_behind(self):
+        """测试未写入前能读到待写数据，多次修改只写最后一次"""
+        self.store.save("ns", "a", {"messages": [1]})
+        self.store.save("ns", "a", {"messages": [1, 2]})
+        self.assertEqual(self.store.load("ns", "a")[0], {"messages": [1, 2]})
+        self.assertEqual(self.store.get_stats()["pending"], 1)
+        self.store.flush()
+        self.assertEqual(self.store.get_stats()["writes"], 1)
+        self.assertEqual(self.store.load("ns", "a")[0], {"messages": [1, 2]})
+        self.assertIsNone(self.store.load("other", "a"))
+
+    def test_delete_and_reopen(self):
+        """测试删除、清空和重新打开后数据仍在"""
+        self.store.save("ns", "a", {"v": 1})
+        self.store.save("ns", "b", {"v": 2})
+        self.store.delete("ns", "a")
+        self.assertIsNone(self.store.load("ns", "a"))
+        self.store.close()
+        self.store = SqliteSessionStore(self.path, flush_interval=60)
+        self.assertIsNone(self.store.load("ns", "a"))
+        self.assertEqual(self.store.load("ns", "b")[0], {"v": 2})
+        self.store.clear("ns")
+        self.assertIsNone(self.store.load("ns", "b"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,247 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+import config
+from bridge.context import Context, ContextType
+from common.dequeue import Dequeue
+from common.shared_state import _INCR_SCRIPT, LocalSharedState, RedisSharedState
+
+
+class FakeRedis(object):
+    """本地替身，实现RedisSharedState用到的redis-py接口（decode_responses=True）"""
+
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+        self.lock = threading.Lock()
+
+    def _check(self, key):
+        if key in self.expiry and self.expiry[key] <= time.monotonic():
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+
+    def set(self, key, value, nx=False, ex=None):
+        with self.lock:
+            self._check(key)
+            if nx and key in self.data:
+                return None
+            self.data[key] = value
+            self.expiry.pop(key, None)
+            if ex:
+                self.expiry[key] = time.monotonic() + ex
+            return True
+
+    def get(self, key):
+        with self.lock:
+            self._check(key)
+            return self.data.get(key)
+
+    def delete(self, key):
+        with self.lock:
+            self.expiry.pop(key, None)
+            return 1 if self.data.pop(key, None) is not None else 0
+
+    def incr(self, key):
+        with self.lock:
+            self._check(key)
+            self.data[key] = str(int(self.data.get(key, 0)) + 1)
+            return int(self.data[key])
+
+    def expire(self, key, seconds):
+        with self.lock:
+            self.expiry[key] = time.monotonic() + seconds
+
+    def rpush(self, key, value):
+        with self.lock:
+            self._check(key)
+            self.data.setdefault(key, []).append(value)
+
+    def lpop(self, key):
+        with self.lock:
+            self._check(key)
+            values = self.data.get(key)
+            if not values:
+                return None
+            value = values.pop(0)
+            if not values:
+                del self.data[key]
+            return value
+
+    def llen(self, key):
+        with self.lock:
+            self._check(key)
+            return len(self.data.get(key, []))
+
+    def ttl(self, key):
+        with self.lock:
+            self._check(key)
+            if key not in self.data:
+                return -2
+            return int(self.expiry[key] - time.monotonic()) if key in self.expiry else -1
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def eval(self, script, numkeys, key, arg):
+        # 只支持自增并设置过期时间、释放锁两个脚本
+        if script == _INCR_SCRIPT:
+            value = self.incr(key)
+            if self.ttl(key) < 0:
+                self.expire(key, int(arg))
+            return value
+        with self.lock:
+            if self.data.get(key) == arg:
+                del self.data[key]
+                return 1
+            return 0
+
+
+class FakePipeline(object):
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+class SharedStateCases(object):
+    def test_add_if_absent(self):
+        """测试去重"""
+        self.assertTrue(self.state.add_if_absent("msg:1"))
+        self.assertFalse(self.state.add_if_absent("msg:1"))
+        self.assertTrue(self.state.add_if_absent("msg:2"))
+
+    def test_list_and_counter(self):
+        """测试被动回复缓存和请求计数"""
+        self.assertEqual(self.state.length("reply"), 0)
+        self.state.push("reply", ["text", "a"])
+        self.state.push("reply", ["voice", "b"])
+        self.assertEqual(self.state.length("reply"), 2)
+        self.assertEqual(self.state.pop("reply"), ["text", "a"])
+        self.assertEqual(self.state.pop("reply"), ["voice", "b"])
+        self.assertIsNone(self.state.pop("reply"))
+        self.assertEqual(self.state.incr("cnt"), 1)
+        self.assertEqual(self.state.incr("cnt"), 2)
+        self.state.delete("cnt")
+        self.assertIsNone(self.state.get("cnt"))
+
+    def test_lock(self):
+        """测试锁互斥，只能由持有者释放"""
+        token = self.state.acquire_lock("session:a", ttl=10)
+        self.assertIsNotNone(token)
+        self.assertIsNone(self.state.acquire_lock("session:a", ttl=10, timeout=0.05))
+        self.state.release_lock("session:a", "other")
+        self.assertIsNone(self.state.acquire_lock("session:a", ttl=10, timeout=0.05))
+        self.state.release_lock("session:a", token)
+        with self.state.lock("session:a", ttl=10, timeout=0.05) as acquired:
+            self.assertTrue(acquired)
+
+    def test_lock_serializes(self):
+        """测试多个线程争用同一把锁时串行执行"""
+        running = []
+        overlaps = []
+
+        def worker():
+            with self.state.lock("session:b", ttl=10):
+                running.append(1)
+                if len(running) > 1:
+                    overlaps.append(1)
+                time.sleep(0.01)
+                running.pop()
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(overlaps, [])
+
+
+class TestLocalSharedState(SharedStateCases, unittest.TestCase):
+    def setUp(self):
+        self.state = LocalSharedState()
+
+
+class TestRedisSharedState(SharedStateCases, unittest.TestCase):
+    def setUp(self):
+        self.state = RedisSharedState(FakeRedis())
+
+    def test_expire(self):
+        """测试计数和列表写入时同时设置过期时间，计数的过期时间不随自增延长"""
+        client = self.state.client
+        self.state.incr("cnt", ttl=100)
+        client.expire("dow:cnt", 10)
+        self.state.incr("cnt", ttl=100)
+        self.assertLessEqual(client.ttl("dow:cnt"), 10)
+        client.expiry.clear()
+        self.state.incr("cnt", ttl=100)
+        self.assertGreater(client.ttl("dow:cnt"), 10)
+        self.state.push("reply", "a", ttl=100)
+        self.assertGreater(client.ttl("dow:reply"), 10)
+
+
+class TestSessionLock(unittest.TestCase):
+    def setUp(self):
+        from channel.gewechat.gewechat_channel import GeWeChatChannel
+
+        self.backup = dict(config.config)
+        config.config["shared_state_lock_wait"] = 0.05
+        self.channel = GeWeChatChannel()
+        self.state = RedisSharedState(FakeRedis())
+        self.context = Context(ContextType.TEXT, "你好", {"session_id": "lock_test"})
+        with self.channel.lock:
+            self.channel.sessions["lock_test"] = [Dequeue(), threading.BoundedSemaphore(1)]
+        self.token = self.state.acquire_lock("session:x", ttl=10)
+        patches = [
+            ("channel.chat_channel.get_shared_state", lambda: self.state),
+            ("channel.chat_channel.ChatChannel._session_lock_key", lambda _, context: "session:x"),
+        ]
+        for target, value in patches:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        with self.channel.lock:
+            self.channel.sessions.pop("lock_test", None)
+        config.config.clear()
+        config.config.update(self.backup)
+
+    def assert_requeued(self):
+        queue = self.channel.sessions["lock_test"][0]
+        self.assertEqual(queue.qsize(), 1)
+        self.assertIs(queue.get_nowait()[1], self.context)
+
+    def test_requeue(self):
+        """测试会话锁被其他进程持有时等待有限时间后把消息放回会话队列，不处理消息"""
+        with mock.patch.object(self.channel, "_handle") as handle:
+            self.assertIsNone(self.channel._handle_in_session(self.context))
+        handle.assert_not_called()
+        self.assert_requeued()
+
+    def test_requeue_async(self):
+        """测试异步处理时同样不会一直等待会话锁"""
+        with mock.patch.object(self.channel, "_handle_async") as handle:
+            self.assertIsNone(asyncio.run(self.channel._handle_in_session_async(self.context)))
+        handle.assert_not_called()
+        self.assert_requeued()
+
+    def test_acquire_after_release(self):
+        """测试锁在等待期间被释放后正常处理"""
+        threading.Timer(0.01, self.state.release_lock, ("session:x", self.token)).start()
+        config.config["shared_state_lock_wait"] = 5
+        with mock.patch.object(self.channel, "_handle", return_value="ok"):
+            self.assertEqual(self.channel._handle_in_session(self.context), "ok")
+        self.assertEqual(self.channel.sessions["lock_test"][0].qsize(), 0)
+        self.assertIsNone(self.state.get("session:x"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+import unittest
+
+import config
+from bridge.bridge import Bridge
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from common.singleflight import Group, get_group
+from config import conf
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_result(self):
+        """测试同时进行的相同请求只执行一次，所有调用得到同一结果"""
+        group = Group()
+        calls = []
+        results = []
+
+        def fetch(key):
+            calls.append(key)
+            time.sleep(0.2)
+            return "summary of " + key
+
+        threads = [threading.Thread(target=lambda: results.append(group.do("url", fetch, "url"))) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(calls, ["url"])
+        self.assertEqual({result for result, _ in results}, {"summary of url"})
+        self.assertEqual(sum(1 for _, shared in results if shared), 4)
+        self.assertEqual(group.get_stats()["inflight"], 0)
+
+    def test_not_cached_after_finish(self):
+        """测试请求完成后不保留结果，不同key互不影响"""
+        group = Group()
+        self.assertEqual(group.do("a", lambda: 1), (1, False))
+        self.assertEqual(group.do("a", lambda: 2), (2, False))
+        self.assertEqual(group.do("b", lambda: 3), (3, False))
+
+    def test_error_propagates(self):
+        """测试异常传给所有等待者，之后的请求重新执行"""
+        group = Group()
+        started = threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError("upstream error")
+
+        def wait():
+            started.wait()
+            try:
+                group.do("k", fail)
+            except ValueError as e:
+                errors.append(e)
+
+        follower = threading.Thread(target=wait)
+        follower.start()
+        with self.assertRaises(ValueError):
+            group.do("k", fail)
+        follower.join()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(group.do("k", lambda: "ok"), ("ok", False))
+
+    def test_async(self):
+        """测试协程调用合并"""
+        group = Group()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "reply"
+
+        async def main():
+            return await asyncio.gather(*[group.do_async("q", fetch) for _ in range(3)])
+
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result for result, _ in results], ["reply"] * 3)
+
+
+class FakeBot(object):
+    def __init__(self, reply_type):
+        self.reply_type = reply_type
+        self.calls = 0
+
+    def reply(self, query, context):
+        self.calls += 1
+        if self.calls == 1:
+            # 等另一个请求加入后再返回
+            shared = get_group("bridge").get_stats()["shared"]
+            for _ in range(500):
+                if get_group("bridge").get_stats()["shared"] > shared:
+                    break
+                time.sleep(0.01)
+        return Reply(self.reply_type, "tmp/reply.mp3" if self.reply_type == ReplyType.VOICE else "answer")
+
+
+class TestBridgeSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.backup = dict(config.config)
+        self.bridge = Bridge()
+        conf()["singleflight"] = True
+        conf()["reply_cache"] = False
+        conf()["semantic_cache"] = False
+        conf()["stream_reply"] = False
+        conf()["reply_cache_apps"] = [self.bridge.btype["chat"]]
+
+    def tearDown(self):
+        config.config.clear()
+        config.config.update(self.backup)
+        self.bridge.bots.pop("chat", None)
+
+    def _fetch_concurrently(self, bot):
+        self.bridge.bots["chat"] = bot
+        results = []
+
+        def fetch():
+            results.append(self.bridge.fetch_reply_content("怎么用", Context(ContextType.TEXT, "怎么用", {})))
+
+        threads = [threading.Thread(target=fetch) for _ in range(2)]
+        for t in threads:
+            t.start()
+            time.sleep(0.05)
+        for t in threads:
+            t.join()
+        return results
+
+    def test_share_text(self):
+        """测试同时进行的相同问题只请求一次bot，每个提问者得到各自的文本回复"""
+        bot = FakeBot(ReplyType.TEXT)
+        results = self._fetch_concurrently(bot)
+        self.assertEqual(bot.calls, 1)
+        self.assertEqual([reply.content for reply in results], ["answer", "answer"])
+        self.assertIsNot(results[0], results[1])
+
+    def test_not_share_file(self):
+        """测试语音等文件回复不共享，等待者自己请求bot"""
+        bot = FakeBot(ReplyType.VOICE)
+        results = self._fetch_concurrently(bot)
+        self.assertEqual(bot.calls, 2)
+        self.assertEqual([reply.type for reply in results], [ReplyType.VOICE, ReplyType.VOICE])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import json
+import unittest
+
+import config
+from bot.stream_reply import StreamReplySender, can_send_partial, iter_chunk_deltas, iter_sse_deltas, stream_completion
+from bridge.context import Context, ContextType
+from bridge.reply import ReplyType
+from channel.chat_channel import ChatChannel
+from config import conf
+
+
+class FakeResponse(object):
+    def __init__(self, chunks):
+        self.lines = [("data: " + json.dumps(chunk)).encode("utf-8") for chunk in chunks] + [b"", b"data: [DONE]"]
+
+    def iter_lines(self):
+        return iter(self.lines)
+
+
+class FakeChannel(ChatChannel):
+    channel_type = "test"
+    SUPPORT_STREAM_REPLY = True
+    NOT_SUPPORT_REPLYTYPE = []
+
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def send(self, reply, context):
+        self.sent.append(reply)
+
+
+channel = FakeChannel()
+
+
+def delta(text):
+    return {"choices": [{"delta": {"content": text}}]}
+
+
+class TestStreamReply(unittest.TestCase):
+    def setUp(self):
+        self.backup = dict(config.config)
+        conf()["stream_min_segment_length"] = 5
+        conf()["single_chat_reply_prefix"] = ""
+        conf()["single_chat_reply_suffix"] = ""
+        self.channel = channel
+        self.channel.sent = []
+        self.channel.SUPPORT_STREAM_REPLY = True
+        self.context = Context(ContextType.TEXT, "", {"channel": self.channel, "isgroup": False})
+
+    def tearDown(self):
+        config.config.clear()
+        config.config.update(self.backup)
+
+    def test_parse_deltas(self):
+        """测试解析SSE和SDK的流式分块"""
+        response = FakeResponse([{"choices": [{"delta": {"role": "assistant"}}]}, delta("你好"), delta("，世界")])
+        self.assertEqual(list(iter_sse_deltas(response)), ["你好", "，世界"])
+        self.assertEqual(list(iter_chunk_deltas([delta("a"), {"choices": []}, delta("b")])), ["a", "b"])
+
+    def test_send_segments(self):
+        """测试完整的句子立即发送，最后一段作为最终回复"""
+        result = stream_completion(iter(["第一句话说完了。", "第二句", "话也说完了。", "最后一句"]), self.context)
+        self.assertEqual([reply.content for reply in self.channel.sent], ["第一句话说完了。", "第二句话也说完了。"])
+        self.assertEqual(result["final_reply"].type, ReplyType.TEXT)
+        self.assertEqual(result["final_reply"].content, "最后一句")
+        self.assertEqual(result["content"], "第一句话说完了。第二句话也说完了。最后一句")
+
+    def test_decorate_segments(self):
+        """测试中间的分段和最终回复一样经过channel的装饰"""
+        conf()["single_chat_reply_prefix"] = "[bot] "
+        result = stream_completion(iter(["第一句话说完了。", "最后一句"]), self.context)
+        self.assertEqual([reply.content for reply in self.channel.sent], ["[bot] 第一句话说完了。"])
+        self.assertEqual(result["final_reply"].content, "最后一句")  # 最终回复由channel按正常流程装饰
+
+    def test_interrupted_after_send(self):
+        """测试已经发送过分段后出错时用已收到的内容结束，未发送时抛出异常以便重试"""
+
+        def broken_stream(texts):
+            yield from texts
+            raise IOError("connection reset")
+
+        sender = StreamReplySender(self.context)
+        sender.consume(broken_stream(["第一句话说完了。", "第二句话说完了。", "第三"]))
+        self.assertEqual(len(self.channel.sent), 1)
+        self.assertEqual(sender.finish().content, "第三")
+
+        sender = StreamReplySender(self.context)
+        with self.assertRaises(IOError):
+            sender.consume(broken_stream(["没有结束"]))
+
+    def test_dify_error_after_send(self):
+        """测试dify流式回复已经发送过分段后收到error事件时用已收到的内容结束，未发送时抛出异常"""
+        from bot.dify.dify_bot import DifyBot
+        from bot.dify.dify_session import DifySession
+
+        def message(answer):
+            return {"event": "message", "conversation_id": "c1", "answer": answer}
+
+        error = {"event": "error", "status": 500, "message": "model error"}
+        session = DifySession("s1", "user")
+        bot = DifyBot.__new__(DifyBot)
+        response = FakeResponse([message("第一句话说完了。"), message("第二句话说完了。"), message("第三"), error])
+        reply, err = bot._handle_stream_response(response, session, self.context)
+        self.assertIsNone(err)
+        self.assertEqual([reply.content for reply in self.channel.sent], ["第一句话说完了。", "第二句话说完了。"])
+        self.assertEqual(reply.content, "第三")
+        self.assertEqual(session.get_conversation_id(), "c1")
+
+        with self.assertRaises(Exception):
+            bot._handle_stream_response(FakeResponse([message("没有结束"), error]), DifySession("s2", "user"), self.context)
+
+    def test_can_send_partial(self):
+        """测试不支持多条消息的channel不使用流式回复"""
+        self.assertTrue(can_send_partial(self.context))
+        self.channel.SUPPORT_STREAM_REPLY = False
+        self.assertFalse(can_send_partial(self.context))
+        self.assertFalse(can_send_partial(Context(ContextType.TEXT, "", {})))
+
+
+if __name__ == "__main__":
+    unittest.main()
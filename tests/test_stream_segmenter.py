@@ -0,0 +1,54 @@
+import unittest
+
+from common.stream_segmenter import StreamSegmenter
+
+
+def feed_all(segmenter, text, step=1):
+    items = []
+    for i in range(0, len(text), step):
+        items.extend(segmenter.feed(text[i : i + step]))
+    return items, segmenter.flush()
+
+
+class TestStreamSegmenter(unittest.TestCase):
+    def test_sentence_split(self):
+        """测试按句子边界分段，剩余内容在flush时输出"""
+        items, rest = feed_all(StreamSegmenter(min_length=5), "这是第一句话。这是第二句话！最后一句")
+        self.assertEqual(items, [{"type": "text", "content": "这是第一句话。"}, {"type": "text", "content": "这是第二句话！"}])
+        self.assertEqual(rest, [{"type": "text", "content": "最后一句"}])
+
+    def test_min_length(self):
+        """测试短句会与后面的句子合并"""
+        items, rest = feed_all(StreamSegmenter(min_length=10), "好的。我来回答这个问题。")
+        self.assertEqual(items, [{"type": "text", "content": "好的。我来回答这个问题。"}])
+        self.assertEqual(rest, [])
+
+    def test_link_not_split(self):
+        """测试图片和文件链接在生成完整前不会被切断"""
+        items, rest = feed_all(StreamSegmenter(min_length=1), "看图![img](/files/a.png)和文件[f](https://x.com/b.pdf)")
+        self.assertEqual(
+            items,
+            [
+                {"type": "text", "content": "看图"},
+                {"type": "image", "content": "/files/a.png"},
+                {"type": "text", "content": "和文件"},
+                {"type": "file", "content": "https://x.com/b.pdf"},
+            ],
+        )
+        self.assertEqual(rest, [])
+
+    def test_same_as_parse_markdown_text(self):
+        """测试不同的分块方式得到相同的内容"""
+        text = "第一段内容。\n\n![image](/files/1.png)第二段，比较长的内容！结尾"
+        expected = None
+        for step in (1, 3, len(text)):
+            items, rest = feed_all(StreamSegmenter(min_length=1), text, step)
+            joined = [item["content"] for item in items + rest]
+            if expected is None:
+                expected = joined
+            self.assertEqual(joined, expected)
+        self.assertIn("/files/1.png", expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
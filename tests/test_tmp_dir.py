@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from bridge.reply import Reply, ReplyType
+from common.tmp_dir import TmpDir, TmpStore, reply_file
+
+
+class TestTmpStore(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = TmpStore(self.root, shards=16, max_age=100, max_size=0, clean_interval=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _write(self, name, size=10, age=0):
+        path = self.store.file(name)
+        with open(path, "wb") as f:
+            f.write(b"0" * size)
+        if age:
+            mtime = time.time() - age
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_file_sharding(self):
+        """测试相同文件名分到同一个子目录，且子目录已创建"""
+        path = self.store.file("a.mp3")
+        self.assertEqual(path, self.store.file("a.mp3"))
+        self.assertTrue(os.path.isdir(os.path.dirname(path)))
+        self.assertEqual(os.path.dirname(os.path.dirname(path)), self.root)
+        flat = TmpStore(self.root, shards=0, clean_interval=0)
+        self.assertEqual(flat.file("a.mp3"), flat.path() + "a.mp3")
+
+    def test_hold_and_release(self):
+        """测试最后一个引用释放时删除文件，临时目录外的文件不处理"""
+        path = self._write("reply.mp3")
+        self.assertTrue(self.store.hold(path))
+        self.assertTrue(self.store.hold(path))
+        self.store.release(path)
+        self.assertTrue(os.path.exists(path))
+        self.store.release(path)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.store.get_stats()["deleted_release"], 1)
+        self.assertFalse(self.store.hold(__file__))
+        self.store.release(__file__)
+        self.assertTrue(os.path.exists(__file__))
+
+    def test_clean_by_age(self):
+        """测试删除过期文件，被引用的文件保留"""
+        old = self._write("old.jpg", age=200)
+        held = self._write("held.jpg", age=200)
+        new = self._write("new.jpg")
+        self.store.hold(held)
+        deleted = self.store.clean()
+        self.assertEqual(deleted, {"age": 1, "size": 0})
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(held))
+        self.assertTrue(os.path.exists(new))
+        self.assertEqual(self.store.get_stats()["files"], 2)
+
+    def test_clean_by_size(self):
+        """测试超出总大小时从最旧的文件开始删除，跳过被引用和刚写入的文件"""
+        self.store.max_age = 0
+        self.store.max_size = 100
+        held = self._write("held.wav", size=40, age=300)
+        oldest = self._write("oldest.wav", size=40, age=200)
+        older = self._write("older.wav", size=40, age=100)
+        recent = self._write("recent.wav", size=40)
+        self.store.hold(held)
+        deleted = self.store.clean()
+        self.assertEqual(deleted, {"age": 0, "size": 2})
+        self.assertTrue(os.path.exists(held))
+        self.assertFalse(os.path.exists(oldest))
+        self.assertFalse(os.path.exists(older))
+        self.assertTrue(os.path.exists(recent))
+        self.assertEqual(self.store.get_stats()["bytes"], 80)
+        self.store.max_size = 50
+        self.assertEqual(self.store.clean(), {"age": 0, "size": 0})
+        self.assertTrue(os.path.exists(recent))
+
+    def test_reply_file(self):
+        """测试只有文件类回复返回本地路径"""
+        self.assertEqual(reply_file(Reply(ReplyType.VOICE, "tmp/a.mp3")), "tmp/a.mp3")
+        self.assertIsNone(reply_file(Reply(ReplyType.TEXT, "hello")))
+        self.assertIsNone(reply_file(None))
+
+
+class TestReplyFileRelease(unittest.TestCase):
+    def test_release_when_retry_not_submitted(self):
+        """测试发送重试无法提交到线程池时释放回复的临时文件"""
+        from channel.gewechat.gewechat_channel import GeWeChatChannel
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        store = TmpStore(root, clean_interval=0)
+        pool = mock.Mock()
+        pool.submit_with_priority.side_effect = RuntimeError("cannot schedule new futures after shutdown")
+        with mock.patch("common.tmp_dir._store", store), mock.patch("channel.chat_channel.handler_pool", pool):
+            reply = Reply(ReplyType.VOICE, TmpDir().file("reply.mp3"))
+            open(reply.content, "wb").close()
+            TmpDir().hold_reply(reply)
+            GeWeChatChannel()._submit_retry(reply, None, 1)
+        self.assertFalse(os.path.exists(reply.content))
+        self.assertEqual(store.get_stats()["held"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
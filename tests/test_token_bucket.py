@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from common.token_bucket import KeyedTokenBucket, TokenBucket, get_token_bucket
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_lazy_refill(self):
+        """测试按经过的时间补充令牌，且不超过容量"""
+        now = [100.0]
+        with mock.patch("common.token_bucket.time.monotonic", lambda: now[0]):
+            bucket = TokenBucket(60, timeout=0, capacity=2)  # 每秒1个
+            self.assertTrue(bucket.get_token())
+            self.assertFalse(bucket.get_token())
+            now[0] += 1
+            self.assertTrue(bucket.get_token())
+            now[0] += 10
+            self.assertTrue(bucket.try_acquire())
+            self.assertTrue(bucket.try_acquire())
+            self.assertFalse(bucket.try_acquire())
+
+    def test_wait_for_token(self):
+        """测试令牌不足时等待，超时返回False"""
+        bucket = TokenBucket(600, timeout=1)  # 每0.1秒1个
+        start = time.monotonic()
+        self.assertTrue(bucket.get_token())
+        self.assertTrue(bucket.get_token())
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        bucket = TokenBucket(1, timeout=0.1)
+        self.assertTrue(bucket.get_token())
+        self.assertFalse(bucket.get_token())
+
+    def test_async_acquire(self):
+        """测试异步获取令牌"""
+        bucket = TokenBucket(600)
+
+        async def acquire_twice():
+            return await bucket.acquire() and await bucket.acquire()
+
+        self.assertTrue(asyncio.run(acquire_twice()))
+
+    def test_keyed_and_registry(self):
+        """测试按key限流和共享注册"""
+        buckets = KeyedTokenBucket(1, timeout=0)
+        self.assertTrue(buckets.get_token("user1"))
+        self.assertFalse(buckets.get_token("user1"))
+        self.assertTrue(buckets.get_token("user2"))
+        self.assertIs(get_token_bucket("test", 20), get_token_bucket("test", 20))
+        self.assertIsNot(get_token_bucket("test", 20), get_token_bucket("test", 30))
+
+    def test_no_thread(self):
+        """测试创建令牌桶不会启动线程"""
+        count = threading.active_count()
+        buckets = [TokenBucket(20) for _ in range(10)]
+        self.assertEqual(threading.active_count(), count)
+        self.assertEqual(len(buckets), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
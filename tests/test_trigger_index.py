@@ -0,0 +1,44 @@
+import random
+import unittest
+
+from channel.chat_channel import check_contain, check_prefix
+from channel.trigger_index import KeywordMatcher, NameMatcher, PrefixMatcher, mention_pattern
+
+
+class TestTriggerIndex(unittest.TestCase):
+    def test_prefix_order(self):
+        """测试返回列表中最靠前的匹配前缀"""
+        self.assertEqual(PrefixMatcher(["@bot", "@b"]).match("@bot 你好"), "@bot")
+        self.assertEqual(PrefixMatcher(["@b", "@bot"]).match("@bot 你好"), "@b")
+        self.assertEqual(PrefixMatcher(["bot", ""]).match("你好"), "")
+        self.assertIsNone(PrefixMatcher(["bot"]).match("你好"))
+        self.assertIsNone(PrefixMatcher(None).match("你好"))
+
+    def test_keyword(self):
+        """测试关键词包含匹配"""
+        matcher = KeywordMatcher(["she", "he", "hers", "机器人"])
+        self.assertTrue(matcher.contains("ushers"))
+        self.assertTrue(matcher.contains("我是机器人"))
+        self.assertIsNone(matcher.contains("机器"))
+        self.assertIsNone(KeywordMatcher([]).contains("hello"))
+
+    def test_same_as_list_scan(self):
+        """测试与原有的列表遍历结果一致"""
+        rng = random.Random(0)
+        alphabet = "ab@机器"
+        for _ in range(300):
+            words = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 3))) for _ in range(rng.randint(0, 5))]
+            content = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 8)))
+            self.assertEqual(PrefixMatcher(words).match(content), check_prefix(content, words))
+            self.assertEqual(KeywordMatcher(words).contains(content), check_contain(content, words))
+
+    def test_name_and_mention(self):
+        """测试名单和@正则"""
+        self.assertIn("任意群", NameMatcher(["ALL_GROUP"]))
+        self.assertNotIn("群2", NameMatcher(["群1"]))
+        self.assertEqual(mention_pattern("bot").sub("", "@bot 你好"), "你好")
+        self.assertIs(mention_pattern("bot"), mention_pattern("bot"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import threading
+import unittest
+
+from common.worker_pool import PRIORITY_ADMIN, PRIORITY_PLUGIN, PoolBusyError, PriorityThreadPool
+
+
+class TestPriorityThreadPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = PriorityThreadPool(1, max_backlog=2, name="test_pool")
+        self.gate = threading.Event()
+        started = threading.Event()
+        # 占住唯一的工作线程，后续任务都进入积压队列
+        self.pool.submit(lambda: started.set() or self.gate.wait())
+        started.wait(5)
+
+    def tearDown(self):
+        self.gate.set()
+        self.pool.shutdown()
+
+    def test_priority_order(self):
+        """测试高优先级任务先执行"""
+        order = []
+        futures = [
+            self.pool.submit(order.append, "normal"),
+            self.pool.submit_with_priority(PRIORITY_PLUGIN, order.append, "plugin"),
+            self.pool.submit_with_priority(PRIORITY_ADMIN, order.append, "admin"),
+        ]
+        self.gate.set()
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual(order, ["admin", "plugin", "normal"])
+
+    def test_backlog_limit(self):
+        """测试积压队列满时拒绝普通任务，但不拒绝管理命令"""
+        self.pool.submit(int)
+        self.pool.submit(int)
+        with self.assertRaises(PoolBusyError):
+            self.pool.submit(int)
+        future = self.pool.submit_with_priority(PRIORITY_ADMIN, int, "1")
+        self.gate.set()
+        self.assertEqual(future.result(timeout=5), 1)
+        self.assertEqual(self.pool.get_stats()["rejected"], 1)
+
+
+class TestPoolConcurrency(unittest.TestCase):
+    def test_burst_runs_in_parallel(self):
+        """测试只有一个空闲线程时连续提交的任务也会启动新线程并行执行"""
+        pool = PriorityThreadPool(8, name="burst_pool")
+        try:
+            pool.submit(int).result(timeout=5)  # 预热一个工作线程，任务结束后空闲
+            barrier = threading.Barrier(4, timeout=5)  # 4个任务必须同时运行才能通过
+            futures = [pool.submit(barrier.wait) for _ in range(4)]
+            for future in futures:
+                future.result(timeout=10)
+            self.assertGreaterEqual(pool.get_stats()["workers"], 4)
+        finally:
+            pool.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
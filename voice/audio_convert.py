@@ -1,24 +1,14 @@
+"""
+音频格式转换
+pydub、pilk、pysilk在转换时才导入，未使用语音功能时不影响启动速度，缺少依赖时转换会抛出ImportError
+"""
+
 import os
 import shutil
 import wave
 
 from common.log import logger
 
-try:
-    import pysilk
-except ImportError:
-    logger.debug("import pysilk failed, wechaty voice message will not be supported.")
-
-try:
-    from pydub import AudioSegment
-except ImportError:
-    logger.warning("import pydub failed, wechat voice conversion will not be supported. Try: pip install pydub")
-
-try:
-    import pilk
-except ImportError:
-    logger.warning("import pilk failed, silk voice conversion will not be supported. Try: pip install pilk")
-
 sil_supports = [8000, 12000, 16000, 24000, 32000, 44100, 48000]  # slk转wav时，支持的采样率
 
 
@@ -62,10 +52,12 @@ def any_to_mp3(any_path, mp3_path):
         if any_path.endswith(".mp3"):
             shutil.copy2(any_path, mp3_path)
             return
-        
+        from pydub import AudioSegment
+
         # 如果是silk格式，使用pilk转换
         if any_path.endswith((".sil", ".silk", ".slk")):
             # 先转成PCM
+            import pilk
             pcm_path = any_path + '.pcm'
             pilk.decode(any_path, pcm_path)
             
@@ -100,6 +92,8 @@ def any_to_wav(any_path, wav_path):
         return
     if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
         return sil_to_wav(any_path, wav_path)
+    from pydub import AudioSegment
+
     audio = AudioSegment.from_file(any_path)
     audio.set_frame_rate(8000)    # 百度语音转写支持8000采样率, pcm_s16le, 单通道语音识别
     audio.set_channels(1)
@@ -113,6 +107,9 @@ def any_to_sil(any_path, sil_path):
     if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
         shutil.copy2(any_path, sil_path)
         return 10000
+    import pysilk
+    from pydub import AudioSegment
+
     audio = AudioSegment.from_file(any_path)
     rate = find_closest_sil_supports(audio.frame_rate)
     # Convert to PCM_s16
@@ -132,6 +129,8 @@ def mp3_to_silk(mp3_path: str, silk_path: str) -> int:
     Returns:
         Duration of the SILK file in milliseconds
     """
+    import pilk
+    from pydub import AudioSegment
     # First load the MP3 file
     audio = AudioSegment.from_file(mp3_path)
     
@@ -163,6 +162,8 @@ def any_to_amr(any_path, amr_path):
         return
     if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
         raise NotImplementedError("Not support file type: {}".format(any_path))
+    from pydub import AudioSegment
+
     audio = AudioSegment.from_file(any_path)
     audio = audio.set_frame_rate(8000)  # only support 8000
     audio.export(amr_path, format="amr")
@@ -173,6 +174,7 @@ def sil_to_wav(silk_path, wav_path, rate: int = 24000):
     """
     silk 文件转 wav
     """
+    import pysilk
     wav_data = pysilk.decode_file(silk_path, to_wav=True, sample_rate=rate)
     with open(wav_path, "wb") as f:
         f.write(wav_data)
@@ -182,6 +184,7 @@ def split_audio(file_path, max_segment_length_ms=60000):
     """
     分割音频文件
     """
+    from pydub import AudioSegment
     audio = AudioSegment.from_file(file_path)
     audio_length_ms = len(audio)
     if audio_length_ms <= max_segment_length_ms:
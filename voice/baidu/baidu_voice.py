@@ -83,7 +83,7 @@ class BaiduVoice(Voice):
         )
         if not isinstance(result, dict):
             # Avoid the same filename under multithreading
-            fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
+            fileName = TmpDir().file("reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3")
             with open(fileName, "wb") as f:
                 f.write(result)
             logger.info("[Baidu] textToVoice text={} voice file name={}".format(text, fileName))
@@ -1,7 +1,8 @@
 import os
-import requests
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common import http_client
+from common.tmp_dir import TmpDir
 from config import conf
 from voice.voice import Voice
 from voice.audio_convert import any_to_mp3
@@ -25,7 +26,7 @@ class DifyVoice(Voice):
             headers = {
                 'Authorization': 'Bearer ' + conf().get("dify_api_key")
             }
-            response = requests.post(
+            response = http_client.post(
                 f'{conf().get("dify_api_base")}/audio-to-text',
                 headers=headers,
                 files=files
@@ -52,12 +53,12 @@ class DifyVoice(Voice):
                 'Authorization': 'Bearer ' + conf().get("dify_api_key")
             }
             #TODO: raise and log response
-            response = requests.post(
+            response = http_client.post(
                 f'{conf().get("dify_api_base")}/text-to-audio',
                 headers=headers,
                 json=data
             )
-            file_name = "tmp/" + datetime.datetime.now().strftime('%Y%m%d%H%M%S') + str(random.randint(0, 1000)) + ".mp3"
+            file_name = TmpDir().file(datetime.datetime.now().strftime('%Y%m%d%H%M%S') + str(random.randint(0, 1000)) + ".mp3")
             with open(file_name, 'wb') as f:
                 f.write(response.content)
             logger.info("[DIFY VOICE] textToVoice success, file_name={}".format(file_name))
@@ -42,7 +42,7 @@ class EdgeVoice(Voice):
         await communicate.save(fileName)
 
     def textToVoice(self, text):
-        fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
+        fileName = TmpDir().file("reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3")
 
         asyncio.run(self.gen_voice(text, fileName))
 
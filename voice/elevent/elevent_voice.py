@@ -26,7 +26,7 @@ class ElevenLabsVoice(Voice):
             voice=name,
             model='eleven_multilingual_v2'
         )
-        fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
+        fileName = TmpDir().file("reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3")
         save(audio, fileName)
         logger.info("[ElevenLabs] textToVoice text={} voice file name={}".format(text, fileName))
         return Reply(ReplyType.VOICE, fileName)
\ No newline at end of file
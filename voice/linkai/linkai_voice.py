@@ -2,13 +2,14 @@
 google voice service
 """
 import random
-import requests
 from voice import audio_convert
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from config import conf
 from voice.voice import Voice
 from common import const
+from common import http_client
+from common.tmp_dir import TmpDir
 import os
 import datetime
 
@@ -38,7 +39,7 @@ class LinkAIVoice(Voice):
             data = {
                 "model": model
             }
-            res = requests.post(url, files=file_body, headers=headers, data=data, timeout=(5, 60))
+            res = http_client.post(url, files=file_body, headers=headers, data=data, timeout=(5, 60))
             if res.status_code == 200:
                 text = res.json().get("text")
             else:
@@ -65,9 +66,9 @@ class LinkAIVoice(Voice):
                 "voice": conf().get("tts_voice_id"),
                 "app_code": conf().get("linkai_app_code")
             }
-            res = requests.post(url, headers=headers, json=data, timeout=(5, 120))
+            res = http_client.post(url, headers=headers, json=data, timeout=(5, 120))
             if res.status_code == 200:
-                tmp_file_name = "tmp/" + datetime.datetime.now().strftime('%Y%m%d%H%M%S') + str(random.randint(0, 1000)) + ".mp3"
+                tmp_file_name = TmpDir().file(datetime.datetime.now().strftime('%Y%m%d%H%M%S') + str(random.randint(0, 1000)) + ".mp3")
                 with open(tmp_file_name, 'wb') as f:
                     f.write(res.content)
                 reply = Reply(ReplyType.VOICE, tmp_file_name)
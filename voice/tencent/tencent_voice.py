@@ -105,7 +105,7 @@ class TencentVoice(Voice):
             response = client.TextToVoice(req)
             
             if response.Audio:
-                fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
+                fileName = TmpDir().file("reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3")
                 with open(fileName, "wb") as f:
                     f.write(base64.b64decode(response.Audio))
                 logger.info("[Tencent] textToVoice text={} voice file name={}".format(text, fileName))